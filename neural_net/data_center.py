@@ -15,10 +15,13 @@
 #  limitations under the License.
 
 import argparse
+import json
+import multiprocessing
 import logging
 import os 
 import sys
 import numpy as np
+import tensorflow as tf
 import time
 import copy
 
@@ -26,10 +29,19 @@ import copy
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 MOD_PATH = os.path.join(FILE_PATH, './mod')
 sys.path.append(MOD_PATH)
+import artifact
 import clean_data
 import common 
+import dataset
+import dataset_cache
+import input_pipeline
 import process_data
+import report
+import server
+import streaming
 import levenshtein_tools
+import lev_index
+import lev_matrix
 import character_rnn as rnn
 
 from collections import defaultdict
@@ -48,6 +60,11 @@ ch.setLevel(logging.DEBUG)
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
+# gen-stats --parallel puts in memory data here for the workers to map
+SHARED_DATA = 'SHARED_DATA.npy'
+SHARED_LABELS = 'SHARED_LABELS.npy'
+SHARED_RUNS = 'SHARED_RUNS.npy'
+
 
 def gen_data(args):
     """
@@ -62,13 +79,22 @@ def gen_data(args):
     clean_dir = args.output_data
     unclean_dir = args.target_data
     spy_data = args.spy_data
+    workers = args.workers
+    incremental = args.incremental
+    binary = args.binary
+    vocab = args.vocab
+    rle_len = args.rle_len
 
     # do some checks
     try: 
         assert length > 0, "len must be positive"
+        assert rle_len is None or rle_len > 0, "rle_len must be positive"
+        assert workers > 0, "workers must be positive"
         assert split <= 1.0 and split > 0, "split must be between 0-1"
         assert os.path.exists(clean_dir), "output_data dir must exist"
         assert os.path.exists(unclean_dir), "target_data dir must exist"
+        if binary:
+            assert os.path.exists(vocab), "vocab file must exist"
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
@@ -80,6 +106,20 @@ def gen_data(args):
         eval_file = clean_dir + "Eval.csv"
     else: 
         test_file = clean_dir + "Spy.csv"
+    manifest_file = clean_dir + "MANIFEST.json"
+
+    # run length encoded probes are rle_len runs long instead of len characters
+    rle = rle_len is not None
+    if rle:
+        length = rle_len
+
+    # only clean what changed since the last run
+    manifest = None
+    keep = None
+    if incremental:
+        manifest = clean_data.load_manifest(manifest_file, length, spy_data, rle)
+        # the cleaned probes have to outlast write_to_csv emptying clean_dir
+        keep = [os.path.basename(manifest['store'])]
 
     # get list of files 
     list_of_files = common.file_list(unclean_dir)
@@ -104,12 +144,380 @@ def gen_data(args):
 
     # process the data
     if spy_data == True: 
-        data, metadata = clean_data.clean_data(list_of_files, spy_data=True) 
+        data, metadata = clean_data.clean_data(list_of_files, spy_data=True, length=length, workers=workers, manifest=manifest, rle=rle) 
         logging.debug("DATA: {}".format(data))
-        clean_data.write_to_csv(data, metadata, clean_dir, test_file, length, spy_data=True)
+        spy_rows, _ = clean_data.write_to_csv(data, metadata, clean_dir, test_file, length, spy_data=True, rle=rle, keep=keep)
+        outputs = [(test_file, spy_rows)]
     else: 
-        data, metadata = clean_data.clean_data(list_of_files) 
-        clean_data.write_to_csv(data, metadata, clean_dir, train_file, length, split, eval_file, metadata_file)
+        data, metadata = clean_data.clean_data(list_of_files, length=length, workers=workers, manifest=manifest, rle=rle) 
+        train_rows, eval_rows = clean_data.write_to_csv(data, metadata, clean_dir, train_file, length, split, eval_file, metadata_file, rle=rle, keep=keep)
+        outputs = [(train_file, train_rows), (eval_file, eval_rows)]
+
+    # the same rows again in a form that can be memory mapped
+    if binary and outputs[0][1] is not None:
+        vocab_data = dataset.read_vocab(vocab)
+        label_map = None
+        if metadata is not None:
+            label_map = {value[1]: value[0] for value in metadata.values()}
+        for csv_file, rows in outputs:
+            labels = None if spy_data else [row[1] for row in rows]
+            runs = [row[2] for row in rows] if rle else None
+            dataset.write_dataset(dataset.dataset_prefix(csv_file), [row[0] for row in rows], labels, vocab_data, length, label_map, runs)
+
+    # write_to_csv empties clean_dir, so the manifest goes in last
+    if incremental:
+        clean_data.save_manifest(manifest, manifest_file)
+
+
+def cache(args):
+    """
+    Look at or empty the encoded dataset cache.
+
+    :param args: args for cache
+    :type args: Namespace
+    """
+    action = args.action
+
+    if action == 'stats':
+        info = dataset_cache.stats()
+        print("cache_dir: {}".format(info['cache_dir']))
+        print("entries: {}".format(info['entries']))
+        print("size: {:.1f} MB of {:.1f} MB".format(info['bytes'] / 1024.0 ** 2, info['max_bytes'] / 1024.0 ** 2))
+        print("oldest use: {}".format(info['oldest']))
+        print("newest use: {}".format(info['newest']))
+    elif action == 'clear':
+        removed = dataset_cache.clear()
+        print("removed {} entries".format(removed))
+
+
+def bench_clean(args):
+    """
+    Benchmark the probe tokenizer against the old regex cleaner.
+
+    :param args: args for bench_clean
+    :type args: Namespace
+    """
+    unclean_dir = args.target_data
+    length = args.len
+    repeat = args.repeat
+
+    # do some checks
+    try: 
+        assert os.path.exists(unclean_dir), "target_data dir must exist"
+        if length is not None:
+            assert length > 0, "len must be positive"
+        assert repeat > 0, "repeat must be positive"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    list_of_files = common.file_list(unclean_dir)
+    match = ['02_SESSION_INFO', '03_CPU_INFO']
+    list_of_files = [s for s in list_of_files if s['name'] not in match]
+
+    results = clean_data.benchmark(list_of_files, length, repeat)
+
+    print("files: {}".format(results['files']))
+    print("regex:  {:.4f}s".format(results['regex']))
+    print("stream: {:.4f}s".format(results['stream']))
+    print("speedup: {:.2f}x".format(results['regex'] / results['stream']))
+    if results['mismatch'] > 0:
+        print(TermColors.RED + "mismatched probes: {}".format(results['mismatch']) + TermColors.ENDC)
+
+
+def use_cpu(cpu, threads=None, inter_threads=None):
+    """
+    Pick the cpu model when asked to or when there is no GPU,
+    and size the thread pools for it.
+
+    :param cpu: the --cpu flag
+    :type cpu: bool
+    :param threads: intra op threads, defaults to None (one per core)
+    :type threads: int, optional
+    :param inter_threads: inter op threads, defaults to None
+    :type inter_threads: int, optional
+    :return: use the cpu model
+    :rtype: bool
+    """
+    if not cpu and not rnn.gpu_available():
+        logger.info("no GPU found, using the cpu model")
+        cpu = True
+    if cpu:
+        rnn.configure_threads(threads, inter_threads)
+    return cpu
+
+
+def bench_cpu(args):
+    """
+    Benchmark the cpu model, and the CuDNNGRU model if there is a GPU.
+
+    :param args: args for bench_cpu
+    :type args: Namespace
+    """
+    checkpoint_dir = args.checkpoint_dir
+    data_file = args.data_file
+    vocab = args.vocab
+    batch_size = args.batch_size
+    samples = args.samples
+    threads = args.threads
+    inter_threads = args.inter_threads
+
+    # do some checks
+    try: 
+        assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
+        assert os.path.exists(data_file), "data_file must exist"
+        assert os.path.exists(vocab), "vocab file must exist"
+        assert batch_size > 0, "batch_size must be positive"
+        assert samples > 0, "samples must be positive"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    data, _ = process_data.process_data(data_file, vocab, sparse=True)
+    vocab_len = rnn.checkpoint_vocab_len(checkpoint_dir)
+    input_len = data.shape[1]
+    gpu = rnn.gpu_available()
+    rnn.configure_threads(threads, inter_threads)
+
+    models = [('cpu (GRU)', True)]
+    if gpu:
+        models.append(('gpu (CuDNNGRU)', False))
+
+    for name, cpu in models:
+        model, _ = rnn.load_model(checkpoint_dir, vocab_len, input_len, cpu)
+        results = rnn.benchmark_inference(model, data, batch_size, samples)
+        print(name)
+        print("  latency p50: {:.2f}ms".format(results['latency_p50'] * 1000))
+        print("  latency p90: {:.2f}ms".format(results['latency_p90'] * 1000))
+        print("  throughput (batch {}): {:.1f} traces/s".format(batch_size, results['throughput']))
+
+    if not gpu:
+        print("no GPU found, skipped the CuDNNGRU model")
+
+
+def bench_model(args):
+    """
+    Compare training and inference speed of the model types on the same
+    data, and their accuracy when checkpoints are given.
+
+    :param args: args for bench_model
+    :type args: Namespace
+    """
+    data_file = args.data_file
+    vocab = args.vocab
+    batch_size = args.batch_size
+    train_steps = args.train_steps
+    samples = args.samples
+    cpu = args.cpu
+    checkpoints = {'gru': args.gru_checkpoint, 'tcn': args.tcn_checkpoint}
+
+    # do some checks
+    try: 
+        assert os.path.exists(data_file), "data_file must exist"
+        assert os.path.exists(vocab), "vocab file must exist"
+        assert batch_size > 0, "batch_size must be positive"
+        assert train_steps > 0, "train_steps must be positive"
+        assert samples > 0, "samples must be positive"
+        for model_type, checkpoint_dir in checkpoints.items():
+            if checkpoint_dir is not None:
+                assert os.path.exists(checkpoint_dir), "{} checkpoint must exist".format(model_type)
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    data, labels = process_data.process_data(data_file, vocab, sparse=True)
+    input_len = data.shape[1]
+    cpu = cpu or not rnn.gpu_available()
+
+    for model_type in rnn.MODEL_TYPES:
+        tf.keras.backend.clear_session()
+        vocab_len = len(dataset.read_vocab(vocab))
+        if checkpoints[model_type] is not None:
+            vocab_len = rnn.checkpoint_vocab_len(checkpoints[model_type])
+
+        model, model_summary = rnn.build_model(vocab_len, input_len, cpu, model_type=model_type, rle=data.ndim == 3)
+        model = rnn.compile_model(model, optimizer=tf.keras.optimizers.Nadam(), sparse=True)
+        train_speed = rnn.benchmark_training(model, data, labels, batch_size, train_steps)
+        results = rnn.benchmark_inference(model, data, batch_size, samples)
+
+        print("{}{}".format(model_type, " (cpu)" if cpu and model_type == 'gru' else ""))
+        print("  parameters: {}".format(model.count_params()))
+        print("  training: {:.1f} traces/s".format(train_speed))
+        print("  latency p50: {:.2f}ms".format(results['latency_p50'] * 1000))
+        print("  throughput (batch {}): {:.1f} traces/s".format(batch_size, results['throughput']))
+
+        if checkpoints[model_type] is not None:
+            tf.keras.backend.clear_session()
+            model, _ = rnn.load_model(checkpoints[model_type], vocab_len, input_len, cpu, model_type=model_type)
+            predictions = model.predict(data, batch_size=batch_size)
+            print("  accuracy: {:.4f}".format(np.mean(np.argmax(predictions, axis=1) == labels)))
+
+
+def stream_predict(args):
+    """
+    Classify a raw trace as it is read, stop once the model is sure enough.
+
+    :param args: args for stream_predict
+    :type args: Namespace
+    """
+    metadata_file = args.metadata_file
+    trace = args.trace
+    checkpoint_dir = args.checkpoint_dir
+    vocab = args.vocab
+    chunk = args.chunk
+    threshold = args.threshold
+    max_len = args.max_len
+    cpu = args.cpu
+    threads = args.threads
+    inter_threads = args.inter_threads
+
+    # do some checks
+    try: 
+        assert trace == '-' or os.path.exists(trace), "trace must exist (or - for stdin)"
+        assert os.path.exists(metadata_file), "metadata_file must exist"
+        assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
+        assert os.path.exists(vocab), "vocab file must exist"
+        assert chunk > 0, "chunk must be positive"
+        assert 0 < threshold <= 1, "threshold must be between 0 and 1"
+        assert max_len > 0, "max_len must be positive"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    cpu = use_cpu(cpu, threads, inter_threads)
+    target_dict = process_data.grab_metadata(metadata_file)
+    try:
+        model = streaming.load_streaming_model(checkpoint_dir, 1, cpu)
+    except ValueError as err:
+        logger.error(err)
+        return
+    classifier = streaming.StreamingClassifier(model, threshold, chunk, max_len)
+
+    start = time.time()
+    if trace == '-':
+        # os.read hands back whatever is there instead of waiting on a full chunk
+        fd = sys.stdin.fileno()
+        chunks = iter(lambda: os.read(fd, clean_data.CHUNK_SIZE).decode('utf-8', 'replace'), '')
+        result = streaming.classify_raw(classifier, chunks, dataset.read_vocab(vocab))
+    else:
+        with open(trace, 'r') as trace_file:
+            chunks = iter(lambda: trace_file.read(clean_data.CHUNK_SIZE), '')
+            result = streaming.classify_raw(classifier, chunks, dataset.read_vocab(vocab))
+    elapsed = time.time() - start
+
+    if result['label'] is None:
+        logger.error("no symbols in the trace")
+        return
+    color = TermColors.GREEN if result['early'] else TermColors.YELLO
+    print(color + "=======================> " + str([(result['label'], target_dict[result['label']])]) + " <=======================" + TermColors.ENDC)
+    print("confidence: {:.4f} after {} symbols ({:.2f}s){}".format(result['confidence'], result['consumed'], elapsed, 
+                                                                   "" if result['early'] else ", never reached the threshold"))
+
+
+def stream_eval(args):
+    """
+    Accuracy against symbols consumed for the streaming classifier.
+
+    :param args: args for stream_eval
+    :type args: Namespace
+    """
+    eval_file = args.eval_file
+    checkpoint_dir = args.checkpoint_dir
+    vocab = args.vocab
+    chunk = args.chunk
+    thresholds = args.thresholds
+    batch_size = args.batch_size
+    report_file = args.report
+    cpu = args.cpu
+    threads = args.threads
+    inter_threads = args.inter_threads
+
+    # do some checks
+    try: 
+        assert os.path.exists(eval_file), "eval_file must exist"
+        assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
+        assert os.path.exists(vocab), "vocab file must exist"
+        assert chunk > 0, "chunk must be positive"
+        assert all(0 < t <= 1 for t in thresholds), "thresholds must be between 0 and 1"
+        assert batch_size > 0, "batch_size must be positive"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    cpu = use_cpu(cpu, threads, inter_threads)
+    eval_data, eval_labels = process_data.process_data(eval_file, vocab, sparse=True)
+    try:
+        model = streaming.load_streaming_model(checkpoint_dir, batch_size, cpu)
+    except ValueError as err:
+        logger.error(err)
+        return
+
+    predictions, ends = streaming.chunk_predictions(model, eval_data, chunk, batch_size)
+    report = streaming.tradeoff(predictions, ends, eval_labels, sorted(thresholds))
+
+    print("{} traces, {} symbols in chunks of {}".format(len(eval_data), eval_data.shape[1], chunk))
+    print("  {:>9} {:>9} {:>13} {:>15} {:>7}".format('threshold', 'accuracy', 'mean symbols', 'median symbols', 'early'))
+    for row in report:
+        print("  {:>9} {:>9.4f} {:>13.1f} {:>15.1f} {:>7.1%}".format('full' if row['threshold'] is None else row['threshold'], 
+                                                                    row['accuracy'], row['mean_symbols'], row['median_symbols'], row['early']))
+
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump({'eval_file': eval_file, 'checkpoint_dir': checkpoint_dir, 'chunk': chunk, 'rows': len(eval_data), 'tradeoff': report}, f, indent=2)
+        logger.info("report written to: {}".format(report_file))
+
+
+def serve(args):
+    """
+    Load the model once and answer predictions over a socket.
+
+    :param args: args for serve
+    :type args: Namespace
+    """
+    metadata_file = args.metadata_file
+    checkpoint_dir = args.checkpoint_dir
+    vocab = args.vocab
+    length = args.len
+    socket_path = args.socket
+    host = args.host
+    port = args.port
+    max_batch = args.max_batch
+    max_wait = args.max_wait
+    top_k = args.top_k
+    cpu = args.cpu
+    threads = args.threads
+    inter_threads = args.inter_threads
+
+    # do some checks
+    try: 
+        assert os.path.exists(metadata_file), "metadata_file must exist"
+        assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
+        assert os.path.exists(vocab), "vocab file must exist"
+        assert length > 0, "len must be positive"
+        assert 0 < port < 65536, "port must be between 1 and 65535"
+        assert max_batch > 0, "max_batch must be positive"
+        assert max_wait >= 0, "max_wait can not be negative"
+        assert top_k > 0, "top_k must be positive"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    cpu = use_cpu(cpu, threads, inter_threads)
+    target_dict = process_data.grab_metadata(metadata_file)
+    model, _ = rnn.load_model(checkpoint_dir, rnn.checkpoint_vocab_len(checkpoint_dir), length, cpu)
+
+    batcher = server.Batcher(model, max_batch, max_wait / 1000)
+    batcher.start()
+    predictor = server.Predictor(batcher, dataset.read_vocab(vocab), length, target_dict, top_k, rnn.checkpoint_is_rle(checkpoint_dir))
+    server.serve(predictor, socket_path, host, port)
 
 
 def train_data(args):
@@ -128,6 +536,15 @@ def train_data(args):
     checkpoint_dir = args.checkpoint_dir
     #truncate = args.truncate
     vocab = args.vocab
+    sparse = args.sparse_labels
+    stream = args.stream
+    batch_size = args.batch_size
+    shuffle_buffer = args.shuffle_buffer
+    patience = args.patience
+    lr_patience = args.lr_patience
+    lr_factor = args.lr_factor
+    min_lr = args.min_lr
+    model_type = args.model
 
     # do some checks
     try:
@@ -139,26 +556,46 @@ def train_data(args):
         assert os.path.exists(training_dir), "training_dir must exist"
         assert os.path.exists(eval_file), "eval_file must exist"
         assert os.path.exists(vocab), "vocab file must exist"
+        assert patience >= 0, "patience can not be negative"
+        assert lr_patience >= 0, "lr_patience can not be negative"
+        assert 0 < lr_factor < 1, "lr_factor must be between 0 and 1"
+        assert min_lr > 0, "min_lr must be positive"
+        if stream:
+            assert dataset.is_dataset(train_file) and dataset.is_dataset(eval_file), "--stream needs the .header.json files from gen-data --binary"
+            assert batch_size > 0, "batch_size must be positive"
+            assert shuffle_buffer > 0, "shuffle_buffer must be positive"
         #assert truncate > 0, 'truncate must be positive'
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
 
-    # get train and eval data
-    train_data, train_labels = process_data.process_data(train_file, vocab)
-    test_data, test_labels = process_data.process_data(eval_file, vocab) 
-
     # make the checkpoint directory 
     if not continue_training and checkpoint_dir is None: 
         checkpoint_dir = common.grab_next_session(training_dir)
 
-    # train the model 
-    history, model_summary = rnn.train_and_validate(train_data, train_labels, test_data, test_labels, epochs, checkpoint_dir, continue_training)
+    if stream:
+        # stream batches off the disk instead of loading everything
+        train_set, train_steps, header = input_pipeline.make_dataset(train_file, vocab, batch_size, 
+                                                                     shuffle_buffer=shuffle_buffer, sparse=sparse)
+        test_set, test_steps, _ = input_pipeline.make_dataset(eval_file, vocab, batch_size, shuffle=False, sparse=sparse)
+        input_dims = (len(header['vocab']), header['truncate'])
+        history, model_summary = rnn.train_and_validate(train_set, None, test_set, None, epochs, checkpoint_dir, continue_training, sparse, 
+                                                        train_steps, test_steps, input_dims, patience, lr_patience, lr_factor, min_lr, 
+                                                        model_type, header.get('runs') is not None, batch_size=batch_size)
+    else:
+        # get train and eval data
+        train_data, train_labels = process_data.process_data(train_file, vocab, sparse=sparse)
+        test_data, test_labels = process_data.process_data(eval_file, vocab, sparse=sparse) 
+
+        # train the model 
+        history, model_summary = rnn.train_and_validate(train_data, train_labels, test_data, test_labels, epochs, checkpoint_dir, continue_training, sparse, 
+                                                        patience=patience, lr_patience=lr_patience, lr_factor=lr_factor, min_lr=min_lr, 
+                                                        model_type=model_type)
 
     # plot the data 
     if not continue_training: 
         common.write_file(model_summary,checkpoint_dir + "/MODEL_SUMMARY")
-        common.plot_graphs_val(history, 'categorical_accuracy', checkpoint_dir)
+        common.plot_graphs_val(history, rnn.accuracy_metric(sparse), checkpoint_dir)
         common.plot_graphs_val(history, 'loss', checkpoint_dir)
 
 
@@ -175,6 +612,15 @@ def eval_data(args):
     checkpoint_dir = args.checkpoint_dir
     # truncate = args.truncate
     vocab = args.vocab
+    sparse = args.sparse_labels
+    cpu = args.cpu
+    threads = args.threads
+    inter_threads = args.inter_threads
+    backend = args.backend
+    model_type = args.model
+    top_k = args.top_k
+    report_file = args.report
+    batch_size = args.batch_size
     
     # do some checks
     try: 
@@ -182,16 +628,31 @@ def eval_data(args):
         assert os.path.exists(metadata_file), "metadata_file must exist"
         assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
         assert os.path.exists(vocab), "vocab file must exist"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
+        assert top_k > 0, "top_k must be positive"
+        assert batch_size > 0, "batch_size must be positive"
         # assert truncate > 0, 'truncate must be positive'
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
 
+    if artifact.is_artifact(checkpoint_dir):
+        # an export from the export command, check what it costs
+        eval_data, eval_labels = process_data.process_data(eval_file, vocab, sparse=True)
+        backends = None if backend is None else [backend]
+        report = artifact.accuracy_report(checkpoint_dir, eval_data, eval_labels, backends, threads=threads)
+        print_accuracy_report(report)
+        return
+
+    cpu = use_cpu(cpu, threads, inter_threads)
+
     target_dict = process_data.grab_metadata(metadata_file)
     print("target dict: {}".format(target_dict))
-    eval_data, eval_labels, original_test_labels = process_data.process_data(eval_file, vocab, return_original=True)
+    eval_data, eval_labels, original_test_labels = process_data.process_data(eval_file, vocab, return_original=True, sparse=sparse)
     
-    rnn.eval(eval_data, eval_labels, checkpoint_dir, target_dict, original_test_labels, hide_results)
+    rnn.eval(eval_data, eval_labels, checkpoint_dir, target_dict, original_test_labels, hide_results, sparse, cpu, model_type, 
+             top_k, report_file, batch_size)
 
 
 def predict_data(args):
@@ -206,6 +667,11 @@ def predict_data(args):
     checkpoint_dir = args.checkpoint_dir
     vocab = args.vocab
     fun = args.fun
+    cpu = args.cpu
+    threads = args.threads
+    inter_threads = args.inter_threads
+    backend = args.backend
+    model_type = args.model
 
     # do some checks
     try: 
@@ -213,6 +679,8 @@ def predict_data(args):
         assert os.path.exists(metadata_file), "metadata_file must exist"
         assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
         assert os.path.exists(vocab), "vocab file must exist"
+        assert threads is None or threads > 0, "threads must be positive"
+        assert inter_threads is None or inter_threads > 0, "inter_threads must be positive"
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
@@ -222,8 +690,290 @@ def predict_data(args):
 
     # need the map between hash and url 
     target_dict = process_data.grab_metadata(metadata_file)    
+
+    if artifact.is_artifact(checkpoint_dir):
+        if backend is None:
+            backend = 'tflite' if artifact.read_header(checkpoint_dir)['tflite'] is not None else 'saved_model'
+        runner, header = artifact.load(checkpoint_dir, backend, threads)
+        rnn.show_predictions(runner.predict(spy_data[:, :header['input_len']]), target_dict, fun)
+        return
+
+    cpu = use_cpu(cpu, threads, inter_threads)
     # get the models best guess
-    rnn.predict(spy_data, checkpoint_dir, target_dict, fun)
+    rnn.predict(spy_data, checkpoint_dir, target_dict, fun, cpu, model_type)
+
+
+def print_accuracy_report(report):
+    """
+    Print the accuracy of an export next to the checkpoint it came from.
+
+    :param report: from artifact.accuracy_report
+    :type report: dict
+    """
+    print("export: {} (quantize: {}), {} probes".format(report['artifact'], report['quantize'], report['rows']))
+    for name, result in sorted(report['models'].items()):
+        print("  {:<12} accuracy: {:.4f} time: {:.2f}s".format(name, result['accuracy'], result['time']))
+    for name, delta in sorted(report.get('delta', dict()).items()):
+        color = TermColors.GREEN if delta >= 0 else TermColors.RED
+        print("  {:<12} delta: {}".format(name, color + "{:+.4f}".format(delta) + TermColors.ENDC))
+
+
+def export(args):
+    """
+    Export a checkpoint for inference.
+
+    :param args: args for export
+    :type args: Namespace
+    """
+    checkpoint_dir = args.checkpoint_dir
+    output_dir = args.output_dir
+    length = args.len
+    quantize = args.quantize
+    tflite = not args.no_tflite
+    eval_file = args.eval_file
+    vocab = args.vocab
+
+    # do some checks
+    try: 
+        assert os.path.exists(checkpoint_dir), "checkpoint_dir must exist"
+        assert tf.train.latest_checkpoint(checkpoint_dir) is not None, "checkpoint_dir has no checkpoint"
+        assert not os.path.exists(output_dir), "output_dir must not exist"
+        assert length > 0, "len must be positive"
+        assert tflite or quantize == 'none', "--quantize is for the TFLite model"
+        if eval_file is not None:
+            assert os.path.exists(eval_file), "eval_file must exist"
+            assert os.path.exists(vocab), "vocab file must exist"
+    except AssertionError as err: 
+        logger.error("Failed check: {}".format(err)) 
+        return 
+
+    eval_data = None
+    if eval_file is not None:
+        eval_data, eval_labels = process_data.process_data(eval_file, vocab, sparse=True)
+        eval_data = eval_data[:, :length]
+
+    representative_data = None if eval_data is None else eval_data[:artifact.REPRESENTATIVE_ROWS]
+    try:
+        artifact.export(checkpoint_dir, output_dir, length, quantize, tflite, representative_data)
+    except ValueError as err:
+        logger.error("Export failed: {}".format(err))
+        return
+
+    if eval_data is not None:
+        report = artifact.accuracy_report(output_dir, eval_data, eval_labels)
+        with open(os.path.join(output_dir, 'ACCURACY.json'), 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print_accuracy_report(report)
+
+
+def run_fold(args, checkpoint_dir, rows, all_data, all_labels, runs, input_dims, rle, cpu=False):
+    """
+    Train and test one gen-stats fold.
+
+    :param args: args for gen_stats
+    :type args: Namespace
+    :param checkpoint_dir: session dir for the fold
+    :type checkpoint_dir: str
+    :param rows: train, eval and test rows from process_data.split_fold
+    :type rows: tuple
+    :param all_data: every probe
+    :type all_data: numpy.array
+    :param all_labels: every label, as ints
+    :type all_labels: numpy.array
+    :param runs: run lengths kept apart from all_data, or None
+    :type runs: numpy.array
+    :param input_dims: (vocab_len, input_len)
+    :type input_dims: tuple
+    :param rle: run length encoded probes
+    :type rle: bool
+    :param cpu: train the cpu model, defaults to False
+    :type cpu: bool, optional
+    :return: test accuracy
+    :rtype: float
+    """
+    train_file = args.train_file 
+    epochs = args.epochs
+    vocab = args.vocab
+    sparse = args.sparse_labels
+    stream = args.stream
+    batch_size = args.batch_size
+    shuffle_buffer = args.shuffle_buffer
+    model_type = args.model
+    patience = args.patience
+    lr_patience = args.lr_patience
+    lr_factor = args.lr_factor
+    min_lr = args.min_lr
+
+    # pull out the test data for this session, the rest is now trainig
+    train_rows, eval_rows, test_rows = rows
+
+    # train the model 
+    logger.debug("TRINING")
+    if stream:
+        train_set, train_steps, _ = input_pipeline.make_dataset(train_file, vocab, batch_size, indices=train_rows, 
+                                                                shuffle_buffer=shuffle_buffer, sparse=sparse)
+        eval_set, eval_steps, _ = input_pipeline.make_dataset(train_file, vocab, batch_size, indices=eval_rows, 
+                                                              shuffle=False, sparse=sparse)
+        history, model_summary = rnn.train_and_validate(train_set, None, eval_set, None, epochs, checkpoint_dir, sparse=sparse, 
+                                                        steps_per_epoch=train_steps, validation_steps=eval_steps, input_dims=input_dims, 
+                                                        patience=patience, lr_patience=lr_patience, lr_factor=lr_factor, min_lr=min_lr, 
+                                                        model_type=model_type, rle=rle, cpu=cpu, batch_size=batch_size)
+    else:
+        # batches are gathered by row number, no per fold copy of the data
+        train_set = input_pipeline.IndexedBatches(all_data, all_labels, train_rows, batch_size, sparse)
+        eval_set = input_pipeline.IndexedBatches(all_data, all_labels, eval_rows, batch_size, sparse, shuffle=False)
+        history, model_summary = rnn.train_and_validate(train_set, None, eval_set, None, epochs, checkpoint_dir, sparse=sparse, 
+                                                        input_dims=input_dims, patience=patience, lr_patience=lr_patience, 
+                                                        lr_factor=lr_factor, min_lr=min_lr, model_type=model_type, rle=rle, cpu=cpu)
+
+    # the test half is small, gather it
+    test_data = np.asarray(all_data[test_rows])
+    if test_data.ndim == 2 and runs is not None:
+        test_data = dataset.stack_runs(test_data, runs[test_rows])
+    test_labels = np.asarray(all_labels[test_rows], dtype=np.int64)
+    if not sparse:
+        test_labels = tf.keras.utils.to_categorical(test_labels, input_pipeline.NUM_CLASSES)
+    
+    # get the result
+    logger.debug("EVAL")
+    metrics = rnn.eval(test_data, test_labels, checkpoint_dir, show_results=False, sparse=sparse, cpu=cpu, model_type=model_type, 
+                       report_file=checkpoint_dir + "/EVAL_REPORT.json")
+    common.write_file(str(model_summary), checkpoint_dir + "/MODEL_SUMMARY")
+    common.plot_graphs_val(history, rnn.accuracy_metric(sparse), checkpoint_dir)
+    common.plot_graphs_val(history, 'loss', checkpoint_dir)
+    return metrics[1]
+
+
+def cpu_sets(workers):
+    """
+    Split the cores this process may run on into one set per worker.
+
+    :param workers: number of workers
+    :type workers: int
+    :return: a list of cores per worker, None where pinning isn't supported
+    :rtype: list
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * workers
+
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < workers:
+        logger.warning("{} workers on {} cores, they will share".format(workers, len(cores)))
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    # neighbouring cores together, the first few sets get any left over
+    return [[int(core) for core in cores_set] for cores_set in np.array_split(cores, workers)]
+
+
+# the worker's share of the data, set by fold_worker_init
+_fold_worker = dict()
+
+
+def fold_worker_init(cores_queue, shared, input_dims, rle):
+    """
+    Set up a gen-stats worker: pin it to its cores, size the TF thread 
+    pools to match and map the shared data.
+
+    :param cores_queue: one entry from cpu_sets per worker
+    :type cores_queue: multiprocessing.Queue
+    :param shared: specs from dataset.share_array for data, labels and runs
+    :type shared: dict
+    :param input_dims: (vocab_len, input_len)
+    :type input_dims: tuple
+    :param rle: run length encoded probes
+    :type rle: bool
+    """
+    # workers train the cpu model, they would all fight over one GPU
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    cores = cores_queue.get()
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    threads = len(cores) if cores is not None else None
+
+    _fold_worker['threads'] = threads
+    _fold_worker['data'] = dataset.open_shared(shared['data'])
+    _fold_worker['labels'] = dataset.open_shared(shared['labels'])
+    _fold_worker['runs'] = dataset.open_shared(shared['runs'])
+    _fold_worker['input_dims'] = input_dims
+    _fold_worker['rle'] = rle
+    logger.debug("worker {} on cores {}".format(os.getpid(), cores))
+
+
+def fold_worker(job):
+    """
+    Run one fold in a worker, see fold_worker_init.
+
+    :param job: args, checkpoint dir and rows for the fold
+    :type job: tuple
+    :return: checkpoint dir and test accuracy
+    :rtype: tuple
+    """
+    args, checkpoint_dir, rows = job
+    tf.keras.backend.clear_session()
+    threads = _fold_worker['threads']
+    rnn.configure_threads(threads, 1 if threads is not None and threads < 4 else None)
+
+    accuracy = run_fold(args, checkpoint_dir, rows, _fold_worker['data'], _fold_worker['labels'], _fold_worker['runs'], 
+                        _fold_worker['input_dims'], _fold_worker['rle'], cpu=True)
+    return checkpoint_dir, accuracy
+
+
+def parallel_folds(args, folds, all_data, all_labels, runs, input_dims, rle):
+    """
+    Run the gen-stats folds in args.parallel worker processes. Each worker
+    is pinned to its own cores and maps the data from disk, nothing is 
+    pickled over but the row numbers.
+
+    :param args: args for gen_stats
+    :type args: Namespace
+    :param folds: from process_data.gen_fold_indices
+    :type folds: list
+    :param all_data: every probe
+    :type all_data: numpy.array
+    :param all_labels: every label, as ints
+    :type all_labels: numpy.array
+    :param runs: run lengths kept apart from all_data, or None
+    :type runs: numpy.array
+    :param input_dims: (vocab_len, input_len)
+    :type input_dims: tuple
+    :param rle: run length encoded probes
+    :type rle: bool
+    :return: test accuracy of each fold, in fold order
+    :rtype: list
+    """
+    training_dir = args.training_dir
+    workers = min(args.parallel, args.splits)
+
+    # session dirs up front so the fold order doesn't depend on who finishes first
+    jobs = []
+    for split in range(0, args.splits):
+        jobs.append((args, common.grab_next_session(training_dir), process_data.split_fold(folds, split)))
+
+    # files, not dirs, grab_next_session only looks at dirs
+    shared = {
+        'data': dataset.share_array(all_data, os.path.join(training_dir, SHARED_DATA)),
+        'labels': dataset.share_array(all_labels, os.path.join(training_dir, SHARED_LABELS)),
+        'runs': dataset.share_array(runs, os.path.join(training_dir, SHARED_RUNS))
+    }
+
+    # spawn, a forked TF runtime doesn't work in the child
+    context = multiprocessing.get_context('spawn')
+    cores_queue = context.Queue()
+    for cores in cpu_sets(workers):
+        cores_queue.put(cores)
+
+    logger.info("{} folds on {} workers".format(len(jobs), workers))
+    accuracy_per_session = []
+    try:
+        with context.Pool(workers, initializer=fold_worker_init, initargs=(cores_queue, shared, input_dims, rle)) as pool:
+            for checkpoint_dir, accuracy in pool.imap(fold_worker, jobs):
+                logger.debug("{}: {}".format(checkpoint_dir, accuracy))
+                accuracy_per_session.append(accuracy)
+    finally:
+        for name in [SHARED_DATA, SHARED_LABELS, SHARED_RUNS]:
+            if os.path.exists(os.path.join(training_dir, name)):
+                os.remove(os.path.join(training_dir, name))
+
+    return accuracy_per_session
 
 
 def gen_stats(args):
@@ -241,75 +991,77 @@ def gen_stats(args):
     test_file = args.test_file
     hyp = args.hyp
     vocab = args.vocab
+    sparse = args.sparse_labels
+    stream = args.stream
+    batch_size = args.batch_size
+    shuffle_buffer = args.shuffle_buffer
+    stratify = args.stratify
+    model_type = args.model
+    patience = args.patience
+    lr_patience = args.lr_patience
+    lr_factor = args.lr_factor
+    min_lr = args.min_lr
+    parallel = args.parallel
 
     # do some checks
     try:
         assert os.path.exists(training_dir), "training_dir must exist"
         assert os.path.exists(train_file), "eval_file must exist"
+        assert batch_size > 0, "batch_size must be positive"
+        if stream:
+            assert dataset.is_dataset(train_file), "--stream needs the .header.json from gen-data --binary"
+            assert shuffle_buffer > 0, "shuffle_buffer must be positive"
         if test_file is not None:  
             assert os.path.exists(test_file), "test_file must exist"
         assert hyp >= 0 and hyp <= 1, "hyp must be between 0 and 1"
         assert epochs > 0, 'epochs must be positive'
         assert os.path.exists(vocab), "vocab file must exist"
         assert splits > 0, "splits must be positive"
+        assert patience >= 0, "patience can not be negative"
+        assert lr_patience >= 0, "lr_patience can not be negative"
+        assert 0 < lr_factor < 1, "lr_factor must be between 0 and 1"
+        assert min_lr > 0, "min_lr must be positive"
+        assert parallel > 0, "parallel must be positive"
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
 
-    # get the data together  
-    train_data_process, train_labels_process = process_data.process_data(train_file, vocab)
-    data_split, data_lables = process_data.gen_splits(splits, train_data_process, train_labels_process)
+    # get the data together, one copy, every fold is just row numbers into it
+    runs = None
+    if dataset.is_dataset(train_file):
+        # memory mapped, the probes stay on disk
+        all_data, all_labels, header = dataset.load_dataset(train_file, dataset.read_vocab(vocab))
+        input_dims = (len(header['vocab']), all_data.shape[1])
+        runs = dataset.load_runs(train_file, header)
+        if runs is not None and not stream:
+            # run length encoded, symbols and runs go in as one array
+            all_data = dataset.stack_runs(all_data, runs)
+    else:
+        all_data, all_labels = process_data.process_data(train_file, vocab, sparse=True)
+        symbols = all_data[0][:, 0] if all_data.ndim == 3 else all_data[0]
+        input_dims = (len(set(symbols)), all_data.shape[1])
+    rle = all_data.ndim == 3 or runs is not None
+    folds = process_data.gen_fold_indices(all_labels, splits, stratify)
 
     if test_file is not None: 
-            test_data_process, test_labels_process = process_data.process_data(test_file, vocab)
+            test_data_process, test_labels_process = process_data.process_data(test_file, vocab, sparse=sparse)
             test_data_split, test_data_lables = process_data.gen_splits(splits, test_data_process, test_labels_process)
 
     # delte all the data in this directory 
     common.clean_dir_dir(training_dir)
-    
-    accuracy_per_session = []
-
-    # run the tests
-    for split in range(0, splits):
-        # pull out the test data for this session  
-        eval_data = data_split[split] 
 
-        start = 0 
-        end = len(eval_data)
-        # just so we aren't testing and validating on the same data
-        test_data = eval_data[int(end/2):end] 
-        eval_data = eval_data[start:int(end/2)] 
-
-
-        # the rest is now trainig
-        indicies = list(range(0, splits))
-        # remove the test data
-        del indicies[split]
-        train_data = data_split[indicies[0]]
-        train_labels = data_lables[indicies[0]]
-        # remove the first one
-        del indicies[0]
-        for i in indicies:
-            train_data = np.append(train_data, data_split[i], axis=0)
-            train_labels = np.append(train_labels, data_lables[i], axis=0)
-
-        # logger.debug(train_data)
-      
-        # make the checkpoint directory
-        checkpoint_dir = common.grab_next_session(training_dir)
-       
-        # train the model 
-        logger.debug("TRINING")
-        history, model_summary = rnn.train_and_validate(train_data, train_labels, eval_data, eval_labels, epochs, checkpoint_dir)
-        
-        # get the result
-        logger.debug("EVAL")
-        metrics = rnn.eval(test_data, test_labels, checkpoint_dir, show_results=False)
-        common.write_file(str(model_summary), checkpoint_dir + "/MODEL_SUMMARY")
-        accuracy_per_session.append(metrics[1])
-        logger.debug("accuracy so far: {}".format(accuracy_per_session))
-        common.plot_graphs_val(history, 'categorical_accuracy', checkpoint_dir)
-        common.plot_graphs_val(history, 'loss', checkpoint_dir)
+    if parallel > 1:
+        accuracy_per_session = parallel_folds(args, folds, all_data, all_labels, runs, input_dims, rle)
+    else:
+        accuracy_per_session = []
+
+        # run the tests
+        for split in range(0, splits):
+            # make the checkpoint directory
+            checkpoint_dir = common.grab_next_session(training_dir)
+            accuracy_per_session.append(run_fold(args, checkpoint_dir, process_data.split_fold(folds, split), all_data, all_labels, runs, 
+                                                 input_dims, rle))
+            logger.debug("accuracy so far: {}".format(accuracy_per_session))
     
     t, s, avg = process_data.get_stats(accuracy_per_session, hyp)
     data = "list of accs: {}".format(accuracy_per_session)
@@ -332,6 +1084,9 @@ def levenshtein(args):
     examples_two = args.examples_two 
     truncate = args.truncate
     all_flag = args.all
+    workers = args.workers
+    prefilter = args.prefilter
+    qgram = args.qgram
 
     # do some checks  
     try:
@@ -344,6 +1099,8 @@ def levenshtein(args):
         if examples_two is not None: 
             assert examples_two > 0, 'examples_two must be positive'
         assert truncate > 0, 'truncate must be positive'
+        assert workers > 0, 'workers must be positive'
+        assert qgram > 0, 'qgram must be positive'
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
@@ -398,11 +1155,11 @@ def levenshtein(args):
     total = 0 
     incorrect = 0
 
-    for test_probe in test_probes:
-        # match test_probe againsts all train probes 
-        match, dist = levenshtein_tools.least_distance(train_probes, test_probe)
-        time2 = time.time()
-        logger.debug('time: {}'.format(time2 - time1))
+    # match test_probe againsts all train probes 
+    index = levenshtein_tools.Prefilter(train_probes, qgram) if prefilter else None
+    prune_stats = dict()
+    for test_probe, match, dist, seconds in levenshtein_tools.classify_all(train_probes, test_probes, workers, index=index, stats=prune_stats):
+        logger.debug('time: {}'.format(seconds))
         if match == test_probe[0]:
             correct += 1 
         else: 
@@ -412,6 +1169,8 @@ def levenshtein(args):
 
     # how many did it get correctly 
     print('\n\nAccuracy: {}\nCorrect: {}\nIncorrect: {}\n missed_train: {} missed_test: {}'.format(correct/total, correct, incorrect, missed_url_train, missed_url_test))
+    if prefilter:
+        print(levenshtein_tools.prune_report(prune_stats))
 
 
 def lev_gen_stats(args): 
@@ -428,11 +1187,23 @@ def lev_gen_stats(args):
     truncate = args.truncate
     hyp = args.hyp
     number_of_examples = args.number_of_examples
+    workers = args.workers
+    matrix_file = args.matrix
+    k = args.k
+    prefilter = args.prefilter
+    qgram = args.qgram
+    use_index = args.index
 
     # do some checks
     try:
         assert os.path.exists(training_dir), "training_dir must exist"
         assert splits > 0, "splits must be positive"
+        assert workers > 0, "workers must be positive"
+        assert k > 0, "k must be positive"
+        assert k == 1 or matrix_file is not None, "k needs --matrix"
+        assert qgram > 0, "qgram must be positive"
+        assert matrix_file is None or not prefilter, "--matrix does not go with --prefilter"
+        assert not use_index or (matrix_file is None and not prefilter), "--index does not go with --matrix or --prefilter"
         if number_of_examples is not None:
             assert number_of_examples > 0, "splits must be positive"
     except AssertionError as err: 
@@ -441,11 +1212,21 @@ def lev_gen_stats(args):
 
     # grab the data set 
     data_set = process_data.grab_csv(train_file, truncate)
+
+    matrix = None
+    if matrix_file is not None:
+        # every distance once, up front, the folds are then just rows and columns of it
+        probes = [probe for key in data_set for probe in data_set[key]]
+        matrix = lev_matrix.distance_matrix(probes, matrix_file, workers)
+        rows = iter(range(len(probes)))
+        data_set = {key: [next(rows) for _ in data_set[key]] for key in data_set}
+
     # gen lev data splits  
     data_split = levenshtein_tools.gen_lev_splits(splits, data_set, number_of_examples)
 
     
     accuracy_per_session = []
+    prune_stats = dict()
 
     print(len(data_split)) 
     # run the tests
@@ -482,15 +1263,27 @@ def lev_gen_stats(args):
         print("test: {}. id:{}".format(len(test_data), id(test_data)))
         print("train: {}. id:{}".format(len(train_data), id(train_data)))
         total_time_one = time.time()
-        for test_probe in test_data:
-            time1 = time.time()
-            match, dist = levenshtein_tools.least_distance(train_data, test_probe)
-            time2 = time.time()
+        fold_stats = dict()
+        if matrix is not None:
+            # the splits hold matrix rows
+            results = lev_matrix.classify(matrix, train_data, test_data, k)
+            train_data = [(key, probes[row]) for key, row in train_data]
+        elif prefilter:
+            results = levenshtein_tools.classify_all(train_data, test_data, workers, index=levenshtein_tools.Prefilter(train_data, qgram), 
+                                                     stats=fold_stats)
+        elif use_index:
+            # kept next to session.csv for lev-eval
+            index = lev_index.BKTree(train_data)
+            index.save(lev_index.index_file(checkpoint_file))
+            results = levenshtein_tools.classify_all(train_data, test_data, workers, index=index)
+        else:
+            results = levenshtein_tools.classify_all(train_data, test_data, workers)
+        for test_probe, match, dist, seconds in results:
             if match == test_probe[0]:
-                print("{}: time {}".format(TermColors.GREEN + str(match) + TermColors.ENDC, time2-time1))
+                print("{}: time {}".format(TermColors.GREEN + str(match) + TermColors.ENDC, seconds))
                 correct += 1 
             else: 
-                print("{}: time {}".format(TermColors.RED + str(match) + TermColors.ENDC, time2-time1))
+                print("{}: time {}".format(TermColors.RED + str(match) + TermColors.ENDC, seconds))
                 incorrect += 1
             total += 1 
         total_time_two = time.time()
@@ -500,6 +1293,9 @@ def lev_gen_stats(args):
         accuracy_per_session.append(correct/total)
         logger.debug("accuracy so far: {}".format(accuracy_per_session))
         logger.debug('Time: {}'.format(total_time_two-total_time_one))
+        if prefilter:
+            logger.debug(levenshtein_tools.prune_report(fold_stats))
+            levenshtein_tools.merge_stats(prune_stats, fold_stats)
         # write data to file 
         logger.debug("WRITE SESSION DATA")
         csv_data = "probe,label \n"
@@ -513,6 +1309,8 @@ def lev_gen_stats(args):
     data += "\n t-value:{}, std:{}, avg:{}".format(t, s, avg)
     data += "\n hyp 0: {}".format(hyp)
     data += "\n time: {}".format(total_time_two-total_time_one)
+    if prefilter:
+        data += "\n prefilter: {}".format(levenshtein_tools.prune_report(prune_stats))
     common.write_file(data, training_dir + "/SESSION_INFO")
 
 
@@ -528,6 +1326,10 @@ def lev_eval(args):
     examples = args.number_of_examples
     hide = args.hide
     banner = args.banner 
+    workers = args.workers
+    no_index = args.no_index
+    prefilter = args.prefilter
+    qgram = args.qgram
     
     # truncate = args.truncate
     
@@ -535,6 +1337,8 @@ def lev_eval(args):
     try: 
         assert os.path.exists(eval_file), "eval_file must exist"
         assert os.path.exists(checkpoint_file), "checkpoint_dir must exist"
+        assert workers > 0, "workers must be positive"
+        assert qgram > 0, "qgram must be positive"
     except AssertionError as err: 
         logger.error("Failed check: {}".format(err)) 
         return 
@@ -548,32 +1352,47 @@ def lev_eval(args):
     eval_data = levenshtein_tools.unpack_lev_splits(copy.deepcopy(eval_data[0]))
     train_data = levenshtein_tools.unpack_lev_splits(copy.deepcopy(train_data[0]))
 
+    # the index lev-gen-stats saved with the session, if it is there
+    index = None
+    if prefilter:
+        index = levenshtein_tools.Prefilter(train_data, qgram)
+    elif not no_index and os.path.exists(lev_index.index_file(checkpoint_file)):
+        index = lev_index.BKTree.load(lev_index.index_file(checkpoint_file))
+        try:
+            index.reorder(train_data)
+        except ValueError as err:
+            logger.warning("not using the index: {}".format(err))
+            index = None
+
     correct = 0
     incorrect = 0
     total = 0 
+    prune_stats = dict()
 
-    for test_probe in eval_data:
-        time1 = time.time()
-        match, dist = levenshtein_tools.least_distance(train_data, test_probe)
-        time2 = time.time()
+    for test_probe, match, dist, seconds in levenshtein_tools.classify_all(train_data, eval_data, workers, index=index, stats=prune_stats):
         if match == test_probe[0]:
             if not hide:
-                print("{}: time {}".format(TermColors.GREEN + str(match) + TermColors.ENDC, time2-time1))
+                print("{}: time {}".format(TermColors.GREEN + str(match) + TermColors.ENDC, seconds))
             correct += 1 
         else: 
             if not hide: 
-                print("{}: time {}".format(TermColors.RED + str(match) + TermColors.ENDC, time2-time1))
+                print("{}: time {}".format(TermColors.RED + str(match) + TermColors.ENDC, seconds))
             incorrect += 1
         total += 1 
 
     # how many did it get correctly 
     print(banner)
     print('\n\nAccuracy: {}\nCorrect: {}\nIncorrect: {}\n\n'.format(correct/total, correct, incorrect ))
+    if prefilter:
+        print(levenshtein_tools.prune_report(prune_stats))
 
 
 def main():
     # make parser
     parser = argparse.ArgumentParser(prog='data_center')
+    parser.add_argument('--no_cache', default=False, action='store_true', help='Do not use the encoded dataset cache.')
+    parser.add_argument('--cache_dir', metavar='', default=dataset_cache.DEFAULT_CACHE_DIR, type=str, help='Encoded dataset cache directory. (default: {})'.format(dataset_cache.DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache_size', metavar='', default=dataset_cache.DEFAULT_MAX_BYTES // 1024 ** 2, type=int, help='Max size of the cache in MB. (default: {})'.format(dataset_cache.DEFAULT_MAX_BYTES // 1024 ** 2))
     subparsers = parser.add_subparsers()
 
     # make sub parsers 
@@ -585,6 +1404,14 @@ def main():
     parser_levenshtein = subparsers.add_parser('lev', help='Use the levenshtein method. (NOTE:BROKEN)')
     parser_lev_gen_stats = subparsers.add_parser('lev-gen-stats', help='Do a student t-test on a k fold cv. (lev)')
     parser_lev_eval = subparsers.add_parser('lev-eval', help='Eval lev model')
+    parser_bench_clean = subparsers.add_parser('bench-clean', help='Benchmark the probe cleaner.')
+    parser_cache = subparsers.add_parser('cache', help='Manage the encoded dataset cache.')
+    parser_bench_cpu = subparsers.add_parser('bench-cpu', help='Benchmark the model on the cpu.')
+    parser_serve = subparsers.add_parser('serve', help='Keep the model loaded and serve predictions.')
+    parser_export = subparsers.add_parser('export', help='Export a checkpoint to SavedModel and TFLite.')
+    parser_bench_model = subparsers.add_parser('bench-model', help='Compare the speed (and accuracy) of the model types.')
+    parser_stream_predict = subparsers.add_parser('stream-predict', help='Classify a raw trace as it comes in, stop early when sure.')
+    parser_stream_eval = subparsers.add_parser('stream-eval', help='Accuracy against symbols consumed when stopping early.')
 
     # gen data arguments
     parser_gen_data.add_argument('target_data', type=str, help='Path to data to be processes.')
@@ -592,6 +1419,11 @@ def main():
     parser_gen_data.add_argument('--len', metavar='', default=450, type=int, help='Len of the string to truncate to. (Default to 450 characters)')
     parser_gen_data.add_argument('--split', metavar='', default=0.9, type=float, help='When to split to eval. (Default to .90 train .10 eval)')
     parser_gen_data.add_argument('--spy_data', default=False, action='store_true', help='Is this new spy data? (i.e) preparing the data for prediction.')
+    parser_gen_data.add_argument('--binary', default=False, action='store_true', help='Also write a memory mappable binary dataset next to each csv.')
+    parser_gen_data.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file (used with --binary)")
+    parser_gen_data.add_argument('--incremental', default=False, action='store_true', help='Only clean new or changed files since the last run.')
+    parser_gen_data.add_argument('--workers', metavar='', default=1, type=int, help='Number of processes to clean with. (default: 1)')
+    parser_gen_data.add_argument('--rle_len', metavar='', default=None, type=int, help='Run length encode the probes, keeping this many runs (replaces --len). (default: off)')
 
     # train arguments
     parser_train.add_argument('train_file', type=str, help='Path to train csv.')
@@ -602,6 +1434,15 @@ def main():
     parser_train.add_argument('--checkpoint_dir', metavar='', default=None, type=str, help='checkpoint directory.')
     #parser_train.add_argument('--truncate', metavar='', default=450, type=int, help='truncate data. (default: None)') 
     parser_train.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_train.add_argument('--sparse_labels', default=False, action='store_true', help='Keep labels as ints instead of one hot.')
+    parser_train.add_argument('--stream', default=False, action='store_true', help='Stream batches off the disk. (needs gen-data --binary)')
+    parser_train.add_argument('--batch_size', metavar='', default=32, type=int, help='Batch size when streaming. (default: 32)')
+    parser_train.add_argument('--shuffle_buffer', metavar='', default=input_pipeline.SHUFFLE_BUFFER, type=int, help='Shuffle buffer when streaming. (default: {})'.format(input_pipeline.SHUFFLE_BUFFER))
+    parser_train.add_argument('--patience', metavar='', default=0, type=int, help='Stop after this many epochs without a better val accuracy and keep the best weights. (default: 0, never)')
+    parser_train.add_argument('--lr_patience', metavar='', default=0, type=int, help='Cut the learning rate after this many epochs without a better val accuracy. (default: 0, use the fixed schedule)')
+    parser_train.add_argument('--lr_factor', metavar='', default=rnn.LR_FACTOR, type=float, help='What to multiply the learning rate by on a plateau. (default: {})'.format(rnn.LR_FACTOR))
+    parser_train.add_argument('--min_lr', metavar='', default=rnn.MIN_LR, type=float, help='Learning rate floor. (default: {})'.format(rnn.MIN_LR))
+    parser_train.add_argument('--model', default='gru', choices=rnn.MODEL_TYPES, help='Model to train, stacked GRUs or a dilated convolution. (default: gru)')
     
     # eval arguments 
     parser_eval.add_argument('metadata_file', type=str, help='Path to metadata.')
@@ -610,6 +1451,15 @@ def main():
     parser_eval.add_argument('--hide_results', default=True, action='store_false', help='Do not print model guess for each url.')
     #parser_eval.add_argument('--truncate', metavar='', default=450, type=int, help='truncate data. (default: None)')
     parser_eval.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_eval.add_argument('--sparse_labels', default=False, action='store_true', help='Keep labels as ints instead of one hot.')
+    parser_eval.add_argument('--cpu', default=False, action='store_true', help='Run the cpu model. (default when there is no GPU)')
+    parser_eval.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads for the cpu model. (default: one per core)')
+    parser_eval.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads for the cpu model. (default: 2)')
+    parser_eval.add_argument('--backend', default=None, choices=artifact.BACKENDS, help='With an export as checkpoint_dir, which model to run. (default: all)')
+    parser_eval.add_argument('--model', default=None, choices=rnn.MODEL_TYPES, help='Model the checkpoint is for. (default: read from the checkpoint)')
+    parser_eval.add_argument('--top_k', metavar='', default=report.TOP_K, type=int, help='k for the top k accuracy. (default: {})'.format(report.TOP_K))
+    parser_eval.add_argument('--report', metavar='', default=None, type=str, help='Write the metrics to this json file, per url numbers go in a csv next to it.')
+    parser_eval.add_argument('--batch_size', metavar='', default=256, type=int, help='Batch size for the predictions. (default: 256)')
 
     # predict arguments 
     parser_predict.add_argument('metadata_file', type=str, help='Path to metadata.')
@@ -618,6 +1468,11 @@ def main():
     #parser_predict.add_argument('--truncate', metavar='', default=450, type=int, help='truncate data.')
     parser_predict.add_argument('--fun', default=False, action="store_true", help='the fun way to display data.')
     parser_predict.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_predict.add_argument('--cpu', default=False, action='store_true', help='Run the cpu model. (default when there is no GPU)')
+    parser_predict.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads for the cpu model. (default: one per core)')
+    parser_predict.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads for the cpu model. (default: 2)')
+    parser_predict.add_argument('--backend', default=None, choices=artifact.BACKENDS, help='With an export as checkpoint_dir, which model to run. (default: tflite)')
+    parser_predict.add_argument('--model', default=None, choices=rnn.MODEL_TYPES, help='Model the checkpoint is for. (default: read from the checkpoint)')
 
     # gen stats arguments
     parser_gen_stats.add_argument('train_file', type=str, help='Path to train csv.')
@@ -627,6 +1482,17 @@ def main():
     parser_gen_stats.add_argument('--training_dir', metavar='', default='./cv_training', type=str, help='Directory to store training sessions.')
     parser_gen_stats.add_argument('--test_file', metavar='', default=None, type=str, help='If you need to test against a different data set that it trained on.')
     parser_gen_stats.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_gen_stats.add_argument('--sparse_labels', default=False, action='store_true', help='Keep labels as ints instead of one hot.')
+    parser_gen_stats.add_argument('--stream', default=False, action='store_true', help='Stream batches off the disk. (needs gen-data --binary)')
+    parser_gen_stats.add_argument('--batch_size', metavar='', default=32, type=int, help='Batch size. (default: 32)')
+    parser_gen_stats.add_argument('--stratify', default=False, action='store_true', help='Spread every label evenly over the folds.')
+    parser_gen_stats.add_argument('--shuffle_buffer', metavar='', default=input_pipeline.SHUFFLE_BUFFER, type=int, help='Shuffle buffer when streaming. (default: {})'.format(input_pipeline.SHUFFLE_BUFFER))
+    parser_gen_stats.add_argument('--patience', metavar='', default=0, type=int, help='Stop after this many epochs without a better val accuracy and keep the best weights. (default: 0, never)')
+    parser_gen_stats.add_argument('--lr_patience', metavar='', default=0, type=int, help='Cut the learning rate after this many epochs without a better val accuracy. (default: 0, use the fixed schedule)')
+    parser_gen_stats.add_argument('--lr_factor', metavar='', default=rnn.LR_FACTOR, type=float, help='What to multiply the learning rate by on a plateau. (default: {})'.format(rnn.LR_FACTOR))
+    parser_gen_stats.add_argument('--min_lr', metavar='', default=rnn.MIN_LR, type=float, help='Learning rate floor. (default: {})'.format(rnn.MIN_LR))
+    parser_gen_stats.add_argument('--model', default='gru', choices=rnn.MODEL_TYPES, help='Model to train, stacked GRUs or a dilated convolution. (default: gru)')
+    parser_gen_stats.add_argument('--parallel', metavar='', default=1, type=int, help='Run this many folds at once, each on its own cores with the cpu model. (default: 1)')
 
     # Levenshtein distance arguments  
     parser_levenshtein.add_argument('data_set_one', type=str, help='first data set.')
@@ -636,6 +1502,9 @@ def main():
     parser_levenshtein.add_argument('--examples_two', metavar='', type=int, default=None, help='number of examples. (default all)')
     parser_levenshtein.add_argument('--truncate', metavar='', type=int, default=1000, help='Truncate length (default: 1000)')
     parser_levenshtein.add_argument('--all', default=False, action='store_true', help='use all data (please use two different files)')
+    parser_levenshtein.add_argument('--prefilter', default=False, action='store_true', help='Skip train probes whose length/symbol count bound already loses.')
+    parser_levenshtein.add_argument('--qgram', metavar='', type=int, default=1, help='Also bound with q-gram counts of this size, with --prefilter. (default: 1, symbols only)')
+    parser_levenshtein.add_argument('--workers', metavar='', type=int, default=1, help='Processes to classify the test probes with. (default: 1)')
     #parser_levenshtein.add_argument('--plot', default=False, action="store_true", help='plot misses and hits.')
     
     # Levenshtein gen stats arguments
@@ -645,6 +1514,12 @@ def main():
     parser_lev_gen_stats.add_argument('--truncate', metavar='', default=450, type=int, help='truncate data. (default 450)')
     parser_lev_gen_stats.add_argument('--hyp', default=0.94, type=float,  help='The hypothesis value. (i.e) H0 > 0.94')
     parser_lev_gen_stats.add_argument('--number_of_examples', metavar='', type=int, default=None, help='number of examples. (defaultall)')
+    parser_lev_gen_stats.add_argument('--matrix', metavar='', type=str, default=None, help='Work out every distance once into this .npy (resumes if it is there) and slice the folds out of it.')
+    parser_lev_gen_stats.add_argument('--k', metavar='', type=int, default=1, help='Neighbours that vote, needs --matrix. (default: 1)')
+    parser_lev_gen_stats.add_argument('--index', default=False, action='store_true', help='Search each fold with a BK-tree and save it next to session.csv for lev-eval.')
+    parser_lev_gen_stats.add_argument('--prefilter', default=False, action='store_true', help='Skip train probes whose length/symbol count bound already loses.')
+    parser_lev_gen_stats.add_argument('--qgram', metavar='', type=int, default=1, help='Also bound with q-gram counts of this size, with --prefilter. (default: 1, symbols only)')
+    parser_lev_gen_stats.add_argument('--workers', metavar='', type=int, default=1, help='Processes to classify the test probes with. (default: 1)')
 
     # eval arguments 
     parser_lev_eval.add_argument('eval_file', type=str, help='Path to eval csv.')
@@ -652,6 +1527,85 @@ def main():
     parser_lev_eval.add_argument('--number_of_examples', metavar='', type=int, default=None, help='number of examples. (default all)')
     parser_lev_eval.add_argument('--banner', metavar='', type=str, default=None, help='banner')
     parser_lev_eval.add_argument('--hide', default=False, action='store_true', help='Hide results')
+    parser_lev_eval.add_argument('--no_index', default=False, action='store_true', help='Scan every train probe even if the session has an index.')
+    parser_lev_eval.add_argument('--prefilter', default=False, action='store_true', help='Skip train probes whose length/symbol count bound already loses.')
+    parser_lev_eval.add_argument('--qgram', metavar='', type=int, default=1, help='Also bound with q-gram counts of this size, with --prefilter. (default: 1, symbols only)')
+    parser_lev_eval.add_argument('--workers', metavar='', type=int, default=1, help='Processes to classify the test probes with. (default: 1)')
+
+    # bench clean arguments
+    parser_bench_clean.add_argument('target_data', type=str, help='Path to raw data to clean.')
+    parser_bench_clean.add_argument('--len', metavar='', default=None, type=int, help='Len of the string to truncate to. (default: None)')
+    parser_bench_clean.add_argument('--repeat', metavar='', default=3, type=int, help='Number of timed runs. (default: 3)')
+
+    # cache arguments
+    parser_cache.add_argument('action', type=str, choices=['stats', 'clear'], help='Show what is in the cache or empty it.')
+
+    # bench cpu arguments
+    parser_bench_cpu.add_argument('checkpoint_dir', type=str, help='Path to checkpoint dir.')
+    parser_bench_cpu.add_argument('data_file', type=str, help='Path to a csv or .header.json to run.')
+    parser_bench_cpu.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_bench_cpu.add_argument('--batch_size', metavar='', default=256, type=int, help='Batch size for the throughput run. (default: 256)')
+    parser_bench_cpu.add_argument('--samples', metavar='', default=100, type=int, help='Number of single trace runs. (default: 100)')
+    parser_bench_cpu.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads. (default: one per core)')
+    parser_bench_cpu.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads. (default: 2)')
+
+    # serve arguments
+    parser_serve.add_argument('metadata_file', type=str, help='Path to metadata.')
+    parser_serve.add_argument('checkpoint_dir', type=str, help='Path to checkpoint dir.')
+    parser_serve.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_serve.add_argument('--len', metavar='', default=450, type=int, help='Probe length the model was trained on. (default: 450)')
+    parser_serve.add_argument('--socket', metavar='', default=None, type=str, help='Listen on this unix socket instead of http.')
+    parser_serve.add_argument('--host', metavar='', default='127.0.0.1', type=str, help='http address. (default: 127.0.0.1)')
+    parser_serve.add_argument('--port', metavar='', default=8450, type=int, help='http port. (default: 8450)')
+    parser_serve.add_argument('--max_batch', metavar='', default=server.MAX_BATCH, type=int, help='Most probes in one batch. (default: {})'.format(server.MAX_BATCH))
+    parser_serve.add_argument('--max_wait', metavar='', default=server.MAX_WAIT * 1000, type=float, help='ms to wait for a batch to fill. (default: {})'.format(server.MAX_WAIT * 1000))
+    parser_serve.add_argument('--top_k', metavar='', default=server.TOP_K, type=int, help='Number of guesses to send back. (default: {})'.format(server.TOP_K))
+    parser_serve.add_argument('--cpu', default=False, action='store_true', help='Run the cpu model. (default when there is no GPU)')
+    parser_serve.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads for the cpu model. (default: one per core)')
+    parser_serve.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads for the cpu model. (default: 2)')
+
+    # export arguments
+    parser_export.add_argument('checkpoint_dir', type=str, help='Path to checkpoint dir.')
+    parser_export.add_argument('output_dir', type=str, help='Where to write the export.')
+    parser_export.add_argument('--len', metavar='', default=450, type=int, help='Probe length the model was trained on. (default: 450)')
+    parser_export.add_argument('--quantize', default='none', choices=artifact.QUANTIZE_MODES, help='Quantize the TFLite model. (default: none)')
+    parser_export.add_argument('--no_tflite', default=False, action='store_true', help='Only write the SavedModel.')
+    parser_export.add_argument('--eval_file', metavar='', default=None, type=str, help='Check the accuracy of the export against the checkpoint on this data.')
+    parser_export.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file (used with --eval_file)")
+
+    # bench model arguments
+    parser_bench_model.add_argument('data_file', type=str, help='Path to a csv or .header.json with labels.')
+    parser_bench_model.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_bench_model.add_argument('--batch_size', metavar='', default=32, type=int, help='Batch size. (default: 32)')
+    parser_bench_model.add_argument('--train_steps', metavar='', default=20, type=int, help='Number of timed training batches. (default: 20)')
+    parser_bench_model.add_argument('--samples', metavar='', default=50, type=int, help='Number of single trace runs. (default: 50)')
+    parser_bench_model.add_argument('--cpu', default=False, action='store_true', help='Use the cpu GRU. (default when there is no GPU)')
+    parser_bench_model.add_argument('--gru_checkpoint', metavar='', default=None, type=str, help='Trained gru checkpoint dir to get the accuracy of.')
+    parser_bench_model.add_argument('--tcn_checkpoint', metavar='', default=None, type=str, help='Trained tcn checkpoint dir to get the accuracy of.')
+
+    # stream predict
+    parser_stream_predict.add_argument('metadata_file', type=str, help='Path to metadata.')
+    parser_stream_predict.add_argument('trace', type=str, help='Raw spy tool output, - reads stdin.')
+    parser_stream_predict.add_argument('checkpoint_dir', type=str, help='Path to a gru checkpoint dir.')
+    parser_stream_predict.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_stream_predict.add_argument('--chunk', metavar='', default=streaming.CHUNK, type=int, help='Symbols per step. (default: {})'.format(streaming.CHUNK))
+    parser_stream_predict.add_argument('--threshold', metavar='', default=streaming.THRESHOLD, type=float, help='Confidence to stop at. (default: {})'.format(streaming.THRESHOLD))
+    parser_stream_predict.add_argument('--max_len', metavar='', default=450, type=int, help='Most symbols to read. (default: 450)')
+    parser_stream_predict.add_argument('--cpu', default=False, action='store_true', help='Run the cpu model. (default when there is no GPU)')
+    parser_stream_predict.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads for the cpu model. (default: one per core)')
+    parser_stream_predict.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads for the cpu model. (default: 2)')
+
+    # stream eval
+    parser_stream_eval.add_argument('eval_file', type=str, help='Path to a csv or .header.json with labels.')
+    parser_stream_eval.add_argument('checkpoint_dir', type=str, help='Path to a gru checkpoint dir.')
+    parser_stream_eval.add_argument('--vocab', metavar='', default='./vocab.txt', type=str, help="vocab file")
+    parser_stream_eval.add_argument('--chunk', metavar='', default=streaming.CHUNK, type=int, help='Symbols per step. (default: {})'.format(streaming.CHUNK))
+    parser_stream_eval.add_argument('--thresholds', metavar='', default=streaming.THRESHOLDS, type=float, nargs='+', help='Confidences to try. (default: {})'.format(' '.join(str(t) for t in streaming.THRESHOLDS)))
+    parser_stream_eval.add_argument('--batch_size', metavar='', default=256, type=int, help='Traces run side by side. (default: 256)')
+    parser_stream_eval.add_argument('--report', metavar='', default=None, type=str, help='Write the trade-off to this json file.')
+    parser_stream_eval.add_argument('--cpu', default=False, action='store_true', help='Run the cpu model. (default when there is no GPU)')
+    parser_stream_eval.add_argument('--threads', metavar='', default=None, type=int, help='Intra op threads for the cpu model. (default: one per core)')
+    parser_stream_eval.add_argument('--inter_threads', metavar='', default=None, type=int, help='Inter op threads for the cpu model. (default: 2)')
 
     # set functions
     parser_gen_data.set_defaults(func=gen_data) 
@@ -662,6 +1616,14 @@ def main():
     parser_levenshtein.set_defaults(func=levenshtein) 
     parser_lev_gen_stats.set_defaults(func=lev_gen_stats) 
     parser_lev_eval.set_defaults(func=lev_eval) 
+    parser_bench_clean.set_defaults(func=bench_clean)
+    parser_cache.set_defaults(func=cache)
+    parser_bench_cpu.set_defaults(func=bench_cpu)
+    parser_serve.set_defaults(func=serve)
+    parser_export.set_defaults(func=export)
+    parser_bench_model.set_defaults(func=bench_model)
+    parser_stream_predict.set_defaults(func=stream_predict)
+    parser_stream_eval.set_defaults(func=stream_eval)
 
     args = parser.parse_args()    
 
@@ -669,6 +1631,8 @@ def main():
         parser.print_help()
         return 
 
+    dataset_cache.configure(not args.no_cache, args.cache_dir, args.cache_size * 1024 ** 2)
+
     args.func(args)
 
 
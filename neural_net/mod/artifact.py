@@ -0,0 +1,357 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import json
+import os
+import logging
+import time
+import numpy as np
+import tensorflow as tf
+
+import character_rnn as rnn
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+ARTIFACT_VERSION = 1
+
+# what an export directory looks like
+ARTIFACT_FILE = 'ARTIFACT.json'
+SAVED_MODEL_DIR = 'saved_model'
+TFLITE_FILE = 'model.tflite'
+
+QUANTIZE_MODES = ['none', 'float16', 'int8']
+BACKENDS = ['tflite', 'saved_model']
+
+# rows of the eval data used to calibrate int8 activations
+REPRESENTATIVE_ROWS = 100
+
+
+def is_artifact(path):
+    """
+    Is this an export directory.
+
+    :param path: path to check
+    :type path: str
+    :return: True if it has an ARTIFACT.json
+    :rtype: bool
+    """
+    return os.path.isfile(os.path.join(path, ARTIFACT_FILE))
+
+
+def read_header(artifact_dir):
+    """
+    Read the ARTIFACT.json of an export.
+
+    :param artifact_dir: export directory
+    :type artifact_dir: str
+    :raises ValueError: artifact from a different version
+    :return: the header
+    :rtype: dict
+    """
+    with open(os.path.join(artifact_dir, ARTIFACT_FILE)) as header_file:
+        header = json.load(header_file)
+
+    if header.get('version') != ARTIFACT_VERSION:
+        raise ValueError("{} is version {} not {}".format(artifact_dir, header.get('version'), ARTIFACT_VERSION))
+
+    return header
+
+
+def tflite_converter(session, model):
+    """
+    Make a TFLite converter for a keras model, it moved out of contrib in 1.13.
+
+    :param session: session the model lives in
+    :param model: the model
+    :return: the converter
+    """
+    if hasattr(tf, 'lite') and hasattr(tf.lite, 'TFLiteConverter'):
+        return tf.lite.TFLiteConverter.from_session(session, [model.input], [model.output])
+    return tf.contrib.lite.TFLiteConverter.from_session(session, [model.input], [model.output])
+
+
+def set_quantization(converter, quantize, representative_data=None):
+    """
+    Turn on quantization with whichever converter api this TF has.
+
+    int8 on TF 1.13 is post_training_quantize (int8 weights, float math).
+    Newer converters take tf.lite.Optimize and, with representative data,
+    calibrate the activations too. float16 needs the newer api.
+
+    :param converter: TFLite converter
+    :param quantize: one of QUANTIZE_MODES
+    :type quantize: str
+    :param representative_data: encoded probes to calibrate int8 with, defaults to None
+    :type representative_data: numpy.array, optional
+    :raises ValueError: mode is not supported by this TF
+    """
+    if quantize == 'none':
+        return
+
+    optimize = getattr(getattr(tf, 'lite', None), 'Optimize', None)
+
+    if quantize == 'float16':
+        if optimize is None or not hasattr(converter, 'target_spec'):
+            raise ValueError("float16 quantization needs TF >= 1.14, this is {}".format(tf.__version__))
+        converter.optimizations = [optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+        return
+
+    if optimize is None:
+        converter.post_training_quantize = True
+        return
+
+    converter.optimizations = [optimize.DEFAULT]
+    if representative_data is not None and hasattr(converter, 'representative_dataset'):
+        def representative_dataset():
+            for row in representative_data:
+                yield [row[np.newaxis].astype(np.float32)]
+        converter.representative_dataset = representative_dataset
+
+
+def export(checkpoint_dir, output_dir, input_len, quantize='none', tflite=True, representative_data=None):
+    """
+    Write a checkpoint out as a SavedModel and a TFLite model.
+
+    Both come from the cpu model in inference mode (no dropout). The GRUs
+    are unrolled for TFLite since it can't run the while loop.
+
+    :param checkpoint_dir: checkpoint directory from train
+    :type checkpoint_dir: str
+    :param output_dir: where to put the export, must not exist yet
+    :type output_dir: str
+    :param input_len: probe length the model was trained on
+    :type input_len: int
+    :param quantize: one of QUANTIZE_MODES, defaults to 'none'
+    :type quantize: str, optional
+    :param tflite: also write the TFLite model, defaults to True
+    :type tflite: bool, optional
+    :param representative_data: encoded probes to calibrate int8 with, defaults to None
+    :type representative_data: numpy.array, optional
+    :return: the header written to ARTIFACT.json
+    :rtype: dict
+    """
+    vocab_len = rnn.checkpoint_vocab_len(checkpoint_dir)
+
+    tf.keras.backend.clear_session()
+    tf.keras.backend.set_learning_phase(0)
+    model, _ = rnn.load_model(checkpoint_dir, vocab_len, input_len, cpu=True, unroll=tflite)
+    session = tf.keras.backend.get_session()
+
+    os.makedirs(output_dir)
+    tf.saved_model.simple_save(session, os.path.join(output_dir, SAVED_MODEL_DIR),
+                               inputs={'tokens': model.input}, outputs={'probabilities': model.output})
+    logger.info("wrote SavedModel")
+
+    if tflite:
+        converter = tflite_converter(session, model)
+        set_quantization(converter, quantize, representative_data)
+        tflite_model = converter.convert()
+        with open(os.path.join(output_dir, TFLITE_FILE), 'wb') as tflite_file:
+            tflite_file.write(tflite_model)
+        logger.info("wrote TFLite model ({}): {} bytes".format(quantize, len(tflite_model)))
+
+    header = dict()
+    header['version'] = ARTIFACT_VERSION
+    header['checkpoint'] = os.path.abspath(tf.train.latest_checkpoint(checkpoint_dir))
+    header['checkpoint_dir'] = os.path.abspath(checkpoint_dir)
+    header['model'] = rnn.checkpoint_model_type(checkpoint_dir)
+    header['rle'] = rnn.checkpoint_is_rle(checkpoint_dir)
+    header['vocab_len'] = vocab_len
+    header['input_len'] = input_len
+    header['saved_model'] = SAVED_MODEL_DIR
+    header['tflite'] = TFLITE_FILE if tflite else None
+    header['quantize'] = quantize if tflite else 'none'
+    header['tf_version'] = tf.__version__
+    header['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    with open(os.path.join(output_dir, ARTIFACT_FILE), 'w') as header_file:
+        json.dump(header, header_file, indent=2)
+
+    return header
+
+
+class TFLiteRunner(object):
+    """
+    Run the TFLite model of an export.
+
+    :param path: path to the .tflite file
+    :type path: str
+    :param threads: interpreter threads if this TF takes it, defaults to None
+    :type threads: int, optional
+    """
+    def __init__(self, path, threads=None):
+        interpreter_class = tf.lite.Interpreter if hasattr(tf, 'lite') else tf.contrib.lite.Interpreter
+        try:
+            self.interpreter = interpreter_class(model_path=path, num_threads=threads)
+        except TypeError:
+            # older interpreters have no num_threads
+            self.interpreter = interpreter_class(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def resize(self, batch_size):
+        if batch_size != self.batch_size:
+            # keep every dim past the batch, a run length encoded model takes (len, 2)
+            self.interpreter.resize_tensor_input(self.input['index'], [batch_size] + list(self.input['shape'][1:]))
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch_size
+
+    def predict(self, data, batch_size=32):
+        """
+        :param data: encoded probes
+        :type data: numpy.array
+        :param batch_size: rows per invoke, defaults to 32
+        :type batch_size: int, optional
+        :return: probabilities
+        :rtype: numpy.array
+        """
+        predictions = []
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size].astype(self.input['dtype'])
+            self.resize(len(batch))
+            self.interpreter.set_tensor(self.input['index'], batch)
+            self.interpreter.invoke()
+            predictions.append(np.array(self.interpreter.get_tensor(self.output['index'])))
+        return np.concatenate(predictions)
+
+
+class SavedModelRunner(object):
+    """
+    Run the SavedModel of an export in its own graph and session.
+
+    :param path: path to the SavedModel directory
+    :type path: str
+    """
+    def __init__(self, path):
+        self.graph = tf.Graph()
+        self.session = tf.Session(graph=self.graph)
+        with self.graph.as_default():
+            meta_graph = tf.saved_model.loader.load(self.session, [tf.saved_model.tag_constants.SERVING], path)
+        signature = meta_graph.signature_def[tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+        self.input = self.graph.get_tensor_by_name(signature.inputs['tokens'].name)
+        self.output = self.graph.get_tensor_by_name(signature.outputs['probabilities'].name)
+
+    def predict(self, data, batch_size=256):
+        """
+        :param data: encoded probes
+        :type data: numpy.array
+        :param batch_size: rows per run, defaults to 256
+        :type batch_size: int, optional
+        :return: probabilities
+        :rtype: numpy.array
+        """
+        predictions = []
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size].astype(np.float32)
+            predictions.append(self.session.run(self.output, {self.input: batch}))
+        return np.concatenate(predictions)
+
+
+def load(artifact_dir, backend='tflite', threads=None):
+    """
+    Load an export for inference.
+
+    :param artifact_dir: export directory
+    :type artifact_dir: str
+    :param backend: one of BACKENDS, defaults to 'tflite'
+    :type backend: str, optional
+    :param threads: TFLite interpreter threads, defaults to None
+    :type threads: int, optional
+    :raises ValueError: the export has no TFLite model
+    :return: the runner and the header
+    """
+    header = read_header(artifact_dir)
+
+    if backend == 'tflite':
+        if header['tflite'] is None:
+            raise ValueError("{} was exported without a TFLite model".format(artifact_dir))
+        runner = TFLiteRunner(os.path.join(artifact_dir, header['tflite']), threads)
+    else:
+        runner = SavedModelRunner(os.path.join(artifact_dir, header['saved_model']))
+
+    return runner, header
+
+
+def accuracy_report(artifact_dir, data, labels, backends=None, reference=True, threads=None):
+    """
+    Run the eval data through each backend of an export and the checkpoint
+    it came from, and report how much accuracy the export lost.
+
+    :param artifact_dir: export directory
+    :type artifact_dir: str
+    :param data: encoded probes
+    :type data: numpy.array
+    :param labels: labels as ints
+    :type labels: numpy.array
+    :param backends: backends to run, defaults to all the export has
+    :type backends: list, optional
+    :param reference: run the checkpoint too if it is still there, defaults to True
+    :type reference: bool, optional
+    :param threads: TFLite interpreter threads, defaults to None
+    :type threads: int, optional
+    :return: accuracy and time for each model, and the delta against the checkpoint
+    :rtype: dict
+    """
+    header = read_header(artifact_dir)
+    if backends is None:
+        backends = [b for b in BACKENDS if b != 'tflite' or header['tflite'] is not None]
+
+    data = data[:, :header['input_len']]
+    labels = np.asarray(labels)
+
+    def run(name, predict):
+        time1 = time.time()
+        predictions = predict(data)
+        time2 = time.time()
+        report['models'][name] = {
+            'accuracy': float(np.mean(np.argmax(predictions, axis=1) == labels)),
+            'time': time2 - time1
+        }
+        logger.info("{}: accuracy {:.4f} time {:.2f}s".format(name, report['models'][name]['accuracy'], time2 - time1))
+
+    report = {'artifact': os.path.abspath(artifact_dir), 'quantize': header['quantize'], 'rows': len(data), 'models': dict()}
+
+    for backend in backends:
+        runner, _ = load(artifact_dir, backend, threads)
+        run(backend, runner.predict)
+
+    if reference and os.path.exists(header['checkpoint_dir']):
+        tf.keras.backend.clear_session()
+        tf.keras.backend.set_learning_phase(0)
+        model, _ = rnn.load_model(header['checkpoint_dir'], header['vocab_len'], header['input_len'], cpu=True)
+        run('checkpoint', model.predict)
+
+        report['delta'] = dict()
+        for backend in backends:
+            report['delta'][backend] = report['models'][backend]['accuracy'] - report['models']['checkpoint']['accuracy']
+    elif reference:
+        logger.warning("checkpoint {} is gone, no accuracy delta".format(header['checkpoint_dir']))
+
+    return report
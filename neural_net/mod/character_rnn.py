@@ -18,8 +18,12 @@ import tensorflow as tf
 import numpy as np
 import os
 import io
+import csv
+import json
+import resource
 import time 
 import cowsay
+import report
  
 #from tensorflow.keras.callbacks import TensorBoard
 from common import TermColors
@@ -35,9 +39,17 @@ from common import TermColors
 #LAYERS = [450, 350, 350, 350, 100, 100]
 
 
+# learning rate never goes under this
+MIN_LR = 0.00001
+
+# how much ReduceLROnPlateau cuts the learning rate by
+LR_FACTOR = 0.5
+
+
 def scheduler(epoch):
     """
     learning rate scheduler.
+    Past epoch 19 the line goes to 0 and then negative, so it is floored at MIN_LR.
     
     :param epoch: number of epochs
     :type epoch: int
@@ -45,28 +57,251 @@ def scheduler(epoch):
     if epoch < 10:
         return 0.001
     else:
-        return 0.001 - (.00005 * epoch)
+        return max(0.001 - (.00005 * epoch), MIN_LR)
+
+
+def training_callbacks(sparse=False, patience=0, lr_patience=0, lr_factor=LR_FACTOR, min_lr=MIN_LR):
+    """
+    The callbacks that decide how training goes, on top of the checkpoint.
+
+    With lr_patience the learning rate is cut by lr_factor every time the 
+    validation accuracy stalls that many epochs, otherwise the fixed 
+    scheduler is used. With patience training stops once the validation 
+    accuracy hasn't improved in that many epochs and the best weights are 
+    put back in the model.
+
+    :param sparse: labels are ints not one hot, defaults to False
+    :type sparse: bool, optional
+    :param patience: epochs without improvement before stopping, defaults to 0 (never stop)
+    :type patience: int, optional
+    :param lr_patience: epochs without improvement before cutting the learning rate, defaults to 0 (use scheduler)
+    :type lr_patience: int, optional
+    :param lr_factor: multiply the learning rate by this on a plateau, defaults to LR_FACTOR
+    :type lr_factor: float, optional
+    :param min_lr: learning rate floor, defaults to MIN_LR
+    :type min_lr: float, optional
+    :return: callbacks
+    :rtype: list
+    """
+    monitor = 'val_' + accuracy_metric(sparse)
+    callbacks = []
+
+    if lr_patience > 0:
+        callbacks.append(tf.keras.callbacks.ReduceLROnPlateau(monitor=monitor, mode='max', factor=lr_factor, 
+                                                              patience=lr_patience, min_lr=min_lr, verbose=1))
+    else:
+        # Learning rate scheduler tapers off the amout of stuff it can forget towards the end 
+        callbacks.append(tf.keras.callbacks.LearningRateScheduler(lambda epoch: max(scheduler(epoch), min_lr)))
+
+    if patience > 0:
+        try:
+            early_stopping = tf.keras.callbacks.EarlyStopping(monitor=monitor, mode='max', patience=patience, 
+                                                              restore_best_weights=True, verbose=1)
+        except TypeError:
+            # older keras can't restore, the best checkpoint is still on disk
+            early_stopping = tf.keras.callbacks.EarlyStopping(monitor=monitor, mode='max', patience=patience, verbose=1)
+        callbacks.append(early_stopping)
+
+    return callbacks
+
+
+# written to the checkpoint dir every epoch
+THROUGHPUT_FILE = 'THROUGHPUT'
+
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """
+    Log how fast training goes, one row per epoch to THROUGHPUT.csv and 
+    THROUGHPUT.jsonl in the checkpoint dir. Rows are appended, so a run 
+    continued with --keep_training carries on in the same files.
+
+    Each row has the epoch wall time (with validation) and the time spent 
+    on training batches, samples per second, batch latency percentiles, 
+    peak RSS of the process, the learning rate the epoch ran with and 
+    whatever keras logged.
+
+    Keep it after the learning rate callbacks so the epoch's rate is set
+    by the time it is read.
+
+    When fit runs a tf.data dataset with steps_per_epoch keras logs a 
+    size of 1 per batch, so pass the batch size for those and every step
+    is counted as a full batch (make_dataset repeats before batching).
+
+    :param checkpoint_dir: where the files go
+    :type checkpoint_dir: str
+    :param batch_size: samples in every batch, defaults to None (what keras logs)
+    :type batch_size: int, optional
+    """
+    FIELDS = ['epoch', 'epoch_time', 'train_time', 'samples', 'samples_per_sec', 'batch_p50_ms', 'batch_p90_ms', 'batch_p99_ms', 
+              'peak_rss_mb', 'lr']
+
+    def __init__(self, checkpoint_dir, batch_size=None):
+        super(ThroughputLogger, self).__init__()
+        self.batch_size = batch_size
+        self.csv_file = os.path.join(checkpoint_dir, THROUGHPUT_FILE + '.csv')
+        self.jsonl_file = os.path.join(checkpoint_dir, THROUGHPUT_FILE + '.jsonl')
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.lr = float(tf.keras.backend.get_value(self.model.optimizer.lr))
+        self.batch_times = []
+        self.samples = 0
+        self.epoch_start = time.time()
+        self.train_end = self.epoch_start
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.time()
+
+    def on_batch_end(self, batch, logs=None):
+        self.train_end = time.time()
+        self.batch_times.append(self.train_end - self.batch_start)
+        if self.batch_size:
+            self.samples += self.batch_size
+        else:
+            self.samples += (logs or dict()).get('size', self.params.get('batch_size') or 0)
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = time.time() - self.epoch_start
+        train_time = self.train_end - self.epoch_start
+        batch_times = np.array(self.batch_times or [0.0]) * 1000
+        row = {
+            'epoch': epoch,
+            'epoch_time': epoch_time,
+            'train_time': train_time,
+            'samples': int(self.samples),
+            'samples_per_sec': self.samples / train_time if train_time > 0 else 0.0,
+            'batch_p50_ms': float(np.percentile(batch_times, 50)),
+            'batch_p90_ms': float(np.percentile(batch_times, 90)),
+            'batch_p99_ms': float(np.percentile(batch_times, 99)),
+            # ru_maxrss is kB on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'lr': self.lr
+        }
+        for key, value in sorted((logs or dict()).items()):
+            row.setdefault(key, float(value))
+        self.write(row)
+
+    def write(self, row):
+        """
+        Append a row to both files. The csv keeps the columns it was started with.
+
+        :param row: the epoch
+        :type row: dict
+        """
+        with open(self.jsonl_file, 'a') as f:
+            f.write(json.dumps(row) + '\n')
+
+        if os.path.exists(self.csv_file) and os.path.getsize(self.csv_file) > 0:
+            with open(self.csv_file, 'r', newline='') as f:
+                fields = next(csv.reader(f))
+            header = False
+        else:
+            fields = self.FIELDS + sorted(key for key in row if key not in self.FIELDS)
+            header = True
+
+        with open(self.csv_file, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            if header:
+                writer.writeheader()
+            writer.writerow(row)
+
+
+MODEL_TYPES = ['gru', 'tcn']
+
+EMBEDDING_DIM = 4
+
+
+def model_inputs(vocab_len, input_len, rle=False):
+    """
+    The input and embedding for the functional models.
+
+    A run length encoded probe comes in as (runs, 2), the symbol and the 
+    run length. The symbol is embedded and log(1 + run length) is tacked 
+    on as one more channel, so the layers after see EMBEDDING_DIM + 1.
+
+    :param vocab_len: Number of unique characters in the probe
+    :type vocab_len: int
+    :param input_len: Number of characters (or runs) in the probe
+    :type input_len: int
+    :param rle: the probe is run length encoded, defaults to False
+    :type rle: bool, optional
+    :return: the input and the embedded sequence
+    """
+    embedding = tf.keras.layers.Embedding(vocab_len, EMBEDDING_DIM, input_length=input_len, embeddings_initializer='glorot_uniform')
+
+    if not rle:
+        inputs = tf.keras.layers.Input(shape=(input_len,))
+        return inputs, embedding(inputs)
+
+    inputs = tf.keras.layers.Input(shape=(input_len, 2))
+    symbols = tf.keras.layers.Lambda(lambda t: t[:, :, 0])(inputs)
+    runs = tf.keras.layers.Lambda(lambda t: tf.log1p(t[:, :, 1:]))(inputs)
+    return inputs, tf.keras.layers.Concatenate()([embedding(symbols), runs])
+
 
 # Feel free to change these hyperparameters
-def build_model(vocab_len, input_len):
+def build_model(vocab_len, input_len, cpu=False, unroll=False, model_type='gru', rle=False, stateful=False, batch_size=None):
     """
     Build the model.
+
+    The cpu model swaps CuDNNGRU for the plain GRU set up the same way 
+    cuDNN does it (reset_after, sigmoid gates) so it can run without a 
+    GPU and take the weights of a CuDNNGRU model, see load_model.
+    The run length encoded model takes a second channel, see model_inputs.
     
     :param vocab_len: Number of unique characters in the probe
     :type vocab_len: int
     :param input_len: Number of characters in the probe
     :type input_len: int
+    :param cpu: build the cpu compatible model, defaults to False
+    :type cpu: bool, optional
+    :param unroll: unroll the cpu GRUs (no while loop, for TFLite), defaults to False
+    :type unroll: bool, optional
+    :param model_type: one of MODEL_TYPES, defaults to 'gru'
+    :type model_type: str, optional
+    :param rle: the probes are run length encoded, defaults to False
+    :type rle: bool, optional
+    :param stateful: keep the GRU state between calls (see streaming), defaults to False
+    :type stateful: bool, optional
+    :param batch_size: fixed batch size, needed with stateful, defaults to None
+    :type batch_size: int, optional
     :return: the model 
     """
-    model = tf.keras.Sequential([
-        tf.keras.layers.Embedding(vocab_len, 4, input_length=input_len, embeddings_initializer='glorot_uniform'),
-        tf.keras.layers.CuDNNGRU(400, return_sequences=True),
-        tf.keras.layers.CuDNNGRU(400, return_sequences=True),
-        tf.keras.layers.CuDNNGRU(400),
+    if model_type == 'tcn':
+        if stateful:
+            raise ValueError("only the gru model can be stateful")
+        return build_tcn_model(vocab_len, input_len, rle=rle)
+    if stateful and rle:
+        raise ValueError("the run length encoded model can not be stateful")
+
+    if cpu:
+        def gru(units, return_sequences=False):
+            return tf.keras.layers.GRU(units, return_sequences=return_sequences, reset_after=True, recurrent_activation='sigmoid', 
+                                       unroll=unroll, stateful=stateful)
+    else:
+        def gru(units, return_sequences=False):
+            return tf.keras.layers.CuDNNGRU(units, return_sequences=return_sequences, stateful=stateful)
+
+    layers = [
+        gru(400, return_sequences=True),
+        gru(400, return_sequences=True),
+        gru(400),
         tf.keras.layers.Dense(100, activation='relu'),
         tf.keras.layers.Dropout(0.5),
         tf.keras.layers.Dense(100, activation='softmax')
-    ])    
+    ]
+
+    if rle:
+        inputs, x = model_inputs(vocab_len, input_len, rle)
+        for layer in layers:
+            x = layer(x)
+        model = tf.keras.Model(inputs=inputs, outputs=x)
+    else:
+        if stateful:
+            # fixed batch, any number of steps per call
+            embedding = tf.keras.layers.Embedding(vocab_len, EMBEDDING_DIM, batch_input_shape=(batch_size, None), embeddings_initializer='glorot_uniform')
+        else:
+            embedding = tf.keras.layers.Embedding(vocab_len, EMBEDDING_DIM, input_length=input_len, embeddings_initializer='glorot_uniform')
+        model = tf.keras.Sequential([embedding] + layers)
 
     # some hacks to print out the model
     tmp_smry = io.StringIO()
@@ -75,35 +310,359 @@ def build_model(vocab_len, input_len):
     return model, summary
 
 
-def compile_model(model, loss='categorical_crossentropy', optimizer='adam', metrics=['categorical_accuracy']):
+# Feel free to change these hyperparameters
+def build_tcn_model(vocab_len, input_len, filters=128, kernel_size=3, dilations=(1, 2, 4, 8, 16, 32, 64, 128), rle=False):
+    """
+    Build the temporal convolution model.
+
+    Residual blocks of two causal dilated Conv1Ds, the dilation doubles 
+    every block so with the defaults the last step sees 
+    1 + 2 * (kernel_size - 1) * sum(dilations) = 1021 characters back, 
+    more than a 450 character probe. The last step goes into the same 
+    head as the GRU model. Every step is computed at once so it trains 
+    and runs a lot faster than the GRUs, on the cpu too.
+
+    :param vocab_len: Number of unique characters in the probe
+    :type vocab_len: int
+    :param input_len: Number of characters in the probe
+    :type input_len: int
+    :param filters: channels in each block, defaults to 128
+    :type filters: int, optional
+    :param kernel_size: conv width, defaults to 3
+    :type kernel_size: int, optional
+    :param dilations: one block per dilation
+    :type dilations: tuple, optional
+    :param rle: the probes are run length encoded, defaults to False
+    :type rle: bool, optional
+    :return: the model 
+    """
+    inputs, x = model_inputs(vocab_len, input_len, rle)
+
+    for dilation in dilations:
+        y = tf.keras.layers.Conv1D(filters, kernel_size, padding='causal', dilation_rate=dilation, activation='relu')(x)
+        y = tf.keras.layers.Conv1D(filters, kernel_size, padding='causal', dilation_rate=dilation, activation='relu')(y)
+        if x.shape[-1] != filters:
+            # 1x1 conv so the skip matches the channels
+            x = tf.keras.layers.Conv1D(filters, 1)(x)
+        x = tf.keras.layers.Add()([x, y])
+
+    x = tf.keras.layers.Lambda(lambda t: t[:, -1, :])(x)
+    x = tf.keras.layers.Dense(100, activation='relu')(x)
+    x = tf.keras.layers.Dropout(0.5)(x)
+    outputs = tf.keras.layers.Dense(100, activation='softmax')(x)
+    model = tf.keras.Model(inputs=inputs, outputs=outputs)
+
+    # some hacks to print out the model
+    tmp_smry = io.StringIO()
+    model.summary(print_fn=lambda x: tmp_smry.write(x + '\n'))
+    summary = tmp_smry.getvalue() 
+    return model, summary
+
+
+def checkpoint_model_type(checkpoint_dir):
+    """
+    Which of MODEL_TYPES wrote this checkpoint, only the tcn has 3-d (conv) kernels.
+
+    :param checkpoint_dir: checkpoint directory 
+    :type checkpoint_dir: str
+    :return: the model type
+    :rtype: str
+    """
+    checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    for name, shape in tf.train.list_variables(checkpoint):
+        if 'kernel' in name and len(shape) == 3:
+            return 'tcn'
+    return 'gru'
+
+
+def checkpoint_is_rle(checkpoint_dir):
+    """
+    Was this checkpoint trained on run length encoded probes. Only then 
+    does a layer take EMBEDDING_DIM + 1 channels, see model_inputs.
+
+    :param checkpoint_dir: checkpoint directory 
+    :type checkpoint_dir: str
+    :return: True for run length encoded
+    :rtype: bool
+    """
+    checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    for name, shape in tf.train.list_variables(checkpoint):
+        if 'kernel' in name and len(shape) >= 2 and shape[-2] == EMBEDDING_DIM + 1:
+            return True
+    return False
+
+
+def convert_gru_weights(weights, from_cudnn=True):
+    """
+    Convert GRU weights between CuDNNGRU and GRU(reset_after=True).
+
+    Same conversion keras does when loading h5 weights across the two. 
+    CuDNNGRU hands its kernels to cuDNN flattened as they are, so the 
+    input kernel of each gate is stored as the cuDNN (units, input) 
+    matrix read back in (input, units) shape and the recurrent kernels 
+    are transposed. The six bias vectors become a (2, 3 * units) matrix.
+
+    :param weights: [kernel, recurrent_kernel, bias] from get_weights
+    :type weights: list of numpy.array
+    :param from_cudnn: CuDNNGRU => GRU, defaults to True (False goes back)
+    :type from_cudnn: bool, optional
+    :return: converted weights
+    :rtype: list of numpy.array
+    """
+    order = 'F' if from_cudnn else 'C'
+
+    def transform_kernels(kernels, func):
+        return np.hstack([func(k) for k in np.hsplit(kernels, 3)])
+
+    kernel = transform_kernels(weights[0], lambda k: k.T.reshape(k.shape, order=order))
+    recurrent_kernel = transform_kernels(weights[1], lambda k: k.T)
+    bias = np.array(weights[2]).reshape((2, -1) if from_cudnn else -1)
+
+    return [kernel, recurrent_kernel, bias]
+
+
+def checkpoint_is_cudnn(checkpoint):
+    """
+    Was this checkpoint written by the CuDNNGRU model.
+    A GRU(reset_after=True) bias is 2-d, every CuDNNGRU and Dense bias is 1-d.
+
+    :param checkpoint: checkpoint prefix
+    :type checkpoint: str
+    :return: True for cuDNN weights
+    :rtype: bool
+    """
+    for name, shape in tf.train.list_variables(checkpoint):
+        if 'bias' in name and len(shape) == 2:
+            return False
+    return True
+
+
+def checkpoint_vocab_len(checkpoint_dir):
+    """
+    Read the vocab size the model was built with out of the embedding 
+    in the latest checkpoint.
+
+    :param checkpoint_dir: checkpoint directory 
+    :type checkpoint_dir: str
+    :raises ValueError: no embedding in the checkpoint
+    :return: vocab_len for build_model
+    :rtype: int
+    """
+    checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    for name, shape in tf.train.list_variables(checkpoint):
+        if 'embeddings' in name and 'OPTIMIZER_SLOT' not in name and len(shape) == 2:
+            return shape[0]
+    raise ValueError("no embedding found in: {}".format(checkpoint))
+
+
+def load_model(checkpoint_dir, vocab_len, input_len, cpu=False, unroll=False, model_type=None, rle=None, stateful=False, batch_size=None):
+    """
+    Build the model and load the latest checkpoint into it.
+
+    If the checkpoint came from the other kind of model the weights are 
+    converted on the way in. The CuDNNGRU model can be built and restored 
+    on a machine without a GPU, it just can't be run.
+
+    :param checkpoint_dir: checkpoint directory 
+    :type checkpoint_dir: str
+    :param vocab_len: Number of unique characters in the probe
+    :type vocab_len: int
+    :param input_len: Number of characters in the probe
+    :type input_len: int
+    :param cpu: build the cpu compatible model, defaults to False
+    :type cpu: bool, optional
+    :param unroll: unroll the cpu GRUs, defaults to False
+    :type unroll: bool, optional
+    :param model_type: one of MODEL_TYPES, defaults to None (whatever wrote the checkpoint)
+    :type model_type: str, optional
+    :param rle: run length encoded model, defaults to None (whatever wrote the checkpoint)
+    :type rle: bool, optional
+    :param stateful: build the stateful model, defaults to False
+    :type stateful: bool, optional
+    :param batch_size: fixed batch size for the stateful model, defaults to None
+    :type batch_size: int, optional
+    :return: the model and summary
+    """
+    checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+    if model_type is None:
+        model_type = checkpoint_model_type(checkpoint_dir)
+    if rle is None:
+        rle = checkpoint_is_rle(checkpoint_dir)
+    model, model_summary = build_model(vocab_len, input_len, cpu, unroll, model_type, rle, stateful, batch_size)
+
+    if model_type == 'tcn':
+        # same layers on the cpu and gpu
+        model.load_weights(checkpoint)
+        return model, model_summary
+
+    from_cudnn = checkpoint_is_cudnn(checkpoint)
+    if from_cudnn != cpu:
+        model.load_weights(checkpoint)
+        return model, model_summary
+
+    tf.logging.info("converting {} weights".format("CuDNNGRU => GRU" if from_cudnn else "GRU => CuDNNGRU"))
+    source_model, _ = build_model(vocab_len, input_len, cpu=not cpu, rle=rle, stateful=stateful, batch_size=batch_size)
+    source_model.load_weights(checkpoint)
+
+    for source_layer, layer in zip(source_model.layers, model.layers):
+        weights = source_layer.get_weights()
+        if isinstance(source_layer, (tf.keras.layers.GRU, tf.keras.layers.CuDNNGRU)):
+            weights = convert_gru_weights(weights, from_cudnn)
+        layer.set_weights(weights)
+
+    return model, model_summary
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """
+    Set the TF thread pools for the keras session.
+    
+    :param intra_op: threads inside one op (the GRU matmuls), defaults to one per core
+    :type intra_op: int, optional
+    :param inter_op: ops run at once, defaults to 2 (the graph is mostly a chain)
+    :type inter_op: int, optional
+    """
+    if intra_op is None:
+        intra_op = os.cpu_count() or 1
+    if inter_op is None:
+        inter_op = 2
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op, inter_op_parallelism_threads=inter_op)
+    tf.keras.backend.set_session(tf.Session(config=config))
+    tf.logging.debug("threads intra_op: {} inter_op: {}".format(intra_op, inter_op))
+
+
+def gpu_available():
+    """
+    Is there a GPU to run the CuDNNGRU model on.
+
+    :return: True if there is
+    :rtype: bool
+    """
+    return tf.test.is_gpu_available(cuda_only=True)
+
+
+def benchmark_inference(model, data, batch_size=256, samples=100):
+    """
+    Time a model on single traces and on batches.
+
+    :param model: a loaded model
+    :param data: encoded probes
+    :type data: numpy.array
+    :param batch_size: batch size for the throughput run, defaults to 256
+    :type batch_size: int, optional
+    :param samples: number of single trace runs, defaults to 100
+    :type samples: int, optional
+    :return: median and p90 latency (s) per trace and traces per second
+    :rtype: dict
+    """
+    # warm up, the first call builds the predict function
+    model.predict(data[:1])
+
+    latencies = []
+    for i in range(0, min(samples, len(data))):
+        time1 = time.time()
+        model.predict(data[i:i + 1])
+        time2 = time.time()
+        latencies.append(time2 - time1)
+
+    batch = data[:batch_size]
+    time1 = time.time()
+    model.predict(batch, batch_size=batch_size)
+    time2 = time.time()
+
+    results = dict()
+    results['latency_p50'] = float(np.percentile(latencies, 50))
+    results['latency_p90'] = float(np.percentile(latencies, 90))
+    results['throughput'] = len(batch) / (time2 - time1)
+
+    return results
+
+
+def benchmark_training(model, data, labels, batch_size=32, steps=20):
+    """
+    Time training steps on a compiled model, after one warm up step.
+
+    :param model: a compiled model
+    :param data: encoded probes
+    :type data: numpy.array
+    :param labels: labels that match how the model was compiled
+    :type labels: numpy.array
+    :param batch_size: batch size, defaults to 32
+    :type batch_size: int, optional
+    :param steps: number of timed steps, defaults to 20
+    :type steps: int, optional
+    :return: traces per second
+    :rtype: float
+    """
+    batches = max(1, len(data) // batch_size)
+    model.train_on_batch(data[:batch_size], labels[:batch_size])
+
+    time1 = time.time()
+    for step in range(0, steps):
+        start = (step % batches) * batch_size
+        model.train_on_batch(data[start:start + batch_size], labels[start:start + batch_size])
+    time2 = time.time()
+
+    return steps * batch_size / (time2 - time1)
+
+
+def accuracy_metric(sparse=False):
+    """
+    Name of the accuracy metric for the label format.
+    
+    :param sparse: labels are ints not one hot, defaults to False
+    :type sparse: bool, optional
+    :return: metric name (prefix with val_ for the validation set)
+    :rtype: str
+    """
+    if sparse:
+        return 'sparse_categorical_accuracy'
+    else:
+        return 'categorical_accuracy'
+
+
+def compile_model(model, loss=None, optimizer='adam', metrics=None, sparse=False):
     """
     Compile the model.
     
     :param model: model form build_model
-    :param loss: lost fucntion, defaults to 'categorical_crossentropy'
+    :param loss: lost fucntion, defaults to categorical_crossentropy (sparse_ when sparse)
     :type loss: str, optional
     :param optimizer: optimizer sinstance, defaults to 'adam'
     :type optimizer: str, optional
-    :param metrics: metrics to be evaluated by the model, defaults to ['categorical_accuracy']
+    :param metrics: metrics to be evaluated by the model, defaults to [accuracy_metric(sparse)]
     :type metrics: list, optional
+    :param sparse: labels are ints not one hot, defaults to False
+    :type sparse: bool, optional
     :return: compiled model
     """
+    if loss is None:
+        loss = 'sparse_categorical_crossentropy' if sparse else 'categorical_crossentropy'
+    if metrics is None:
+        metrics = [accuracy_metric(sparse)]
+
     model.compile(loss=loss,
               optimizer=optimizer,
               metrics=metrics)
     return model 
 
 
-def train_and_validate(train_data, train_labels, val_data, val_labels, epochs, checkpoint_dir, continue_training=False):
+def train_and_validate(train_data, train_labels, val_data, val_labels, epochs, checkpoint_dir, continue_training=False, sparse=False, 
+                       steps_per_epoch=None, validation_steps=None, input_dims=None, patience=0, lr_patience=0, 
+                       lr_factor=LR_FACTOR, min_lr=MIN_LR, model_type='gru', rle=None, cpu=False, batch_size=None):
     """
     Train the model and also pass validataion set.
+    train_data and val_data can also be tf.data datasets or IndexedBatches 
+    (see input_pipeline), then the labels are None and input_dims must be set. 
+    A dataset also needs the steps.
     
     :param train_data: training data
-    :type train_data: numpy.array 
+    :type train_data: numpy.array, tf.data.Dataset or IndexedBatches
     :param train_labels: training labels 
     :type train_labels: numpy.array
     :param val_data: validataion data 
-    :type val_data: numpy.array 
+    :type val_data: numpy.array, tf.data.Dataset or IndexedBatches
     :param val_labels: validatiaon labels
     :type val_labels: numpy.array
     :param epochs: number of epochs
@@ -112,10 +671,39 @@ def train_and_validate(train_data, train_labels, val_data, val_labels, epochs, c
     :type checkpoint_dir: str
     :param continue_training: load weights and continue trining, defaults to False
     :type continue_training: bool, optional
+    :param sparse: labels are ints not one hot, defaults to False
+    :type sparse: bool, optional
+    :param steps_per_epoch: batches per epoch for a dataset, defaults to None
+    :type steps_per_epoch: int, optional
+    :param validation_steps: validation batches for a dataset, defaults to None
+    :type validation_steps: int, optional
+    :param input_dims: (vocab_len, input_len), defaults to None (taken from train_data)
+    :type input_dims: tuple, optional
+    :param patience: stop after this many epochs without improvement, defaults to 0 (never)
+    :type patience: int, optional
+    :param lr_patience: cut the learning rate after this many, defaults to 0 (use scheduler)
+    :type lr_patience: int, optional
+    :param lr_factor: how much to cut the learning rate by, defaults to LR_FACTOR
+    :type lr_factor: float, optional
+    :param min_lr: learning rate floor, defaults to MIN_LR
+    :type min_lr: float, optional
+    :param model_type: one of MODEL_TYPES, defaults to 'gru'
+    :type model_type: str, optional
+    :param rle: run length encoded probes, defaults to None (3-d train_data)
+    :type rle: bool, optional
+    :param cpu: train the cpu GRU instead of CuDNNGRU, defaults to False
+    :type cpu: bool, optional
+    :param batch_size: batch size of a tf.data dataset, for the throughput log, defaults to None
+    :type batch_size: int, optional
     :return: model histroy and summary
     """
-    model, model_summary = build_model(len(set(train_data[0])), train_data.shape[1])
-    model = compile_model(model, optimizer=tf.keras.optimizers.Nadam())
+    if rle is None:
+        rle = getattr(train_data, 'ndim', 0) == 3
+    if input_dims is None:
+        symbols = train_data[0][:, 0] if rle else train_data[0]
+        input_dims = (len(set(symbols)), train_data.shape[1])
+    model, model_summary = build_model(*input_dims, cpu=cpu, model_type=model_type, rle=rle)
+    model = compile_model(model, optimizer=tf.keras.optimizers.Nadam(), sparse=sparse)
 
     tf.logging.debug(model_summary)
     
@@ -123,7 +711,7 @@ def train_and_validate(train_data, train_labels, val_data, val_labels, epochs, c
     checkpoint_prefix = os.path.join(checkpoint_dir, "ckpt_{epoch}")
     checkpoint_callback=tf.keras.callbacks.ModelCheckpoint(
         filepath=checkpoint_prefix,
-        monitor='val_categorical_accuracy',
+        monitor='val_' + accuracy_metric(sparse),
         save_best_only=True,
         save_weights_only=True,
         mode='max')
@@ -132,18 +720,29 @@ def train_and_validate(train_data, train_labels, val_data, val_labels, epochs, c
     if continue_training == True:
         model.load_weights(tf.train.latest_checkpoint(checkpoint_dir))
 
-    # Learning rate scheduler tapers off the amout of stuff it can forget towards the end 
-    scheduler_callback = tf.keras.callbacks.LearningRateScheduler(scheduler)
+    callbacks = [checkpoint_callback] + training_callbacks(sparse, patience, lr_patience, lr_factor, min_lr) + [ThroughputLogger(checkpoint_dir, batch_size)]
     tf.logging.debug("{} {}".format(epochs, type(epochs)) ) 
     # fit the model 
-    history = model.fit(train_data, train_labels, epochs=epochs, callbacks=[checkpoint_callback, scheduler_callback], validation_data=(val_data, val_labels), verbose=1)
+    if val_labels is not None:
+        val_data = (val_data, val_labels)
+    if isinstance(train_data, tf.keras.utils.Sequence):
+        # batches are gathered as they are needed
+        history = model.fit_generator(train_data, epochs=epochs, callbacks=callbacks, 
+                                      validation_data=val_data, verbose=1)
+        return history, model_summary
+
+    history = model.fit(train_data, train_labels, epochs=epochs, steps_per_epoch=steps_per_epoch, callbacks=callbacks, 
+                        validation_data=val_data, validation_steps=validation_steps, verbose=1)
 
     return history, model_summary
 
 
-def eval(test_data, test_labels, checkpoint_dir, target_dict=None, original_test_labels=None, show_results=True): 
+def eval(test_data, test_labels, checkpoint_dir, target_dict=None, original_test_labels=None, show_results=True, sparse=False, cpu=False, 
+         model_type=None, top_k=report.TOP_K, report_file=None, batch_size=256): 
     """
     Evaluate the model.
+    There is one pass over the data, the loss, accuracy, top k accuracy,
+    confusion matrix and per url precision/recall all come from the same predictions.
     show_results will print more verbose infomation about how the model performed. 
     
     :param test_data: test data
@@ -158,61 +757,62 @@ def eval(test_data, test_labels, checkpoint_dir, target_dict=None, original_test
     :type original_test_labels: numpy.array, optional
     :param show_results: show the guesses from the model, defaults to True
     :type show_results: bool, optional
+    :param sparse: test_labels are ints not one hot, defaults to False
+    :type sparse: bool, optional
+    :param cpu: use the cpu model, defaults to False
+    :type cpu: bool, optional
+    :param model_type: one of MODEL_TYPES, defaults to None (whatever wrote the checkpoint)
+    :type model_type: str, optional
+    :param top_k: k for the top k accuracy, defaults to report.TOP_K
+    :type top_k: int, optional
+    :param report_file: write the report to this json file (and a csv next to it), defaults to None
+    :type report_file: str, optional
+    :param batch_size: batch size for the predictions, defaults to 256
+    :type batch_size: int, optional
     :raises ValueError: Data dict must be set when dhow results is choosen
-    :return: metrics
+    :return: metrics, [loss, accuracy] same as model.evaluate
     """
     if show_results == True and (target_dict is None or original_test_labels is None):
         raise ValueError("In order to show resulst target_dict and original_test_label must be set")
   
     # set up the model load the weights  
-    model, model_summary = build_model(len(set(test_data[0])), test_data.shape[1])
-    model = compile_model(model)
-    model.load_weights(tf.train.latest_checkpoint(checkpoint_dir))
+    model, model_summary = load_model(checkpoint_dir, checkpoint_vocab_len(checkpoint_dir), test_data.shape[1], cpu, model_type=model_type)
 
     tf.logging.debug(model_summary)
     
-    # evaluate the model
-    metrics = model.evaluate(test_data, test_labels, verbose=2)
-
     # get the predictions 
+    time1 = time.time()
+    predictions = model.predict(test_data, batch_size=batch_size)
+    time2 = time.time()
+    tf.logging.debug("time: {}".format(time2 - time1))
+
+    labels = original_test_labels if original_test_labels is not None else test_labels
+    results = report.classification_report(predictions, labels, top_k)
+    results['time'] = time2 - time1
+    results['throughput'] = len(test_data) / max(time2 - time1, 1e-9)
+    print("loss: {:.4f} - acc: {:.4f} - top {} acc: {:.4f} - {:.1f} traces/s".format(results['loss'], results['accuracy'], top_k, 
+                                                                                    results['top_k_accuracy'], results['throughput']))
+
     if show_results == True:
-        time1 = time.time()
-        predictions = model.predict(test_data)
-        time2 = time.time()
-        tf.logging.debug("time: {}".format(time2 - time1))
-
-        total = 0 
-        correct = 0 
-
-        result = []
-        incorrect = []
-
-        for (prediction, origonal_test_label) in zip(predictions, original_test_labels):
-            # get the guess 
-            guess = np.argmax(prediction.flatten())
-            result.append([(origonal_test_label, target_dict[origonal_test_label]), (guess, target_dict[guess])])
-            total += 1
-            if origonal_test_label == guess: 
-                correct += 1 
-            else:
-                incorrect.append([(origonal_test_label, target_dict[origonal_test_label]), (guess, target_dict[guess])])
- 
         print("RESULTS:")
-  
-        #for r in sorted(result):
-        #    print(r)
-   
-        print("correct: {}, total: {}, accuracy: {}".format(correct, total, correct/total))
+        print("correct: {}, total: {}, accuracy: {}".format(int(np.trace(results['confusion_matrix'])), results['rows'], results['accuracy']))
         print("HERE'S WHAT I MISSED:")
+        # worst recall first, only urls that were in the data
+        seen = np.flatnonzero(results['support'])
+        for label in seen[np.argsort(results['recall'][seen], kind='stable')][:10]:
+            if results['recall'][label] == 1:
+                break
+            print("  {} {} precision: {:.2f} recall: {:.2f} ({} traces)".format(label, target_dict.get(label), results['precision'][label], 
+                                                                               results['recall'][label], results['support'][label]))
+
+    if report_file is not None:
+        results['checkpoint_dir'] = checkpoint_dir
+        report.write_report(results, report_file, target_dict)
     
-        for w in sorted(incorrect):
-            #print(w)
-            pass
-    
-    return metrics
+    return [results['loss'], results['accuracy']]
 
 
-def predict(test_data, checkpoint_dir, target_dict, fun=False): 
+def predict(test_data, checkpoint_dir, target_dict, fun=False, cpu=False, model_type=None): 
     """
     Prints out a prediction for a given input.
     
@@ -224,10 +824,13 @@ def predict(test_data, checkpoint_dir, target_dict, fun=False):
     :type target_dict: dict
     :param fun: wanna have fun?
     :type fun: bool
+    :param cpu: use the cpu model, defaults to False
+    :type cpu: bool, optional
+    :param model_type: one of MODEL_TYPES, defaults to None (whatever wrote the checkpoint)
+    :type model_type: str, optional
     """
-    model, model_summary = build_model(len(set(test_data[0])), test_data.shape[1])
+    model, model_summary = load_model(checkpoint_dir, checkpoint_vocab_len(checkpoint_dir), test_data.shape[1], cpu, model_type=model_type)
     model = compile_model(model, optimizer=tf.keras.optimizers.Nadam())
-    model.load_weights(tf.train.latest_checkpoint(checkpoint_dir))
     
     tf.logging.debug(model_summary)
     
@@ -235,6 +838,20 @@ def predict(test_data, checkpoint_dir, target_dict, fun=False):
     predictions = model.predict(test_data)
     time2 = time.time()
     tf.logging.debug("time: {}".format(time2 - time1))
+    show_predictions(predictions, target_dict, fun)
+
+
+def show_predictions(predictions, target_dict, fun=False):
+    """
+    Print the best guess for each prediction.
+
+    :param predictions: model output, one row of probabilities per probe
+    :type predictions: numpy.array
+    :param target_dict: map between int and url 
+    :type target_dict: dict
+    :param fun: wanna have fun?
+    :type fun: bool
+    """
     result = []
 
     for prediction in predictions:
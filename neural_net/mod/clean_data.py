@@ -17,8 +17,10 @@ import json
 import os
 import logging
 import re
-import csv 
 import random 
+import time
+import concurrent.futures
+import itertools
 
 import common
 
@@ -39,28 +41,93 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
+# rows are gathered up to about this many bytes before they hit the file
+WRITE_BUFFER_SIZE = 1 << 22
+
+# same line ending csv.writer uses
+LINE_END = '\r\n'
+
+
 def to_string(list1, length):
     """
     Convert array to string.
 
-    :param list1: the list of characters
-    :type list1: list
+    :param list1: the probe, or a list of characters
+    :type list1: str or list
     :param length: truncation length
     :type length: int
     :return: the return string
     :rtype: str
     """
-    str1 = ''.join(str(e) for e in list1)
+    if not isinstance(list1, str):
+        list1 = ''.join(str(e) for e in list1)
     # Truncate the data 
     # may also want to have a floor function here 
-    str1 = ((str1[:length]) if len(str1) > length else str1) 
-    # str1 = str1.replace('',' ').strip()
-    return str1
+    return list1[:length]
+
+
+class RowWriter:
+    """
+    Buffered csv row writer that keeps its file open for the whole run.
+
+    Rows are plain comma joined strings, the probes never need quoting, so
+    this writes exactly what csv.writer with QUOTE_NONE would. Rows are
+    gathered in memory and written out in large blocks.
+    """
+
+    def __init__(self, file_name, title_row, buffer_size=WRITE_BUFFER_SIZE):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.rows = 0
+        self._buffer = []
+        self._buffered = 0
+        self._file = open(file_name, 'w', buffering=buffer_size)
+        self._start = time.time()
+        self._file.write(','.join(title_row) + LINE_END)
+
+    def write(self, row):
+        """
+        Queue up a row.
+
+        :param row: the fields in the row
+        :type row: list of str
+        """
+        line = ','.join(row) + LINE_END
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self.rows += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything buffered so far.
+        """
+        self._file.write(''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
 
+    def close(self):
+        """
+        Flush, close the file and log how fast it went.
+        """
+        self.flush()
+        self._file.close()
+        elapsed = time.time() - self._start
+        rate = self.rows / elapsed if elapsed > 0 else float('inf')
+        logger.info("{}: {} rows in {:.3f}s ({:.0f} rows/s)".format(self.file_name, self.rows, elapsed, rate))
 
-def write_to_csv(data, meta, clean_dir, train_file, length, split=1, eval_file=None, metadata_file=None, spy_data=False):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_to_csv(data, meta, clean_dir, train_file, length, split=1, eval_file=None, metadata_file=None, spy_data=False, rle=False, keep=None):
     """
     Write the data to csv files.
+    Each output is opened once and written through a RowWriter.
     
     :param data: the probe data
     :type data: dict
@@ -80,8 +147,15 @@ def write_to_csv(data, meta, clean_dir, train_file, length, split=1, eval_file=N
     :type metadata_file: str, optional
     :param spy_data: new spy data, not eval dat no split, defaults to False
     :type spy_data: bool, optional
+    :param rle: the probes are [symbols, run lengths], a runs column is added, defaults to False
+    :type rle: bool, optional
+    :param keep: files in clean_dir to leave alone (the probe store), defaults to None
+    :type keep: list, optional
     :raises ValueError: spy data was selected, not all optisons were set
     :raises ValueError: spy data selected, too many options were set
+    :return: the (probe, label) rows written to train and eval, label is None for spy data.
+             With rle the rows are (symbols, label, run lengths)
+    :rtype: list, list
     """
     if not spy_data and (eval_file is None or metadata_file is None):
         raise ValueError("please specify all params")
@@ -89,7 +163,7 @@ def write_to_csv(data, meta, clean_dir, train_file, length, split=1, eval_file=N
         raise ValueError("incorect args")
 
     # delete old tsv's data,  
-    common.clean_dir(clean_dir) 
+    common.clean_dir(clean_dir, keep) 
 
     logger.info("writting new data")
     # logger.debug(data) 
@@ -99,98 +173,638 @@ def write_to_csv(data, meta, clean_dir, train_file, length, split=1, eval_file=N
         title_row = ['probe', 'label']
     else: 
         title_row = ['probe']
+    if rle:
+        title_row.append('runs')
+
+    def row(probe, label=None):
+        # the csv row and the row handed back
+        if not rle:
+            probe = to_string(probe, length)
+            return ([probe] if label is None else [probe, str(label)]), (probe, label)
+        symbols = probe[0][:length]
+        runs = probe[1][:length]
+        csv_row = [symbols] if label is None else [symbols, str(label)]
+        csv_row.append(RUN_SEPARATOR.join(str(r) for r in runs))
+        return csv_row, (symbols, label, runs)
 
-    csv.register_dialect('myDialect', delimiter = ',', quoting=csv.QUOTE_NONE, skipinitialspace=True) 
-    
-    train_line = 0
-    eval_line = 0
-    
     # save metadata
     if spy_data == False:
         with open(metadata_file, 'w') as metadata: 
             json.dump(meta, metadata)
 
-    # write the headers 
-    with open(train_file, 'a') as train_csv:
-         writer = csv.writer(train_csv, dialect='myDialect')
-         writer.writerow(title_row)
+    train_csv = RowWriter(train_file, title_row)
+    eval_csv = None
+    if spy_data == False:
+        eval_csv = RowWriter(eval_file, title_row)
+
+    train_rows = []
+    eval_rows = []
+
+    try:
+        for key in data: 
+            probe_strs = data[key]
+            # use the rest for eval should be 5 per.INFO1 traing set  
+            index = int(len(probe_strs) * split)
+            #logger.debug("index: {} len:{}".format(index, len(probe_strs)))
+            # too short to use
+            train_probes_strs = [p for p in probe_strs[:index] if probe_len(p) >= length]
+            eval_probes_strs = [p for p in probe_strs[index:] if probe_len(p) >= length]
+
+            if spy_data == True:
+                for probe in train_probes_strs: 
+                    csv_row, probe_row = row(probe)
+                    train_csv.write(csv_row)
+                    train_rows.append(probe_row)
+                continue
+
+            if not train_probes_strs and not eval_probes_strs:
+                continue
+
+            try: 
+                label = meta[key][1]
+            except IndexError as err: 
+                logger.error(err)
+                return None, None
 
-    # write the headers
-    if spy_data == False:  
-        with open(eval_file, 'a') as eval_csv:
-            writer = csv.writer(eval_csv, dialect='myDialect')
-            writer.writerow(title_row)
-
-    for key in data: 
-        probe_strs = data[key]
-        # use the rest for eval should be 5 per.INFO1 traing set  
-        index = int(len(probe_strs) * split)
-        #logger.debug("index: {} len:{}".format(index, len(probe_strs)))
-        train_probes_strs = probe_strs[:index]
-        eval_probes_strs = probe_strs[index:]
-       
-        with open(train_file, 'a') as train_tsv:
-            writer = csv.writer(train_tsv, dialect='myDialect')
             for probe in train_probes_strs: 
-                if(len(probe) < length): 
-                    continue
-                if spy_data == False:
-                    try: 
-                        row = [to_string(probe, length), meta[key][1]] 
-                    except IndexError as err: 
-                        #logger.error("probe:{} \n".format(probe))
-                        logger.error(err)
-                        return
+                csv_row, probe_row = row(probe, label)
+                train_csv.write(csv_row)
+                train_rows.append(probe_row)
+
+            for probe in eval_probes_strs:  
+                csv_row, probe_row = row(probe, label)
+                eval_csv.write(csv_row)
+                eval_rows.append(probe_row)
+    finally:
+        train_csv.close()
+        if eval_csv is not None:
+            eval_csv.close()
+
+    return train_rows, eval_rows
+
+
+# every whitespace character \s matches, deleted in one translate
+_STRIP_WS = {i: None for i in range(0x3001) if chr(i).isspace()}
+
+# how much of a probe file to read at a time
+CHUNK_SIZE = 1 << 16
+
+# a cache miss {N}, the group is N
+_MISS = re.compile(r'\{([0-9]+)\}')
+
+# between the run lengths in the csv runs column
+RUN_SEPARATOR = ' '
+
+
+def iter_probe(probe_path, chunk_size=CHUNK_SIZE):
+    """
+    Stream a raw probe file and yield the cleaned probe in pieces.
+
+    This is a single pass over the file. Whitespace is stripped, {N} cache
+    misses are dropped and the braces are checked as it goes, so a trace
+    never has to be held in memory all at once. A marker that is split
+    across two chunks is carried over to the next one. Anything between
+    braces that is not a number is left alone and a bad end is chopped,
+    same as the old regex.
+
+    :param probe_path: path to the raw probe file
+    :type probe_path: str
+    :param chunk_size: number of characters to read at a time, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :return: generator of cleaned probe strings
+    :rtype: generator
+    """
+    with open(probe_path, 'r') as probe_file:
+        chunks = iter(lambda: probe_file.read(chunk_size), '')
+        for piece in clean_chunks(chunks, chunk_size, probe_path):
+            yield piece
+
+
+def clean_chunks(chunks, chunk_size=CHUNK_SIZE, name=None):
+    """
+    Clean a raw probe handed over in pieces, see iter_probe.
+
+    When the braces don't balance the probe is chopped at the last '{', 
+    same as the old regex. Only what comes after the latest '{' can still
+    be chopped, so that much is held back until another '{' turns up or 
+    the end shows the braces balance.
+
+    :param chunks: the raw probe in order
+    :type chunks: iterable of str
+    :param chunk_size: size of the chunks, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :param name: what to call the probe in the log, defaults to None
+    :type name: str, optional
+    :return: generator of cleaned probe strings
+    :rtype: generator
+    """
+    # an open '{' (and whatever came after it) waiting on the next chunk
+    carry = ''
+    # cleaned probe from the latest '{' on
+    held = ''
+    opens = 0
+    closes = 0
+
+    for chunk in chunks:
+        chunk = chunk.translate(_STRIP_WS)
+        opens += chunk.count('{')
+        closes += chunk.count('}')
+        pieces = (carry + chunk).split('{')
+        carry = ''
+
+        # everything before the first '{' carries on from what was held
+        out = []
+        tail = [held, pieces[0]]
+
+        last = len(pieces) - 1
+        for i in range(1, len(pieces)):
+            body, close, rest = pieces[i].partition('}')
+            # there is a later '{', the chop can't reach back past it
+            out.extend(tail)
+            if not close:
+                if i == last and len(body) < max(chunk_size, CHUNK_SIZE):
+                    # could still turn into a {N}, wait and see
+                    carry = '{' + body
+                    tail = []
                 else:
-                    row = [to_string(probe, length)] 
-                writer.writerow(row)
-                train_line += 1
-
-        if spy_data == False:
-            with open(eval_file, 'a') as eval_tsv: 
-                writer = csv.writer(eval_tsv, dialect='myDialect')
-                for probe in eval_probes_strs:  
-                    if(len(probe) < length): 
-                        continue 
-                    try: 
-                        row = [to_string(probe, length), meta[key][1]] 
-                    except IndexError as err: 
-                        # logger.error("probe:{} \n len:{} \n meta: {}".format(probe, length, meta))
-                        logger.error(err)
-                        return
-                    writer.writerow(row)
-                    eval_line += 1
-
-
-def clean_data(list_of_files, spy_data=False): 
+                    tail = ['{' + body]
+                continue
+
+            if body.isdigit():
+                # cache miss, drop it
+                tail = [rest]
+            else:
+                tail = ['{' + body + '}' + rest]
+
+        if not opens:
+            # no '{' yet, nothing to chop back to
+            out.extend(tail)
+            tail = []
+
+        held = ''.join(tail)
+        yield ''.join(out)
+
+    if opens != closes:
+        # seems there is a bug in the prob gathering tool
+        # the last miss never gets closed, chop the bad end off.
+        logger.error("invalid string: {}".format(name))
+        if opens:
+            return
+
+    yield held + carry
+
+
+def read_probe(probe_path, length=None, chunk_size=CHUNK_SIZE):
+    """
+    Read and clean a single raw probe file.
+
+    :param probe_path: path to the raw probe file
+    :type probe_path: str
+    :param length: stop once this many characters are cleaned, defaults to None
+    :type length: int, optional
+    :param chunk_size: number of characters to read at a time, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :return: the cleaned probe
+    :rtype: str
+    """
+    pieces = []
+    size = 0
+
+    stream = iter_probe(probe_path, chunk_size)
+    for piece in stream:
+        pieces.append(piece)
+        size += len(piece)
+        if length is not None and size >= length:
+            # nothing past this point makes it into the csv
+            stream.close()
+            break
+
+    content = ''.join(pieces)
+    if length is not None:
+        content = content[:length]
+
+    return content
+
+
+def clean_probe(content, length=None):
+    """
+    Clean a raw probe that is already in memory.
+
+    :param content: the raw probe
+    :type content: str
+    :param length: truncate the cleaned probe to this, defaults to None
+    :type length: int, optional
+    :return: the cleaned probe
+    :rtype: str
+    """
+    content = ''.join(clean_chunks([content], max(len(content), CHUNK_SIZE), 'raw probe'))
+    if length is not None:
+        content = content[:length]
+
+    return content
+
+
+def regex_clean(content):
+    """
+    The original regex cleaner, kept around to benchmark against.
+
+    :param content: the raw probe file contents
+    :type content: str
+    :return: the cleaned probe
+    :rtype: str
+    """
+    match = re.compile('(\{[0-9]+\})', flags=re.MULTILINE)
+
+    # strip the whitespace out of the file
+    content = re.sub(r'\s+', '', content)
+    start_pos = [m.start() for m in re.finditer('{', content)]
+    end_pos = [m.start() for m in re.finditer('}', content)]
+
+    if len(start_pos) != len(end_pos):
+        # chop the bad ends off.
+        content = content[:start_pos[-1]]
+
+    if len(start_pos) == 0:
+        return content
+
+    # del cahce misses
+    return match.sub('', content)
+
+
+def rle_clean(content):
+    """
+    Clean a raw probe into runs of the same symbol instead of a string.
+
+    Same whitespace stripping and bad end chopping as regex_clean, but a 
+    {N} is not thrown away. It means the spy missed N slots, those are 
+    counted as N more slots of the run it came in so the run lengths keep 
+    the timing. A {N} before any symbol has nothing to add to and is 
+    dropped.
+
+    :param content: the raw probe
+    :type content: str
+    :return: the symbols and the length of each run
+    :rtype: str, list of int
+    """
+    content = content.translate(_STRIP_WS)
+    if content.count('{') != content.count('}'):
+        # chop the bad end off.
+        content = content[:content.rfind('{')]
+
+    symbols = []
+    runs = []
+
+    # text, N, text, N, ... text
+    pieces = _MISS.split(content)
+    for i, piece in enumerate(pieces):
+        if i % 2 == 1:
+            if runs:
+                runs[-1] += int(piece)
+            continue
+
+        for symbol, run in itertools.groupby(piece):
+            if symbols and symbols[-1] == symbol:
+                # same symbol on both sides of a miss
+                runs[-1] += len(list(run))
+            else:
+                symbols.append(symbol)
+                runs.append(len(list(run)))
+
+    return ''.join(symbols), runs
+
+
+def read_probe_runs(probe_path, length=None):
+    """
+    Read a single raw probe file into runs, see rle_clean.
+
+    :param probe_path: path to the raw probe file
+    :type probe_path: str
+    :param length: only keep this many runs, defaults to None
+    :type length: int, optional
+    :return: [symbols, run lengths]
+    :rtype: list
+    """
+    with open(probe_path, 'r') as probe_file:
+        symbols, runs = rle_clean(probe_file.read())
+
+    if length is not None:
+        symbols = symbols[:length]
+        runs = runs[:length]
+
+    return [symbols, runs]
+
+
+def probe_len(probe):
+    """
+    Length of a cleaned probe, in characters or in runs.
+
+    :param probe: from read_probe or read_probe_runs
+    :type probe: str or list
+    :return: the length
+    :rtype: int
+    """
+    if isinstance(probe, str):
+        return len(probe)
+    return len(probe[0])
+
+
+def benchmark(list_of_files, length=None, repeat=3):
+    """
+    Time the streaming tokenizer against the regex cleaner.
+
+    :param list_of_files: list of files from common.file_list
+    :type list_of_files: list
+    :param length: truncation length handed to the tokenizer, defaults to None
+    :type length: int, optional
+    :param repeat: number of times to clean the whole list, defaults to 3
+    :type repeat: int, optional
+    :return: best time for each method and the number of mismatched probes
+    :rtype: dict
+    """
+    probe_files = [f for f in list_of_files if not f['name'].endswith('METADATA')]
+
+    def run_regex():
+        cleaned = []
+        for my_file in probe_files:
+            with open(my_file['path'], 'r') as probe_file:
+                cleaned.append(regex_clean(probe_file.read())[:length])
+        return cleaned
+
+    def run_stream():
+        return [read_probe(my_file['path'], length) for my_file in probe_files]
+
+    results = dict()
+    outputs = dict()
+    for name, method in (('regex', run_regex), ('stream', run_stream)):
+        best = None
+        for _ in range(0, repeat):
+            time1 = time.time()
+            outputs[name] = method()
+            time2 = time.time()
+            if best is None or time2 - time1 < best:
+                best = time2 - time1
+        results[name] = best
+
+    results['files'] = len(probe_files)
+    results['mismatch'] = sum(1 for a, b in zip(outputs['regex'], outputs['stream']) if a != b)
+
+    return results
+
+
+def _clean_shard(paths, length, rle=False):
+    """
+    Clean a contiguous run of probe files. Runs in a worker process.
+
+    :param paths: probe file paths, in order
+    :type paths: list
+    :param length: truncation length passed to read_probe
+    :type length: int
+    :param rle: clean into runs with read_probe_runs, defaults to False
+    :type rle: bool, optional
+    :return: the cleaned probes, in the same order
+    :rtype: list
+    """
+    if rle:
+        return [read_probe_runs(path, length) for path in paths]
+    return [read_probe(path, length) for path in paths]
+
+
+def shard_list(items, number_of_shards):
+    """
+    Split a list into contiguous shards of near equal size.
+    Joining the shards back together gives the original order.
+
+    :param items: the list to split
+    :type items: list
+    :param number_of_shards: how many shards to make
+    :type number_of_shards: int
+    :return: list of shards
+    :rtype: list of lists
+    """
+    number_of_shards = max(1, min(number_of_shards, len(items)))
+    size, extra = divmod(len(items), number_of_shards)
+
+    shards = []
+    start = 0
+    for i in range(0, number_of_shards):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(items[start:end])
+        start = end
+
+    return shards
+
+
+MANIFEST_VERSION = 2
+
+# the cleaned probes go next to the manifest, one json line each
+STORE_SUFFIX = '.probes'
+
+
+def file_signature(path):
+    """
+    Size and modification time of a raw file, used to spot changes.
+
+    :param path: path to the file
+    :type path: str
+    :return: [size, mtime in ns]
+    :rtype: list
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def probe_store(manifest_file):
+    """
+    Where the cleaned probes for a manifest go.
+
+    :param manifest_file: path to the manifest
+    :type manifest_file: str
+    :return: path to the store
+    :rtype: str
+    """
+    return os.path.splitext(manifest_file)[0] + STORE_SUFFIX
+
+
+def load_manifest(manifest_file, length, spy_data=False, rle=False):
+    """
+    Load the manifest of raw files that have already been cleaned.
+    A missing manifest, or one written with different settings, gives
+    back an empty one so everything gets cleaned again.
+
+    The manifest only has the signature of each file and where its
+    cleaned probe is in the probe store, see read_store.
+
+    :param manifest_file: path to the manifest
+    :type manifest_file: str
+    :param length: the truncation length for this run
+    :type length: int
+    :param spy_data: is this spy data, defaults to False
+    :type spy_data: bool, optional
+    :param rle: the probes are runs, defaults to False
+    :type rle: bool, optional
+    :return: the manifest
+    :rtype: dict
+    """
+    params = {'length': length, 'spy_data': spy_data}
+    if rle:
+        params['rle'] = True
+    store = probe_store(manifest_file)
+    manifest = {'version': MANIFEST_VERSION, 'params': params, 'files': dict(), 'store': store}
+
+    old_manifest = None
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'r') as manifest_json:
+                old_manifest = json.load(manifest_json)
+        except ValueError as err:
+            logger.error("bad manifest, starting over: {}".format(err))
+
+    if old_manifest is not None:
+        if old_manifest.get('version') != MANIFEST_VERSION or old_manifest.get('params') != params:
+            logger.info("settings changed since the last run, cleaning everything")
+        else:
+            manifest['files'] = old_manifest['files']
+            return manifest
+
+    # nothing points into the old probes any more
+    if os.path.exists(store):
+        os.remove(store)
+    return manifest
+
+
+def save_manifest(manifest, manifest_file):
+    """
+    Write the manifest out. The probes are already in the store.
+
+    :param manifest: the manifest from load_manifest
+    :type manifest: dict
+    :param manifest_file: path to the manifest
+    :type manifest_file: str
+    """
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as manifest_json:
+        json.dump({key: value for key, value in manifest.items() if key != 'store'}, manifest_json)
+    # don't leave a half written manifest around if we get killed
+    os.replace(tmp_file, manifest_file)
+
+
+def append_store(store, probes):
+    """
+    Add cleaned probes to the end of the store.
+
+    :param store: path to the store
+    :type store: str
+    :param probes: (file name, probe) tuples
+    :type probes: list of tuples
+    :return: {'offset', 'size'} of each record
+    :rtype: list of dict
+    """
+    entries = []
+    with open(store, 'ab') as store_file:
+        store_file.seek(0, os.SEEK_END)
+        offset = store_file.tell()
+        for name, probe in probes:
+            record = (json.dumps([name, probe]) + '\n').encode('utf-8')
+            store_file.write(record)
+            entries.append({'offset': offset, 'size': len(record)})
+            offset += len(record)
+    return entries
+
+
+def read_store(store, entries):
+    """
+    Read cleaned probes back out of the store. Every record has the file
+    name in it, so a manifest that doesn't go with the store is caught.
+
+    :param store: path to the store
+    :type store: str
+    :param entries: (file name, manifest entry) tuples
+    :type entries: list of tuples
+    :raises ValueError: a record isn't the one the manifest says
+    :return: the probes, in the order of entries
+    :rtype: list
+    """
+    probes = [None] * len(entries)
+    if not entries:
+        return probes
+
+    with open(store, 'rb') as store_file:
+        # in store order, so it is one pass over the file
+        for i in sorted(range(len(entries)), key=lambda i: entries[i][1]['offset']):
+            name, entry = entries[i]
+            store_file.seek(entry['offset'])
+            record = json.loads(store_file.read(entry['size']).decode('utf-8'))
+            if not isinstance(record, list) or len(record) != 2 or record[0] != name:
+                raise ValueError("no record for {} at {}".format(name, entry['offset']))
+            probes[i] = record[1]
+    return probes
+
+
+def compact_store(store, files, probes):
+    """
+    Write the store again with only the probes still in use, once the 
+    old ones take up more room than they do.
+
+    :param store: path to the store
+    :type store: str
+    :param files: manifest entries by file name, updated with the new offsets
+    :type files: dict
+    :param probes: cleaned probes by file name
+    :type probes: dict
+    """
+    live = sum(entry['size'] for entry in files.values())
+    if not os.path.exists(store) or os.path.getsize(store) <= 2 * live:
+        return
+
+    tmp_store = store + '.tmp'
+    if os.path.exists(tmp_store):
+        os.remove(tmp_store)
+    names = list(files)
+    for name, entry in zip(names, append_store(tmp_store, [(name, probes[name]) for name in names])):
+        files[name].update(entry)
+    os.replace(tmp_store, store)
+    logger.info("compacted the probe store to {} bytes".format(live))
+
+
+def clean_data(list_of_files, spy_data=False, length=None, workers=1, manifest=None, rle=False):
     """
     Takes the raw data and process cleans it and chops off mistakes.
     This makes Hornby's code compatible with my model.  
 
     {4} represents a chache miss in hornbys code we simply just delete them.  
 
+    With more than one worker the probe files are sharded in order across
+    a process pool and stitched back together in the same order, so the
+    output is exactly what the serial path would give.
+
+    When a manifest is given, files whose name, size and mtime match an
+    entry reuse the probe cleaned last time and only new or changed files
+    are read. Their probes are added to the probe store and the manifest
+    is updated in place to match list_of_files.
+
     :param list_of_files: list of files to clean
     :type list_of_files: list 
     :param spy_data: this is spy data meta_data will be None, defaults to False
     :type spy_data: bool, optional
+    :param length: only keep the first length characters of each probe, defaults to None
+    :type length: int, optional
+    :param workers: number of worker processes, defaults to 1
+    :type workers: int, optional
+    :param manifest: manifest from load_manifest, defaults to None
+    :type manifest: dict, optional
+    :param rle: keep each probe as [symbols, run lengths] and length counts runs, defaults to False
+    :type rle: bool, optional
     :return: data, metaa
     :rtype: dict, dict
     """
-    # we do this a lot so compile it 
-    match = re.compile('(\{[0-9]+\})', flags=re.MULTILINE)
     data_dict = defaultdict(list)
     if spy_data == False:
         meta_dict = defaultdict(list)
     else: 
         meta_dict = None
 
+    probe_files = []
     for my_file in list_of_files:
-        start_pos = []
-        end_pos = []
-        insert_str = []
-        content = ""
-        adjusted_name = my_file['name'].split('_')[0]
-
         if spy_data == False:  
             # save the meta data infomation 
             if my_file['name'] == 'METADATA' or my_file['name'] == '01_METADATA':     
@@ -203,51 +817,64 @@ def clean_data(list_of_files, spy_data=False):
                         i += 1
                 continue
 
-        with open(my_file['path'], 'r') as probe_file: 
-            content = probe_file.read()
-            # logger.debug("content: {}".format(content))
-            # strip the whitespace out of the file
-            content = re.sub(r'\s+', '', content)  
-            
-            # logger.debug("content: {}".format(content))
-            # extend adds the actual content of the list not just appends it 
-            # so you don't have lists and lists and it can zip
-            # the following line finds the all start positions of a given character in a string 
-            start_pos.extend([m.start() for m in re.finditer('{', content)])
-            end_pos.extend([m.start() for m in re.finditer('}', content)])
-        
-            if len(start_pos) != len(end_pos): 
-                logger.error("invalid string:\n {}".format(content))
-                # seems there is a bug in the prob gathering tool
-                # chop the bad ends off. 
-                content = content[:start_pos[-1]]
-                
-            if len(start_pos) == 0: 
-                # skip nothing to replace 
-                content_list = [] 
-                content_list.append(content) 
-                data_dict[adjusted_name].append(content)
-                continue 
-            
-            # del cahce misses 
-            content = match.sub('', content) 
-
-            # start_end_pairs = zip(start_pos, end_pos)
-            
-            # for pair in start_end_pairs:
-                # # grab the number between the brackets 
-                # repeat_num = content[pair[0]+1: pair[1]]
-                # prev_char = content[pair[0]-1]
-                # # make a string of one letter of size repeat_num
-                # insert_str.append(prev_char * int(repeat_num))
-            # for char_str in insert_str:
-                # # match {} with one or more numbers in between 
-                # content = re.sub('(\{[0-9]+\})',char_str, content, 1) 
-
-            content_list = [] 
-            content_list.append(content) 
-            data_dict[adjusted_name].append(content)
-
-            # logging.debug(data_dict)
+        probe_files.append(my_file)
+
+    if manifest is not None:
+        old_files = manifest['files']
+        new_files = dict()
+        signatures = dict()
+        todo = []
+        for my_file in probe_files:
+            signature = file_signature(my_file['path'])
+            signatures[my_file['name']] = signature
+            entry = old_files.get(my_file['name'])
+            if entry is None or entry['signature'] != signature:
+                todo.append(my_file)
+            else:
+                new_files[my_file['name']] = entry
+
+        reused = [my_file['name'] for my_file in probe_files if my_file['name'] in new_files]
+        try:
+            by_name = dict(zip(reused, read_store(manifest['store'], [(name, new_files[name]) for name in reused])))
+        except (IOError, ValueError) as err:
+            logger.error("probe store does not match the manifest, cleaning everything: {}".format(err))
+            if os.path.exists(manifest['store']):
+                os.remove(manifest['store'])
+            new_files = dict()
+            by_name = dict()
+            todo = probe_files
+        logger.info("reusing {} cleaned files, cleaning {}".format(len(by_name), len(todo)))
+    else:
+        todo = probe_files
+
+    paths = [my_file['path'] for my_file in todo]
+
+    if workers > 1 and len(paths) > 1:
+        # a few shards per worker keeps the pool busy when files vary in size
+        shards = shard_list(paths, workers * 4)
+        logger.info("cleaning {} files in {} shards on {} workers".format(len(paths), len(shards), workers))
+        probes = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # map hands the shards back in the order they went in
+            for cleaned in executor.map(_clean_shard, shards, [length] * len(shards), [rle] * len(shards)):
+                probes.extend(cleaned)
+    else:
+        # strip, check and del cache misses in one go
+        probes = _clean_shard(paths, length, rle)
+
+    if manifest is not None:
+        # only what was cleaned this run gets written
+        entries = append_store(manifest['store'], [(my_file['name'], probe) for my_file, probe in zip(todo, probes)])
+        for my_file, probe, entry in zip(todo, probes, entries):
+            entry['signature'] = signatures[my_file['name']]
+            new_files[my_file['name']] = entry
+            by_name[my_file['name']] = probe
+        compact_store(manifest['store'], new_files, by_name)
+        manifest['files'] = new_files
+        probes = [by_name[my_file['name']] for my_file in probe_files]
+
+    for my_file, probe in zip(probe_files, probes):
+        adjusted_name = my_file['name'].split('_')[0]
+        data_dict[adjusted_name].append(probe)
 
     return data_dict, meta_dict
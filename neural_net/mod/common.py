@@ -87,14 +87,18 @@ def file_list(directory):
     return list_dirs
 
 
-def clean_dir(directory):
+def clean_dir(directory, keep=None):
     """
     Removes all files from a directory.
 
     :param directory: directory path
     :type directory: str
+    :param keep: file names to leave alone, defaults to None
+    :type keep: list, optional
     """
     for file_name in os.listdir(directory):
+        if keep and file_name in keep:
+            continue
         file_path = os.path.join(directory, file_name)
         if os.path.isfile(file_path):
             logger.debug('Removing: {}'.format(file_path))
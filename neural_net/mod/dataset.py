@@ -0,0 +1,347 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import itertools
+import json
+import os
+import logging
+import numpy as np
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+DATASET_VERSION = 1
+
+# Train.header.json sits next to Train.tokens.npy and Train.labels.npy
+HEADER_SUFFIX = '.header.json'
+TOKENS_SUFFIX = '.tokens.npy'
+LABELS_SUFFIX = '.labels.npy'
+RUNS_SUFFIX = '.runs.npy'
+
+TOKEN_DTYPE = np.uint8
+LABEL_DTYPE = np.int16
+RUN_DTYPE = np.uint16
+
+# longer runs are clipped to this
+MAX_RUN = np.iinfo(RUN_DTYPE).max
+
+
+def read_vocab(vocab_file):
+    """
+    Read the vocab file. 
+
+    :param vocab_file: path to the vocab file (comma separated characters)
+    :type vocab_file: str
+    :return: sorted list of unique characters
+    :rtype: list
+    """
+    with open(vocab_file) as vocab: 
+        vocab_data = vocab.readline()
+        vocab_data = vocab_data.strip()
+        vocab_data = vocab_data.split(',')
+
+    return sorted(set(vocab_data))
+
+
+def is_dataset(path):
+    """
+    Is this the header of a binary dataset rather than a csv.
+
+    :param path: path to a data file
+    :type path: str
+    :return: True if it is a dataset header
+    :rtype: bool
+    """
+    return path.endswith(HEADER_SUFFIX)
+
+
+def dataset_prefix(csv_file):
+    """
+    Binary dataset prefix for a csv file. (Train.csv => Train)
+
+    :param csv_file: path to the csv
+    :type csv_file: str
+    :return: the prefix
+    :rtype: str
+    """
+    return os.path.splitext(csv_file)[0]
+
+
+def lookup_table(vocab):
+    """
+    Build a 256 entry byte => vocab index table.
+    Bytes that are not in the vocab map to -1.
+
+    :param vocab: sorted vocab from read_vocab
+    :type vocab: list
+    :raises ValueError: vocab entry that is not a single byte
+    :return: the table
+    :rtype: numpy.array (int16)
+    """
+    table = np.full(256, -1, dtype=np.int16)
+    for i, u in enumerate(vocab):
+        if len(u) != 1 or ord(u) > 255:
+            raise ValueError("vocab entries must be single byte characters not: {}".format(u))
+        table[ord(u)] = i
+
+    return table
+
+
+def encode(probes, vocab, truncate=None):
+    """
+    Turn probe strings into a matrix of vocab indices.
+
+    All the probes are joined into one byte buffer and pushed through a 
+    lookup table in one go, no per character python.
+
+    :param probes: list of probes, all the same length
+    :type probes: list of str
+    :param vocab: sorted vocab from read_vocab
+    :type vocab: list
+    :param truncate: cut each probe to this length first, defaults to None
+    :type truncate: int, optional
+    :raises ValueError: probes are different lengths or have a character not in the vocab
+    :return: the tokens
+    :rtype: numpy.array (uint8)
+    """
+    if len(vocab) > np.iinfo(TOKEN_DTYPE).max + 1:
+        raise ValueError("vocab too big for {}".format(np.dtype(TOKEN_DTYPE).name))
+
+    if truncate is not None:
+        probes = [probe[:truncate] for probe in probes]
+
+    if len(probes) == 0:
+        return np.zeros((0, 0 if truncate is None else truncate), dtype=TOKEN_DTYPE)
+
+    width = len(probes[0])
+    lengths = np.fromiter((len(probe) for probe in probes), dtype=np.int64, count=len(probes))
+    if (lengths != width).any():
+        bad = int(np.argmax(lengths != width))
+        raise ValueError("probes must all be the same length: row 0 is {}, row {} is {}".format(width, bad, lengths[bad]))
+
+    try:
+        raw = ''.join(probes).encode('latin-1')
+    except UnicodeEncodeError as err:
+        raise ValueError("character not in vocab: {}".format(repr(err.object[err.start:err.end])))
+
+    tokens = np.take(lookup_table(vocab), np.frombuffer(raw, dtype=np.uint8))
+    if (tokens < 0).any():
+        bad = raw[int(np.argmax(tokens < 0))]
+        raise ValueError("character not in vocab: {}".format(repr(chr(bad))))
+
+    return tokens.astype(TOKEN_DTYPE).reshape(len(probes), width)
+
+
+def encode_runs(runs, truncate=None):
+    """
+    Turn the run lengths of run length encoded probes into a matrix.
+
+    :param runs: run lengths, one list per probe, all the same length
+    :type runs: list of lists
+    :param truncate: cut each probe to this many runs first, defaults to None
+    :type truncate: int, optional
+    :raises ValueError: probes have a different number of runs
+    :return: the run lengths, clipped to MAX_RUN
+    :rtype: numpy.array (uint16)
+    """
+    if truncate is not None:
+        runs = [run[:truncate] for run in runs]
+
+    if len(runs) == 0:
+        return np.zeros((0, 0 if truncate is None else truncate), dtype=RUN_DTYPE)
+
+    width = len(runs[0])
+    if any(len(run) != width for run in runs):
+        raise ValueError("probes must all have {} runs".format(width))
+
+    flat = np.fromiter(itertools.chain.from_iterable(runs), dtype=np.int64, count=width * len(runs))
+    return np.clip(flat, 0, MAX_RUN).astype(RUN_DTYPE).reshape(len(runs), width)
+
+
+def stack_runs(tokens, runs):
+    """
+    Put the symbols and run lengths of run length encoded probes together
+    as the two channels the model takes, see character_rnn.model_inputs.
+
+    :param tokens: symbols from encode
+    :type tokens: numpy.array
+    :param runs: run lengths from encode_runs
+    :type runs: numpy.array
+    :return: (probes, runs, 2) matrix, symbol then run length
+    :rtype: numpy.array (uint16)
+    """
+    return np.stack([np.asarray(tokens, dtype=RUN_DTYPE), np.asarray(runs, dtype=RUN_DTYPE)], axis=-1)
+
+
+def write_dataset(prefix, probes, labels, vocab, truncate, label_map=None, runs=None):
+    """
+    Write a binary dataset. 
+
+    This is a uint8 token matrix, an int16 label vector and a json header 
+    with the vocab, truncate length and label map. Both arrays are plain 
+    .npy files so they can be memory mapped.
+
+    :param prefix: path and name without extension (i.e) clean_dir/Train
+    :type prefix: str
+    :param probes: the probes, already truncated
+    :type probes: list of str
+    :param labels: int label per probe or None for spy data
+    :type labels: list
+    :param vocab: sorted vocab from read_vocab
+    :type vocab: list
+    :param truncate: truncate length the probes were cut to
+    :type truncate: int
+    :param label_map: map between int and url, defaults to None
+    :type label_map: dict, optional
+    :param runs: run lengths when the probes are run length encoded, defaults to None
+    :type runs: list of lists, optional
+    :return: path to the header
+    :rtype: str
+    """
+    tokens = encode(probes, vocab)
+    if tokens.shape[0] == 0:
+        tokens = np.zeros((0, truncate), dtype=TOKEN_DTYPE)
+    np.save(prefix + TOKENS_SUFFIX, tokens)
+
+    header = dict()
+    header['version'] = DATASET_VERSION
+    header['vocab'] = vocab
+    header['truncate'] = truncate
+    header['rows'] = tokens.shape[0]
+    header['tokens'] = os.path.basename(prefix + TOKENS_SUFFIX)
+    header['labels'] = None
+    header['label_map'] = None
+    header['runs'] = None
+
+    if labels is not None:
+        np.save(prefix + LABELS_SUFFIX, np.array(labels, dtype=LABEL_DTYPE))
+        header['labels'] = os.path.basename(prefix + LABELS_SUFFIX)
+    if label_map is not None:
+        header['label_map'] = {str(k): v for k, v in label_map.items()}
+    if runs is not None:
+        run_matrix = encode_runs(runs)
+        if run_matrix.shape[0] == 0:
+            run_matrix = np.zeros((0, truncate), dtype=RUN_DTYPE)
+        np.save(prefix + RUNS_SUFFIX, run_matrix)
+        header['runs'] = os.path.basename(prefix + RUNS_SUFFIX)
+
+    header_file = prefix + HEADER_SUFFIX
+    with open(header_file, 'w') as header_json:
+        json.dump(header, header_json)
+
+    logger.info("{}: {} rows x {}".format(header_file, tokens.shape[0], tokens.shape[1]))
+
+    return header_file
+
+
+def load_dataset(header_file, vocab=None, mmap_mode='r'):
+    """
+    Load a binary dataset. The arrays are memory mapped by default.
+
+    :param header_file: path to the header
+    :type header_file: str
+    :param vocab: vocab to check the dataset against, defaults to None
+    :type vocab: list, optional
+    :param mmap_mode: passed to np.load, defaults to 'r'
+    :type mmap_mode: str, optional
+    :raises ValueError: bad version or vocab does not match
+    :return: tokens, labels (None for spy data), header
+    :rtype: numpy.array, numpy.array, dict
+    """
+    with open(header_file) as header_json:
+        header = json.load(header_json)
+
+    if header.get('version') != DATASET_VERSION:
+        raise ValueError("unknown dataset version: {}".format(header.get('version')))
+    if vocab is not None and list(vocab) != header['vocab']:
+        raise ValueError("dataset was encoded with vocab {} not {}".format(header['vocab'], list(vocab)))
+
+    if header['label_map'] is not None:
+        header['label_map'] = {int(k): v for k, v in header['label_map'].items()}
+
+    directory = os.path.dirname(header_file)
+    tokens = np.load(os.path.join(directory, header['tokens']), mmap_mode=mmap_mode)
+
+    labels = None
+    if header['labels'] is not None:
+        labels = np.load(os.path.join(directory, header['labels']), mmap_mode=mmap_mode)
+
+    return tokens, labels, header
+
+
+def load_runs(header_file, header, mmap_mode='r'):
+    """
+    Load the run lengths of a run length encoded dataset.
+
+    :param header_file: path to the header
+    :type header_file: str
+    :param header: the header from load_dataset
+    :type header: dict
+    :param mmap_mode: passed to np.load, defaults to 'r'
+    :type mmap_mode: str, optional
+    :return: run lengths, None if the dataset is not run length encoded
+    :rtype: numpy.array
+    """
+    if header.get('runs') is None:
+        return None
+
+    return np.load(os.path.join(os.path.dirname(header_file), header['runs']), mmap_mode=mmap_mode)
+
+
+def share_array(array, path):
+    """
+    Get an array onto disk so other processes can memory map it instead
+    of being handed a pickled copy. A memory mapped array is already on 
+    disk and is used as is, anything else is saved to path.
+
+    :param array: the array, or None
+    :type array: numpy.array
+    :param path: .npy file to save it to when it is in memory
+    :type path: str
+    :return: what open_shared needs to map it, None for None
+    :rtype: dict
+    """
+    if array is None:
+        return None
+    if not isinstance(array, np.memmap) or array.filename is None:
+        np.save(path, array)
+        array = np.load(path, mmap_mode='r')
+
+    return {'filename': array.filename, 'dtype': array.dtype.str, 'shape': array.shape, 'offset': array.offset}
+
+
+def open_shared(spec):
+    """
+    Memory map an array from share_array, read only.
+
+    :param spec: from share_array
+    :type spec: dict
+    :return: the array
+    :rtype: numpy.memmap
+    """
+    if spec is None:
+        return None
+    return np.memmap(spec['filename'], dtype=np.dtype(spec['dtype']), mode='r', offset=spec['offset'], shape=tuple(spec['shape']))
@@ -0,0 +1,240 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import hashlib
+import json
+import os
+import logging
+import time
+import zipfile
+import numpy as np
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.npz'
+# a put that is still being written, not an entry yet
+TMP_SUFFIX = '.tmp'
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tanooki')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# set once from the command line with configure
+settings = {
+    'enabled': True,
+    'cache_dir': DEFAULT_CACHE_DIR,
+    'max_bytes': DEFAULT_MAX_BYTES,
+}
+
+
+def configure(enabled=True, cache_dir=None, max_bytes=None):
+    """
+    Set up the cache for this run.
+
+    :param enabled: use the cache at all, defaults to True
+    :type enabled: bool, optional
+    :param cache_dir: where the cache lives, defaults to ~/.cache/tanooki
+    :type cache_dir: str, optional
+    :param max_bytes: evict once the cache is bigger than this, defaults to 2 GiB
+    :type max_bytes: int, optional
+    """
+    settings['enabled'] = enabled
+    if cache_dir is not None:
+        settings['cache_dir'] = cache_dir
+    if max_bytes is not None:
+        settings['max_bytes'] = max_bytes
+
+
+def cache_key(csv_file, vocab, truncate, has_labels=True):
+    """
+    Hash of everything that goes into an encoded dataset: 
+    the csv contents, the vocab, the truncate length and whether the
+    labels were read.
+
+    :param csv_file: path to the csv
+    :type csv_file: str
+    :param vocab: sorted vocab from dataset.read_vocab
+    :type vocab: list
+    :param truncate: truncate length or None
+    :type truncate: int
+    :param has_labels: the labels are parsed too, defaults to True
+    :type has_labels: bool, optional
+    :return: hex digest
+    :rtype: str
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([CACHE_VERSION, list(vocab), truncate, bool(has_labels)]).encode('utf-8'))
+    with open(csv_file, 'rb') as csv_data:
+        for block in iter(lambda: csv_data.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(settings['cache_dir'], key + CACHE_SUFFIX)
+
+
+def _entries():
+    """
+    Every file in the cache, oldest use first.
+
+    :return: list of (last use, size, path)
+    :rtype: list of tuples
+    """
+    cache_dir = settings['cache_dir']
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith(CACHE_SUFFIX):
+            continue
+        file_path = os.path.join(cache_dir, file_name)
+        stat = os.stat(file_path)
+        entries.append((stat.st_mtime, stat.st_size, file_path))
+
+    return sorted(entries)
+
+
+def get(key):
+    """
+    Look up an encoded dataset.
+
+    :param key: from cache_key
+    :type key: str
+    :return: (data, labels) or None on a miss, labels is None for spy data
+    :rtype: tuple
+    """
+    if not settings['enabled']:
+        return None
+
+    entry_path = _entry_path(key)
+    if not os.path.exists(entry_path):
+        logger.debug("cache miss: {}".format(key))
+        return None
+
+    try:
+        with np.load(entry_path) as entry:
+            data = entry['data']
+            labels = entry['labels'] if 'labels' in entry.files else None
+    except (IOError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as err:
+        logger.error("bad cache entry {}: {}".format(entry_path, err))
+        os.remove(entry_path)
+        return None
+
+    # mtime is the last use, that is what eviction goes by
+    os.utime(entry_path, None)
+    logger.info("cache hit: {}".format(key))
+
+    return data, labels
+
+
+def put(key, data, labels=None):
+    """
+    Store an encoded dataset and evict the least recently used entries 
+    until the cache fits.
+
+    :param key: from cache_key
+    :type key: str
+    :param data: the encoded probes
+    :type data: numpy.array
+    :param labels: the labels, defaults to None
+    :type labels: numpy.array, optional
+    """
+    if not settings['enabled']:
+        return
+
+    cache_dir = settings['cache_dir']
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    arrays = {'data': data}
+    if labels is not None:
+        arrays['labels'] = labels
+
+    entry_path = _entry_path(key)
+    # through a file object so np.savez doesn't add .npz, _entries skips it
+    tmp_path = entry_path + TMP_SUFFIX
+    with open(tmp_path, 'wb') as tmp_file:
+        np.savez(tmp_file, **arrays)
+    os.replace(tmp_path, entry_path)
+
+    evict(settings['max_bytes'])
+
+
+def evict(max_bytes):
+    """
+    Remove the least recently used entries until the cache is under max_bytes.
+
+    :param max_bytes: size limit
+    :type max_bytes: int
+    :return: number of entries removed
+    :rtype: int
+    """
+    entries = _entries()
+    total = sum(entry[1] for entry in entries)
+    removed = 0
+
+    for _, size, file_path in entries:
+        if total <= max_bytes:
+            break
+        logger.debug('Evicting: {}'.format(file_path))
+        os.remove(file_path)
+        total -= size
+        removed += 1
+
+    return removed
+
+
+def stats():
+    """
+    What is in the cache.
+
+    :return: cache_dir, entries, bytes, max_bytes, oldest and newest use
+    :rtype: dict
+    """
+    entries = _entries()
+    info = dict()
+    info['cache_dir'] = settings['cache_dir']
+    info['entries'] = len(entries)
+    info['bytes'] = sum(entry[1] for entry in entries)
+    info['max_bytes'] = settings['max_bytes']
+    info['oldest'] = time.ctime(entries[0][0]) if entries else None
+    info['newest'] = time.ctime(entries[-1][0]) if entries else None
+
+    return info
+
+
+def clear():
+    """
+    Empty the cache.
+
+    :return: number of entries removed
+    :rtype: int
+    """
+    return evict(-1)
@@ -0,0 +1,176 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import tensorflow as tf 
+import numpy as np 
+import math 
+import dataset
+
+
+# rows read off the disk in one go
+SHARD_SIZE = 4096
+
+# examples held in the shuffle buffer
+SHUFFLE_BUFFER = 16384
+
+# width of the one hot labels, same as the last layer of the model
+NUM_CLASSES = 100
+
+
+def shard_reader(tokens, labels, indices, shard_size=SHARD_SIZE, shuffle=True, runs=None):
+    """
+    Make a generator that reads the rows in indices off a memory mapped 
+    dataset one shard at a time. The shard order is shuffled every pass, 
+    inside a shard the rows are read in file order so the disk reads stay 
+    mostly sequential.
+    
+    :param tokens: memory mapped token matrix
+    :type tokens: numpy.array
+    :param labels: memory mapped labels
+    :type labels: numpy.array
+    :param indices: the rows to read
+    :type indices: numpy.array
+    :param shard_size: number of rows per shard, defaults to SHARD_SIZE
+    :type shard_size: int, optional
+    :param shuffle: shuffle the rows before sharding, defaults to True
+    :type shuffle: bool, optional
+    :param runs: memory mapped run lengths of a run length encoded dataset, defaults to None
+    :type runs: numpy.array, optional
+    :return: generator function yielding (tokens, labels) shards
+    """
+    def generator():
+        order = np.array(indices)
+        if shuffle:
+            np.random.shuffle(order)
+        for start in range(0, len(order), shard_size):
+            shard = np.sort(order[start:start + shard_size])
+            if runs is not None:
+                yield dataset.stack_runs(tokens[shard], runs[shard]), labels[shard].astype(np.int32)
+            else:
+                yield tokens[shard], labels[shard].astype(np.int32)
+
+    return generator
+
+
+class IndexedBatches(tf.keras.utils.Sequence):
+    """
+    Batches gathered from one copy of the data by row number.
+
+    Each fold of a k-fold run is just an index array, the rows for a 
+    batch are only pulled out (and one hot encoded) when keras asks for 
+    that batch. Works the same on an in memory array or a memory mapped 
+    dataset.
+    """
+
+    def __init__(self, tokens, labels, indices, batch_size=32, sparse=False, shuffle=True):
+        self.tokens = tokens
+        self.labels = labels
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.sparse = sparse
+        self.shuffle = shuffle
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(math.ceil(len(self.indices) / float(self.batch_size)))
+
+    def __getitem__(self, index):
+        # sorted so a memory mapped file is read front to back
+        rows = np.sort(self.indices[index * self.batch_size:(index + 1) * self.batch_size])
+        probes = np.asarray(self.tokens[rows])
+        labels = np.asarray(self.labels[rows], dtype=np.int64)
+        if not self.sparse:
+            labels = tf.keras.utils.to_categorical(labels, NUM_CLASSES)
+        return probes, labels
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+
+def make_dataset(header_file, vocab, batch_size=32, indices=None, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER, shard_size=SHARD_SIZE, sparse=False, repeat=True):
+    """
+    Build a tf.data pipeline that streams a binary dataset from disk.
+
+    Shards are pulled off the memory mapped file, split back into single 
+    examples, shuffled through a bounded buffer, batched and prefetched 
+    so the next batches are ready while the current one trains. Only a 
+    few shards are ever in memory.
+    
+    :param header_file: path to the dataset header from gen-data --binary
+    :type header_file: str
+    :param vocab: path to the vocab file
+    :type vocab: str
+    :param batch_size: batch size, defaults to 32
+    :type batch_size: int, optional
+    :param indices: only use these rows, defaults to None (all of them)
+    :type indices: numpy.array, optional
+    :param shuffle: shuffle the examples, defaults to True
+    :type shuffle: bool, optional
+    :param shuffle_buffer: size of the shuffle buffer, defaults to SHUFFLE_BUFFER
+    :type shuffle_buffer: int, optional
+    :param shard_size: number of rows read at a time, defaults to SHARD_SIZE
+    :type shard_size: int, optional
+    :param sparse: int labels instead of one hot, defaults to False
+    :type sparse: bool, optional
+    :param repeat: repeat forever (what fit wants), defaults to True
+    :type repeat: bool, optional
+    :raises ValueError: the dataset has no labels
+    :return: the dataset, steps per pass and the dataset header
+    :rtype: tf.data.Dataset, int, dict
+    """
+    tokens, labels, header = dataset.load_dataset(header_file, dataset.read_vocab(vocab))
+    if labels is None:
+        raise ValueError("{} has no labels".format(header_file))
+
+    runs = dataset.load_runs(header_file, header)
+
+    if indices is None:
+        indices = np.arange(tokens.shape[0])
+    width = tokens.shape[1]
+
+    if runs is None:
+        probe_type = tf.uint8
+        probe_shape = tf.TensorShape([None, width])
+    else:
+        # symbol and run length, see dataset.stack_runs
+        probe_type = tf.uint16
+        probe_shape = tf.TensorShape([None, width, 2])
+
+    data = tf.data.Dataset.from_generator(
+        shard_reader(tokens, labels, indices, shard_size, shuffle, runs),
+        output_types=(probe_type, tf.int32),
+        output_shapes=(probe_shape, tf.TensorShape([None])))
+
+    # back to single examples so the shuffle buffer mixes across shards
+    data = data.apply(tf.data.experimental.unbatch())
+    if shuffle:
+        data = data.shuffle(shuffle_buffer)
+    if repeat:
+        data = data.repeat()
+    data = data.batch(batch_size)
+
+    def to_model(probe, label):
+        probe = tf.cast(probe, tf.float32)
+        if not sparse:
+            label = tf.one_hot(label, NUM_CLASSES)
+        return probe, label
+
+    data = data.map(to_model, num_parallel_calls=4)
+    data = data.prefetch(tf.data.experimental.AUTOTUNE)
+
+    steps = int(math.ceil(len(indices) / float(batch_size)))
+
+    return data, steps, header
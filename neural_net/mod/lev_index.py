@@ -0,0 +1,295 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import heapq
+import json
+import logging
+import os
+import sys
+import Levenshtein as lev
+
+import levenshtein_tools
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+INDEX_VERSION = 1
+
+# written next to session.csv
+INDEX_SUFFIX = '.bktree.json'
+
+
+def index_file(checkpoint_file):
+    """
+    Where the index for a session csv goes.
+
+    :param checkpoint_file: the session.csv
+    :type checkpoint_file: str
+    :return: path to the index
+    :rtype: str
+    """
+    return os.path.splitext(checkpoint_file)[0] + INDEX_SUFFIX
+
+
+# probes kept in a list under an edge before it is split into a node
+BUCKET_SIZE = 32
+
+
+class BKTree(object):
+    """
+    Burkhard-Keller tree over train probes, for exact nearest neighbours
+    by Levenshtein distance without comparing against every probe.
+
+    Every node has a pivot probe and hangs everything under it off the 
+    distance to the pivot. Edit distance is a metric, so for a query q at 
+    distance d from the pivot everything under the edge e is at least 
+    |e - d| from q, and whole branches get skipped once they can't beat 
+    the k-th best so far. Branches are searched closest bound first.
+
+    The distance to a pivot has to be worked out in full, so small 
+    branches are kept as a bucket of probes instead of more nodes. Those
+    are checked with the k-th best as the cutoff, which is cheap.
+
+    Ties go to the probe that came first (the rank, insertion order unless
+    set with reorder), the same as levenshtein_tools.least_distance.
+
+    :param probes: (label, probe) tuples, defaults to None
+    :type probes: list of tuples, optional
+    :param bucket_size: most probes in a bucket, defaults to BUCKET_SIZE
+    :type bucket_size: int, optional
+    """
+    def __init__(self, probes=None, bucket_size=BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.labels = []
+        self.probes = []
+        self.rank = []
+        # per node: its pivot, {distance: child node} and {distance: [probes]}
+        self.pivots = []
+        self.edges = []
+        self.buckets = []
+        for label, probe in probes or []:
+            self.add(label, probe)
+
+    def __len__(self):
+        return len(self.probes)
+
+    def new_node(self, pivot):
+        self.pivots.append(pivot)
+        self.edges.append(dict())
+        self.buckets.append(dict())
+        return len(self.pivots) - 1
+
+    def add(self, label, probe):
+        """
+        Insert a probe.
+
+        :param label: its label
+        :type label: int
+        :param probe: the probe
+        :type probe: str
+        """
+        item = len(self.probes)
+        self.labels.append(label)
+        self.probes.append(probe)
+        self.rank.append(item)
+        if not self.pivots:
+            self.new_node(item)
+            return
+        self.insert(item, 0)
+
+    def insert(self, item, node):
+        """
+        Put a probe somewhere under node.
+
+        :param item: the probe number
+        :type item: int
+        :param node: the node to start at
+        :type node: int
+        """
+        while True:
+            distance = lev.distance(self.probes[item], self.probes[self.pivots[node]])
+            if distance in self.edges[node]:
+                node = self.edges[node][distance]
+                continue
+
+            bucket = self.buckets[node].setdefault(distance, [])
+            bucket.append(item)
+            if len(bucket) > self.bucket_size:
+                # too big to scan, the first one becomes a pivot for the rest
+                del self.buckets[node][distance]
+                child = self.new_node(bucket[0])
+                self.edges[node][distance] = child
+                for other in bucket[1:]:
+                    self.insert(other, child)
+            return
+
+    def query(self, probe, k=1):
+        """
+        The k closest train probes.
+
+        :param probe: the probe to look up
+        :type probe: str
+        :param k: number of neighbours, defaults to 1
+        :type k: int, optional
+        :return: (label, distance) closest first, ties by rank
+        :rtype: list of tuples
+        """
+        if not self.probes:
+            return []
+
+        # max heap of the best k as (-distance, -rank, probe number)
+        best = []
+
+        def radius():
+            return -best[0][0] if len(best) == k else None
+
+        def keep(item, distance):
+            if radius() is not None and distance > radius():
+                return
+            entry = (-distance, -self.rank[item], item)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+        # (lower bound, order, node or None, bucket)
+        todo = [(0, 0, 0, None)]
+        order = 1
+        while todo:
+            bound, _, node, bucket = heapq.heappop(todo)
+            # ties can still win on rank, so a bound of exactly the radius is searched
+            if radius() is not None and bound > radius():
+                break
+
+            if bucket is not None:
+                for item in bucket:
+                    if radius() is None:
+                        keep(item, lev.distance(probe, self.probes[item]))
+                    else:
+                        keep(item, levenshtein_tools.bounded_distance(probe, self.probes[item], radius()))
+                continue
+
+            pivot = self.pivots[node]
+            edges = list(self.edges[node]) + list(self.buckets[node])
+            if radius() is None:
+                distance = lev.distance(probe, self.probes[pivot])
+            else:
+                # past the radius plus the longest edge nothing here can win
+                cutoff = radius() + max(edges + [0])
+                distance = levenshtein_tools.bounded_distance(probe, self.probes[pivot], cutoff)
+                if distance > cutoff:
+                    continue
+            keep(pivot, distance)
+            for branches, is_node in ((self.edges[node], True), (self.buckets[node], False)):
+                for edge, branch in branches.items():
+                    branch_bound = max(bound, abs(edge - distance))
+                    if radius() is None or branch_bound <= radius():
+                        heapq.heappush(todo, (branch_bound, order, branch if is_node else None, None if is_node else branch))
+                        order += 1
+
+        return [(self.labels[item], -neg_distance) for neg_distance, _, item in sorted(best, reverse=True)]
+
+    def nearest(self, test_probe):
+        """
+        Drop in for levenshtein_tools.least_distance.
+
+        :param test_probe: test probe tuple
+        :type test_probe: tuple
+        :return: label and distance of the closest train probe
+        :rtype: tuple
+        """
+        result = self.query(test_probe[1], 1)
+        if not result:
+            return -1, sys.maxsize
+        return result[0]
+
+    def reorder(self, train_probes):
+        """
+        Break ties by the order of train_probes instead of insertion order,
+        so the answers match a least_distance scan over that list.
+
+        :param train_probes: the same (label, probe) tuples as the tree, any order
+        :type train_probes: list of tuples
+        :raises ValueError: train_probes aren't what the tree holds
+        """
+        if len(train_probes) != len(self.probes):
+            raise ValueError("index has {} probes, not {}".format(len(self.probes), len(train_probes)))
+
+        positions = dict()
+        for position, (label, probe) in enumerate(train_probes):
+            positions.setdefault((label, probe), []).append(position)
+
+        rank = []
+        for label, probe in zip(self.labels, self.probes):
+            if not positions.get((label, probe)):
+                raise ValueError("index does not match the train probes")
+            rank.append(positions[(label, probe)].pop(0))
+        self.rank = rank
+
+    def save(self, path):
+        """
+        Write the tree out as json.
+
+        :param path: file to write
+        :type path: str
+        """
+        with open(path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'bucket_size': self.bucket_size,
+                'labels': self.labels,
+                'probes': self.probes,
+                'pivots': self.pivots,
+                'edges': [sorted(edges.items()) for edges in self.edges],
+                'buckets': [sorted(buckets.items()) for buckets in self.buckets]
+            }, f)
+        logger.info("index of {} probes written to: {}".format(len(self.probes), path))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a tree written by save.
+
+        :param path: the file
+        :type path: str
+        :raises ValueError: unknown version
+        :return: the tree
+        :rtype: BKTree
+        """
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get('version') != INDEX_VERSION:
+            raise ValueError("unknown index version: {}".format(saved.get('version')))
+
+        tree = cls(bucket_size=saved['bucket_size'])
+        tree.labels = saved['labels']
+        tree.probes = saved['probes']
+        tree.rank = list(range(len(tree.probes)))
+        tree.pivots = saved['pivots']
+        tree.edges = [{int(edge): child for edge, child in edges} for edges in saved['edges']]
+        tree.buckets = [{int(edge): bucket for edge, bucket in buckets} for buckets in saved['buckets']]
+        return tree
@@ -0,0 +1,250 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import numpy as np
+import Levenshtein as lev
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+MATRIX_VERSION = 1
+
+# rows (and columns) in a block of work
+BLOCK = 256
+
+MATRIX_DTYPE = np.uint16
+
+# next to the matrix: what it was computed over, and the blocks that are done
+META_SUFFIX = '.json'
+DONE_SUFFIX = '.done'
+
+
+def signature(probes):
+    """
+    Fingerprint of the probes, in order, so a matrix is never reused for
+    different data.
+
+    :param probes: the probes
+    :type probes: list of str
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    for probe in probes:
+        digest.update(probe.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+# the probes in a worker, set once by _init_worker
+_probes = None
+
+
+def _init_worker(probes):
+    global _probes
+    _probes = probes
+
+
+def _block(corner):
+    """
+    Distances for one block, the diagonal blocks only work out one half.
+
+    :param corner: first row and first column of the block
+    :type corner: tuple
+    :return: the corner and the distances
+    :rtype: tuple
+    """
+    row, column = corner
+    rows = _probes[row:row + BLOCK]
+    columns = _probes[column:column + BLOCK]
+    values = np.zeros((len(rows), len(columns)), dtype=MATRIX_DTYPE)
+    for i, probe in enumerate(rows):
+        start = i + 1 if row == column else 0
+        for j in range(start, len(columns)):
+            values[i, j] = min(lev.distance(probe, columns[j]), np.iinfo(MATRIX_DTYPE).max)
+    if row == column:
+        values = values + values.T
+    return corner, values
+
+
+def read_done(done_file):
+    """
+    Blocks finished by an earlier run. A line cut short by a crash is ignored.
+
+    :param done_file: the done file
+    :type done_file: str
+    :return: corners of the finished blocks
+    :rtype: set
+    """
+    done = set()
+    if not os.path.exists(done_file):
+        return done
+    with open(done_file) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2 and all(part.isdigit() for part in parts):
+                done.add((int(parts[0]), int(parts[1])))
+    return done
+
+
+def distance_matrix(probes, matrix_file, workers=1):
+    """
+    Every Levenshtein distance between the probes, as an N x N uint16
+    .npy that is memory mapped.
+
+    The upper triangle is cut into BLOCK x BLOCK blocks that are worked
+    out in parallel and written (both halves) as they finish. Each block
+    is flushed to disk before it is marked in the done file, so a run
+    that gets interrupted picks up where it left off. If the probes
+    changed the matrix is started over.
+
+    :param probes: the probes
+    :type probes: list of str
+    :param matrix_file: the .npy to write
+    :type matrix_file: str
+    :param workers: number of processes, defaults to 1
+    :type workers: int, optional
+    :return: the matrix, read only
+    :rtype: numpy.memmap
+    """
+    n = len(probes)
+    meta_file = matrix_file + META_SUFFIX
+    done_file = matrix_file + DONE_SUFFIX
+    meta = {'version': MATRIX_VERSION, 'probes': n, 'block': BLOCK, 'signature': signature(probes)}
+
+    saved = None
+    if os.path.exists(matrix_file) and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            saved = json.load(f)
+
+    if saved == meta:
+        done = read_done(done_file)
+        matrix = np.load(matrix_file, mmap_mode='r+')
+        logger.info("resuming {}: {} blocks already done".format(matrix_file, len(done)))
+    else:
+        if saved is not None:
+            logger.warning("{} was computed over other probes, starting over".format(matrix_file))
+        done = set()
+        matrix = np.lib.format.open_memmap(matrix_file, mode='w+', dtype=MATRIX_DTYPE, shape=(n, n))
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f, indent=2)
+        open(done_file, 'w').close()
+
+    corners = [(row, column) for row in range(0, n, BLOCK) for column in range(row, n, BLOCK) if (row, column) not in done]
+    total = len(done) + len(corners)
+    if corners:
+        logger.info("{} probes, {} of {} blocks to go on {} workers".format(n, len(corners), total, workers))
+
+    time1 = time.time()
+    pool = None
+    if workers > 1 and len(corners) > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(probes,))
+        results = pool.imap_unordered(_block, corners)
+    else:
+        _init_worker(probes)
+        results = map(_block, corners)
+
+    try:
+        with open(done_file, 'a') as f:
+            for finished, ((row, column), values) in enumerate(results, len(done) + 1):
+                matrix[row:row + values.shape[0], column:column + values.shape[1]] = values
+                matrix[column:column + values.shape[1], row:row + values.shape[0]] = values.T
+                matrix.flush()
+                f.write("{} {}\n".format(row, column))
+                f.flush()
+                logger.debug("block {}/{} ({:.1f}s)".format(finished, total, time.time() - time1))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    del matrix
+    return np.load(matrix_file, mmap_mode='r')
+
+
+def vote(labels, distances):
+    """
+    Majority label of the nearest neighbours. On a tied count the label
+    with the closest neighbour wins.
+
+    :param labels: labels of the neighbours, closest first
+    :type labels: list
+    :param distances: their distances
+    :type distances: list
+    :return: label and the distance to its closest neighbour
+    :rtype: tuple
+    """
+    counts = dict()
+    for label in labels:
+        counts[label] = counts.get(label, 0) + 1
+    most = max(counts.values())
+    for label, distance in zip(labels, distances):
+        if counts[label] == most:
+            return label, distance
+
+
+def classify(matrix, train_rows, test_rows, k=1):
+    """
+    Nearest neighbour of each test probe from the precomputed distances,
+    by slicing out the test rows and train columns. With k = 1 this is the
+    same answer as levenshtein_tools.least_distance on the train rows in
+    this order, ties go to the first train row.
+
+    :param matrix: from distance_matrix
+    :type matrix: numpy.array
+    :param train_rows: (label, matrix row) of the train probes
+    :type train_rows: list of tuples
+    :param test_rows: (label, matrix row) of the test probes
+    :type test_rows: list of tuples
+    :param k: number of neighbours that vote, defaults to 1
+    :type k: int, optional
+    :return: generator of (test probe, label, distance, seconds), like levenshtein_tools.classify_all
+    :rtype: generator
+    """
+    time1 = time.time()
+    train_labels = [label for label, _ in train_rows]
+    test_index = np.array([row for _, row in test_rows], dtype=np.int64)
+    train_index = np.array([row for _, row in train_rows], dtype=np.int64)
+    distances = np.asarray(matrix[np.ix_(test_index, train_index)])
+
+    if k == 1:
+        nearest = distances.argmin(axis=1)
+        results = [(train_labels[column], int(distances[i, column])) for i, column in enumerate(nearest)]
+    else:
+        # stable, so equal distances keep the train order
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        results = [vote([train_labels[column] for column in row], [int(distances[i, column]) for column in row])
+                   for i, row in enumerate(nearest)]
+
+    seconds = (time.time() - time1) / max(len(test_rows), 1)
+    for test_probe, (match, dist) in zip(test_rows, results):
+        yield test_probe, match, dist, seconds
@@ -14,17 +14,64 @@
 
 
 import Levenshtein as lev 
+import multiprocessing
+import numpy as np
 import sys 
 import random 
+import time
 import common 
 
 from collections import defaultdict
 
 
+def _has_score_cutoff():
+    """
+    Newer Levenshtein (requirements.txt pins 0.20.9) can give up on a
+    distance once it passes score_cutoff, which is a lot cheaper than
+    finishing it. The old python-Levenshtein 0.12 can't.
+
+    :return: True if lev.distance takes score_cutoff
+    :rtype: bool
+    """
+    try:
+        lev.distance('a', 'b', score_cutoff=0)
+    except TypeError:
+        return False
+    return True
+
+
+HAS_SCORE_CUTOFF = _has_score_cutoff()
+
+
+def bounded_distance(probe_one, probe_two, cutoff):
+    """
+    Levenshtein distance, when it is at most cutoff.
+
+    :param probe_one: a probe
+    :type probe_one: str
+    :param probe_two: another probe
+    :type probe_two: str
+    :param cutoff: largest distance we care about
+    :type cutoff: int
+    :return: the distance, or something bigger than cutoff
+    :rtype: int
+    """
+    # the length difference is as close as they can get
+    if abs(len(probe_one) - len(probe_two)) > cutoff:
+        return cutoff + 1
+    if HAS_SCORE_CUTOFF:
+        return lev.distance(probe_one, probe_two, score_cutoff=cutoff)
+    return lev.distance(probe_one, probe_two)
+
+
 def least_distance(train_probes, test_probe): 
     """
     Get the probe with the least amount of 
     distance. return the key. 
+
+    The best distance so far is used as a cutoff, a train probe that can't
+    beat it is dropped as soon as that is clear. Same answer as checking 
+    every distance in full, on a tie the first train probe wins.
     
     :param train_probes: test of train_probes
     :type train_probes: list of tuples
@@ -36,16 +83,259 @@ def least_distance(train_probes, test_probe):
     least_dist = (sys.maxsize, -1)
 
     for train_probe in train_probes:
-        #print(train_probe[1])
-        #print('+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
-        #print(test_probe[1])
-        distance = lev.distance(train_probe[1], test_probe[1]) 
+        if least_dist[0] == 0:
+            # nothing beats an exact match
+            break
+        if least_dist[0] == sys.maxsize:
+            distance = lev.distance(train_probe[1], test_probe[1])
+        else:
+            # only strictly closer probes replace the best
+            distance = bounded_distance(train_probe[1], test_probe[1], least_dist[0] - 1)
         if distance < least_dist[0]: 
             least_dist = (distance, train_probe[0])
     
     return least_dist[1], least_dist[0]
 
 
+# the train probes (and index) in a worker, set once by _init_worker
+_train_probes = None
+_index = None
+
+
+def _init_worker(train_probes, index=None):
+    """
+    Hand the train probes to a worker once, not with every test probe.
+
+    :param train_probes: train probes
+    :type train_probes: list of tuples
+    :param index: index over train_probes, defaults to None
+    :type index: lev_index.BKTree, optional
+    """
+    global _train_probes, _index
+    _train_probes = train_probes
+    _index = index
+
+
+class Prefilter(object):
+    """
+    Cheap lower bounds on the edit distance from a query to every train
+    probe at once, so most of them never reach the Levenshtein kernel.
+
+    Each probe is kept as its length and its symbol counts (and q-gram 
+    counts with q > 1) in numpy arrays. For a query:
+        - the length difference is a bound,
+        - (L1 of the symbol counts + length difference) / 2 is a bound, 
+          an edit fixes at most one missing and one extra symbol, it is
+          never below half the L1 or the length difference,
+        - L1 of the q-gram counts / 2q is a bound, an edit touches at most q 
+          q-grams on each side.
+    Symbols and q-grams that are not in the train probes share one column,
+    that only makes the L1 smaller so the bounds still hold.
+
+    Candidates are checked closest bound first with the best distance so
+    far as the cutoff, and the search stops at the first bound past it.
+    The answer is the same as least_distance, ties go to the first train
+    probe. How much was skipped is counted in stats.
+
+    :param train_probes: train probes
+    :type train_probes: list of tuples
+    :param q: q-gram size for the extra bound, defaults to 1 (symbol counts only)
+    :type q: int, optional
+    """
+    def __init__(self, train_probes, q=1):
+        self.labels = [label for label, _ in train_probes]
+        self.probes = [probe for _, probe in train_probes]
+        self.q = q
+        self.lengths = np.array([len(probe) for probe in self.probes], dtype=np.int64)
+
+        self.symbols = self.columns(self.probes, 1)
+        self.symbol_counts = np.stack([self.counts(probe, self.symbols, 1) for probe in self.probes]) if self.probes else None
+        if q > 1:
+            self.grams = self.columns(self.probes, q)
+            self.gram_counts = np.stack([self.counts(probe, self.grams, q) for probe in self.probes]) if self.probes else None
+        self.stats = dict.fromkeys(['queries', 'candidates', 'bound_pruned', 'kernel', 'cutoff_pruned'], 0)
+
+    @staticmethod
+    def columns(probes, q):
+        """
+        A column for every q-gram in the probes, plus one for the rest.
+        """
+        grams = sorted(set(probe[i:i + q] for probe in probes for i in range(len(probe) - q + 1)))
+        return {gram: column for column, gram in enumerate(grams)}
+
+    @staticmethod
+    def counts(probe, columns, q):
+        """
+        q-gram counts of a probe.
+
+        :return: one count per column, the last is everything not in columns
+        :rtype: numpy.array
+        """
+        other = len(columns)
+        index = [columns.get(probe[i:i + q], other) for i in range(len(probe) - q + 1)]
+        return np.bincount(np.array(index, dtype=np.int64), minlength=other + 1).astype(np.int32)
+
+    def bounds(self, probe):
+        """
+        Lower bound on the distance from probe to every train probe.
+
+        :param probe: the query
+        :type probe: str
+        :return: one bound per train probe
+        :rtype: numpy.array
+        """
+        length = np.abs(self.lengths - len(probe))
+        symbol_l1 = np.abs(self.symbol_counts - self.counts(probe, self.symbols, 1)).sum(axis=1)
+        bound = np.maximum(length, (symbol_l1 + length + 1) // 2)
+        if self.q > 1:
+            gram_l1 = np.abs(self.gram_counts - self.counts(probe, self.grams, self.q)).sum(axis=1)
+            bound = np.maximum(bound, (gram_l1 + 2 * self.q - 1) // (2 * self.q))
+        return bound
+
+    def nearest(self, test_probe):
+        """
+        Drop in for least_distance.
+
+        :param test_probe: test probe tuple
+        :type test_probe: tuple
+        :return: label and distance of the closest train probe
+        :rtype: tuple
+        """
+        self.stats['queries'] += 1
+        self.stats['candidates'] += len(self.probes)
+        if not self.probes:
+            return -1, sys.maxsize
+
+        bounds = self.bounds(test_probe[1])
+        order = np.argsort(bounds, kind='stable')
+        # (distance, train probe)
+        best = (sys.maxsize, -1)
+        checked = 0
+        for candidate in order:
+            if bounds[candidate] > best[0]:
+                break
+            # a tie only wins from further up the list
+            cutoff = best[0] if candidate < best[1] else best[0] - 1
+            if bounds[candidate] > cutoff:
+                continue
+            checked += 1
+            if best[1] < 0:
+                distance = lev.distance(self.probes[candidate], test_probe[1])
+            else:
+                distance = bounded_distance(self.probes[candidate], test_probe[1], cutoff)
+            if distance > cutoff:
+                self.stats['cutoff_pruned'] += 1
+                continue
+            best = (distance, candidate)
+
+        self.stats['kernel'] += checked
+        self.stats['bound_pruned'] += len(self.probes) - checked
+        return self.labels[best[1]], best[0]
+
+    def take_stats(self):
+        """
+        The counts so far, and start over.
+
+        :return: the stats
+        :rtype: dict
+        """
+        stats = self.stats
+        self.stats = dict.fromkeys(stats, 0)
+        return stats
+
+
+def prune_report(stats):
+    """
+    How much work the prefilter saved.
+
+    :param stats: Prefilter stats
+    :type stats: dict
+    :return: a line for the log
+    :rtype: str
+    """
+    candidates = max(stats.get('candidates', 0), 1)
+    kernel = max(stats.get('kernel', 0), 1)
+    return ("{} queries x {:.0f} train probes: {:.1%} skipped by the bounds, {} reached the kernel and {:.1%} of those "
+            "were cut off early").format(stats.get('queries', 0), stats.get('candidates', 0) / max(stats.get('queries', 0), 1), 
+                                         stats.get('bound_pruned', 0) / candidates, stats.get('kernel', 0), 
+                                         stats.get('cutoff_pruned', 0) / kernel)
+
+
+def merge_stats(stats, more):
+    """
+    Add one set of counts to another.
+    """
+    for key, value in more.items():
+        stats[key] = stats.get(key, 0) + value
+
+
+def _nearest(train_probes, test_probe, index=None):
+    """
+    least_distance, or the index when there is one.
+    """
+    if index is not None:
+        return index.nearest(test_probe)
+    return least_distance(train_probes, test_probe)
+
+
+def _classify(test_probe):
+    """
+    least_distance against the worker's train probes, timed.
+
+    :param test_probe: test probe tuple
+    :type test_probe: tuple
+    :return: label, distance, seconds it took and the index stats
+    :rtype: tuple
+    """
+    time1 = time.time()
+    match, dist = _nearest(_train_probes, test_probe, _index)
+    seconds = time.time() - time1
+    return match, dist, seconds, _index.take_stats() if hasattr(_index, 'take_stats') else None
+
+
+def classify_all(train_probes, test_probes, workers=1, chunksize=None, index=None, stats=None):
+    """
+    Find the closest train probe for every test probe, spread over a pool 
+    of worker processes. The train probes go to each worker once when it
+    starts, after that only the test probes are sent over. The results 
+    come back in the order of test_probes as they are done.
+
+    :param train_probes: train probes
+    :type train_probes: list of tuples
+    :param test_probes: test probes
+    :type test_probes: list of tuples
+    :param workers: number of processes, defaults to 1 (no pool)
+    :type workers: int, optional
+    :param chunksize: test probes sent to a worker at a time, defaults to None (a few chunks per worker)
+    :type chunksize: int, optional
+    :param index: search this instead of scanning train_probes, defaults to None
+    :type index: lev_index.BKTree or Prefilter, optional
+    :param stats: add the Prefilter stats to this, defaults to None
+    :type stats: dict, optional
+    :return: generator of (test_probe, label, distance, seconds)
+    :rtype: generator
+    """
+    if workers <= 1:
+        for test_probe in test_probes:
+            time1 = time.time()
+            match, dist = _nearest(train_probes, test_probe, index)
+            seconds = time.time() - time1
+            if stats is not None and hasattr(index, 'take_stats'):
+                merge_stats(stats, index.take_stats())
+            yield test_probe, match, dist, seconds
+        return
+
+    if chunksize is None:
+        # small enough that results keep coming and the workers finish together
+        chunksize = max(1, len(test_probes) // (workers * 8))
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(train_probes, index)) as pool:
+        for test_probe, (match, dist, seconds, more) in zip(test_probes, pool.imap(_classify, test_probes, chunksize)):
+            if stats is not None and more is not None:
+                merge_stats(stats, more)
+            yield test_probe, match, dist, seconds
+
+
 def gen_lev_splits(number_of_splits, data, examples=None):
     """
     Generate data splits on given data and labesl.
@@ -21,6 +21,8 @@ import math
 import common 
 import operator 
 import random
+import dataset
+import dataset_cache
 
 from functools import reduce
 from collections import defaultdict
@@ -95,6 +97,7 @@ def grab_csv(csv_file, truncate):
 def gen_splits(number_of_splits, data, labels):
     """
     Generate data splits on given data and labesl.
+    The remainder is spread over the first splits instead of being dropped.
 
     :param number_of_splits: number of data splits
     :type number_of_splits: int
@@ -104,85 +107,229 @@ def gen_splits(number_of_splits, data, labels):
     :type labels: numpy.array
     :return: data and label splits
     """
-    data_splits = [] 
-    label_splits = []
-
-    number_of_examples = data.shape[0] // number_of_splits
-    start = 0 
-    end = number_of_examples  
-    for i in range(0, number_of_splits):
-        data_splits.append(data[start:end])
-        label_splits.append(labels[start:end])
-        start = end 
-        end += number_of_examples
+    data_splits = np.array_split(data, number_of_splits)
+    label_splits = np.array_split(labels, number_of_splits)
 
     return data_splits, label_splits
 
 
-def process_data(csv_file, vocab, truncate=None ,return_original=False):
+def gen_fold_indices(labels, number_of_splits, stratify=False):
     """
-    Process the data and lables. data will be numpy array, lables will be one hot.
-    
+    Split the rows of a dataset into k folds, as row numbers.
+
+    Nothing is copied, the folds are just index arrays into the one copy 
+    of the data. Every row lands in exactly one fold. With stratify each 
+    label is spread evenly over the folds.
+
+    :param labels: int label per row
+    :type labels: numpy.array
+    :param number_of_splits: number of folds
+    :type number_of_splits: int
+    :param stratify: keep the label mix the same in every fold, defaults to False
+    :type stratify: bool, optional
+    :return: one sorted index array per fold
+    :rtype: list of numpy.array
+    """
+    labels = np.asarray(labels)
+    np.random.seed()
+
+    if not stratify:
+        order = np.random.permutation(len(labels))
+        return [np.sort(fold) for fold in np.array_split(order, number_of_splits)]
+
+    folds = [[] for _ in range(0, number_of_splits)]
+    # start each label on a different fold so the remainders even out
+    offset = 0
+    for label in np.unique(labels):
+        rows = np.random.permutation(np.flatnonzero(labels == label))
+        for i, part in enumerate(np.array_split(rows, number_of_splits)):
+            folds[(i + offset) % number_of_splits].append(part)
+        offset += len(rows) % number_of_splits
+
+    return [np.sort(np.concatenate(fold)) if fold else np.zeros(0, dtype=np.int64) for fold in folds]
+
+
+def split_fold(folds, split):
+    """
+    Pull one fold out for testing. The held out fold is cut in half, 
+    one half to validate on while training and the other to test on, 
+    so we aren't testing and validating on the same data.
+
+    :param folds: from gen_fold_indices
+    :type folds: list of numpy.array
+    :param split: which fold to hold out
+    :type split: int
+    :return: train, validation and test row numbers
+    :rtype: numpy.array, numpy.array, numpy.array
+    """
+    held_out = np.random.permutation(folds[split])
+    half = len(held_out) // 2
+    eval_rows = np.sort(held_out[:half])
+    test_rows = np.sort(held_out[half:])
+    train_rows = np.concatenate([fold for i, fold in enumerate(folds) if i != split])
+
+    return train_rows, eval_rows, test_rows
+
+
+def encode_probes(probes, vocab, truncate=None):
+    """
+    Encode probe strings to a uint8 matrix of vocab indices. 
+
+    :param probes: the probes 
+    :type probes: list of str
+    :param vocab: sorted vocab from dataset.read_vocab
+    :type vocab: list
+    :param truncate: truncate the probe, defaults to None
+    :type truncate: int, optional
+    :raises ValueError: bad truncation value, ragged probes or unknown characters
+    :return: data
+    :rtype: numpy.array
+    """
+    if truncate is not None:
+        if truncate <= 0 or any(truncate >= len(probe) for probe in probes):
+            raise ValueError("If you are going to truncate pick a good number...not: {}".format(truncate))
+
+    return dataset.encode(probes, vocab, truncate)
+
+
+def encode_csv(csv_file, vocab, truncate=None, has_labels=True):
+    """
+    Parse and encode a csv, in file order.
+    Goes through dataset_cache so an unchanged csv is only parsed once.
+    A csv with a runs column (gen-data --rle_len) comes back as 
+    (probes, runs, 2) symbols and run lengths, see dataset.stack_runs.
+
     :param csv_file: path to data file 
     :type csv_file: str
+    :param vocab: path to the vocab file
+    :type vocab: str
     :param truncate: truncate the probe, defaults to None
     :type truncate: int, optional
-    :param return_original: return non-one hot, defaults to False
-    :type return_original: bool, optional
-    :raises ValueError: bad truncation file
-    :return: data, lables 
+    :param has_labels: the csv has a label column, defaults to True
+    :type has_labels: bool, optional
+    :return: data, labels (None without has_labels)
     :rtype: numpy.array, numpy.array
     """
+    vocab = dataset.read_vocab(vocab)
+
+    key = None
+    if dataset_cache.settings['enabled']:
+        key = dataset_cache.cache_key(csv_file, vocab, truncate, has_labels)
+        cached = dataset_cache.get(key)
+        if cached is not None:
+            return cached
+
     train_probes = []
     train_labels = []
+    train_runs = []
+    runs_column = None
 
     flag = False 
 
     # open the file 
-    with open(csv_file) as csv_file: 
-        csvReader = csv.reader(csv_file)
+    with open(csv_file) as csv_data: 
+        csvReader = csv.reader(csv_data)
         for row in csvReader: 
             # skip first
             if flag == False: 
                 flag = True
+                if 'runs' in row:
+                    runs_column = row.index('runs')
                 continue
             train_probes.append(row[0])
-            train_labels.append(row[1])
+            if has_labels:
+                train_labels.append(row[1])
+            if runs_column is not None:
+                train_runs.append([int(run) for run in row[runs_column].split()])
+
+    # convert text to char
+    train_data = encode_probes(train_probes, vocab, truncate)
+    if runs_column is not None:
+        train_data = dataset.stack_runs(train_data, dataset.encode_runs(train_runs, truncate))
+
+    # fix data type 
+    if has_labels:
+        train_labels = np.array([int(label) for label in train_labels], dtype=np.int64)
+    else:
+        train_labels = None
 
+    if key is not None:
+        dataset_cache.put(key, train_data, train_labels)
 
-    #tf.logging.debug(train_probes[1])
-    with open(vocab) as vocab_file: 
-        vocab_data = vocab_file.readline()
-        vocab_data = vocab_data.strip()
-        vocab_data = vocab_data.split(',')
+    return train_data, train_labels
 
-    vocab = sorted(set(vocab_data))
 
-    # conversion functions
-    char2idx = {u:i for i, u in enumerate(vocab)}
+def load_dataset(header_file, vocab, truncate=None):
+    """
+    Load a binary dataset from gen-data --binary and shuffle it.
+    The file is memory mapped so only the shuffled uint8 copy is held in memory.
 
-    for i in range(0, len(train_probes)):
-        #convert text to char
-        new_l =  list([char2idx[c] for c in str(train_probes[i])]) 
-        if truncate is None:
-            train_probes[i] = new_l
-        elif truncate > 0 and truncate < len(new_l):
-            train_probes[i] = new_l
-            del train_probes[i][truncate:]
+    :param header_file: path to the dataset header (i.e) Train.header.json
+    :type header_file: str
+    :param vocab: path to the vocab file
+    :type vocab: str
+    :param truncate: truncate the probe, defaults to None
+    :type truncate: int, optional
+    :raises ValueError: bad truncation value
+    :return: data, labels (None for spy data)
+    :rtype: numpy.array, numpy.array
+    """
+    tokens, labels, header = dataset.load_dataset(header_file, dataset.read_vocab(vocab))
+    runs = dataset.load_runs(header_file, header)
+
+    if truncate is not None:
+        if truncate > 0 and truncate < tokens.shape[1]:
+            tokens = tokens[:, :truncate]
+            if runs is not None:
+                runs = runs[:, :truncate]
         else:
             raise ValueError("If you are going to truncate pick a good number...not: {}".format(truncate))
 
-    # fix data type 
-    for i in range(0, len(train_labels)):
-        train_labels[i] = int(train_labels[i])
+    if runs is not None:
+        # run length encoded, the model takes both as one input
+        tokens = dataset.stack_runs(tokens, runs)
+
+    # shuffle the data, fancy indexing pulls it off the disk
+    np.random.seed()
+    indicies = np.random.permutation(tokens.shape[0])
+    train_data = tokens[indicies]
+    train_labels = None
+    if labels is not None:
+        train_labels = np.asarray(labels[indicies], dtype=np.int64)
+
+    return train_data, train_labels
 
-    # convert to numpy array 
-    train_labels = np.array(train_labels)
-    train_probes = np.array(train_probes)
 
-    # rename data
-    train_data = train_probes
-    train_labels = train_labels
+def process_data(csv_file, vocab, truncate=None ,return_original=False, sparse=False):
+    """
+    Process the data and lables. data will be numpy array, lables will be one hot.
+    With sparse the lables stay ints and no one hot matrix is built.
+    csv_file can also be the header of a binary dataset from gen-data --binary.
+    
+    :param csv_file: path to data file 
+    :type csv_file: str
+    :param truncate: truncate the probe, defaults to None
+    :type truncate: int, optional
+    :param return_original: return non-one hot, defaults to False
+    :type return_original: bool, optional
+    :param sparse: keep lables as ints, defaults to False
+    :type sparse: bool, optional
+    :raises ValueError: bad truncation file
+    :return: data, lables 
+    :rtype: numpy.array, numpy.array
+    """
+    if dataset.is_dataset(csv_file):
+        train_data, train_labels = load_dataset(csv_file, vocab, truncate)
+        original_test_labels = train_labels
+        if not sparse:
+            train_labels = tf.keras.utils.to_categorical(train_labels) 
+        if return_original == True: 
+            return train_data, train_labels, original_test_labels
+        else: 
+            return train_data, train_labels
+
+    # parse and encode, or pull it out of the cache
+    train_data, train_labels = encode_csv(csv_file, vocab, truncate)
 
     # shuffle the data 
     np.random.seed()
@@ -195,7 +342,8 @@ def process_data(csv_file, vocab, truncate=None ,return_original=False):
     original_test_labels = train_labels
 
     # need the one hot becuse math 
-    train_labels = tf.keras.utils.to_categorical(train_labels) 
+    if not sparse:
+        train_labels = tf.keras.utils.to_categorical(train_labels) 
     #train_data = tf.keras.utils.to_categorical(train_data) 
     if return_original == True: 
         return train_data, train_labels, original_test_labels
@@ -215,48 +363,12 @@ def process_spy(csv_file, vocab, truncate=None):
     :return: data 
     :rtype: numpy.array
     """
-    train_probes = []
-
-    flag = False 
-
-    # open the file 
-    with open(csv_file) as csv_file: 
-        csvReader = csv.reader(csv_file)
-        for row in csvReader: 
-            # skip first
-            if flag == False: 
-                flag = True
-                continue
-            train_probes.append(row[0])
-
-    #tf.logging.debug(train_probes[1])
-    #tf.logging.debug(train_probes[1])
-    with open(vocab) as vocab_file: 
-        vocab_data = vocab_file.readline()
-        vocab_data = vocab_data.strip()
-        vocab_data = vocab_data.split(',')
-
-    vocab = sorted(set(vocab_data))
-
-    # conversion functions
-    char2idx = {u:i for i, u in enumerate(vocab)}
-
-    for i in range(0, len(train_probes)):
-        #convert text to char
-        new_l =  list([char2idx[c] for c in str(train_probes[i])]) 
-        if truncate is None:
-            train_probes[i] = new_l
-        elif truncate > 0 and truncate < len(new_l):
-            train_probes[i] = new_l
-            del train_probes[i][truncate:]
-        else:
-            raise ValueError("If you are going to truncate pick a good number...not: {}".format(truncate))
-
-    # convert to numpy array 
-    train_probes = np.array(train_probes)
+    if dataset.is_dataset(csv_file):
+        train_data, _ = load_dataset(csv_file, vocab, truncate)
+        return train_data
 
-    # rename data
-    train_data = train_probes
+    # parse and encode, or pull it out of the cache
+    train_data, _ = encode_csv(csv_file, vocab, truncate, has_labels=False)
 
     # shuffle the data 
     np.random.seed()
@@ -0,0 +1,155 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import csv
+import json
+import logging
+import os
+import numpy as np
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+TOP_K = 5
+
+# same clipping keras does before the log in the crossentropy
+EPSILON = 1e-7
+
+
+def confusion_matrix(labels, guesses, classes):
+    """
+    Count of (label, guess) pairs.
+
+    :param labels: true labels as ints
+    :type labels: numpy.array
+    :param guesses: predicted labels as ints
+    :type guesses: numpy.array
+    :param classes: number of classes
+    :type classes: int
+    :raises ValueError: a label or guess is not one of the classes
+    :return: classes x classes, rows are the true label
+    :rtype: numpy.array
+    """
+    for name, values in (('label', labels), ('guess', guesses)):
+        bad = values[(values < 0) | (values >= classes)]
+        if len(bad):
+            raise ValueError("{} {} is not one of the {} classes".format(name, bad[0], classes))
+
+    return np.bincount(labels * classes + guesses, minlength=classes * classes).reshape(classes, classes)
+
+
+def top_k_accuracy(predictions, labels, k=TOP_K):
+    """
+    How often the label is in the k most likely guesses.
+
+    :param predictions: model output, one row of probabilities per probe
+    :type predictions: numpy.array
+    :param labels: true labels as ints
+    :type labels: numpy.array
+    :param k: number of guesses, defaults to TOP_K
+    :type k: int, optional
+    :return: the accuracy
+    :rtype: float
+    """
+    k = min(k, predictions.shape[1])
+    # a label is in the top k when fewer than k classes beat it
+    label_probs = predictions[np.arange(len(labels)), labels]
+    return float(np.mean((predictions > label_probs[:, None]).sum(axis=1) < k))
+
+
+def classification_report(predictions, labels, top_k=TOP_K):
+    """
+    Everything eval reports, from one set of predictions.
+
+    :param predictions: model output, one row of probabilities per probe
+    :type predictions: numpy.array
+    :param labels: true labels, ints or one hot
+    :type labels: numpy.array
+    :param top_k: k for the top k accuracy, defaults to TOP_K
+    :type top_k: int, optional
+    :return: loss, accuracy, top k accuracy, confusion matrix and per class precision/recall
+    :rtype: dict
+    """
+    labels = np.asarray(labels)
+    if labels.ndim == 2 and labels.shape[1] > 1:
+        labels = labels.argmax(axis=1)
+    labels = labels.flatten().astype(np.int64)
+    classes = predictions.shape[1]
+    rows = np.arange(len(labels))
+
+    guesses = predictions.argmax(axis=1)
+    matrix = confusion_matrix(labels, guesses, classes)
+    hits = np.diag(matrix).astype(np.float64)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, hits / predicted, 0.0)
+        recall = np.where(support > 0, hits / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    return {
+        'rows': len(labels),
+        'loss': float(-np.mean(np.log(np.clip(predictions[rows, labels], EPSILON, 1.0)))),
+        'accuracy': float(np.mean(guesses == labels)),
+        'top_k': top_k,
+        'top_k_accuracy': top_k_accuracy(predictions, labels, top_k),
+        'confusion_matrix': matrix,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'support': support
+    }
+
+
+def write_report(report, report_file, target_dict=None):
+    """
+    Write a report out as json, and the per class numbers as a csv next to it.
+
+    :param report: from classification_report, plus anything else worth keeping
+    :type report: dict
+    :param report_file: json file to write, the csv gets the same name
+    :type report_file: str
+    :param target_dict: map between int and url, defaults to None
+    :type target_dict: dict, optional
+    :return: the csv file
+    :rtype: str
+    """
+    target_dict = target_dict or dict()
+    with open(report_file, 'w') as f:
+        json.dump({key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in report.items()}, f, indent=2)
+
+    csv_file = os.path.splitext(report_file)[0] + '.csv'
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['label', 'url', 'precision', 'recall', 'f1', 'support'])
+        for label in range(len(report['support'])):
+            writer.writerow([label, target_dict.get(label, ''), '{:.4f}'.format(report['precision'][label]),
+                             '{:.4f}'.format(report['recall'][label]), '{:.4f}'.format(report['f1'][label]), report['support'][label]])
+
+    logger.info("report written to: {} and {}".format(report_file, csv_file))
+    return csv_file
@@ -0,0 +1,367 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import json
+import os
+import logging
+import queue
+import socketserver
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+import clean_data
+import dataset
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+# most rows handed to one model.predict
+MAX_BATCH = 64
+
+# how long (s) the first request in a batch waits for company
+MAX_WAIT = 0.005
+
+TOP_K = 5
+
+
+class Pending(object):
+    """
+    One request waiting on the batcher.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batcher(threading.Thread):
+    """
+    Owns the model. Requests are queued up and whatever shows up within
+    max_wait of the first one (up to max_batch rows) goes through a
+    single model.predict.
+
+    Keras in TF 1.x keeps the graph and session per thread, so both are
+    grabbed where the model was loaded and entered again in here.
+
+    :param model: a loaded model
+    :param max_batch: most rows in one predict, defaults to MAX_BATCH
+    :type max_batch: int, optional
+    :param max_wait: seconds to wait on more requests, defaults to MAX_WAIT
+    :type max_wait: float, optional
+    """
+    def __init__(self, model, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        super(Batcher, self).__init__()
+        self.daemon = True
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.graph = tf.get_default_graph()
+        self.session = tf.keras.backend.get_session()
+        # build the predict function now, not racing in the thread
+        self.model._make_predict_function()
+
+    def submit(self, tokens):
+        """
+        Queue rows up and wait for the probabilities.
+
+        :param tokens: encoded probes
+        :type tokens: numpy.array
+        :raises RuntimeError: the model blew up on the batch
+        :return: probabilities, one row per probe
+        :rtype: numpy.array
+        """
+        pending = Pending(tokens)
+        self.requests.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise RuntimeError(pending.error)
+        return pending.result
+
+    def gather(self):
+        """
+        Block on one request then grab what else comes in before the deadline.
+
+        :return: the batch
+        :rtype: list of Pending
+        """
+        batch = [self.requests.get()]
+        rows = len(batch[0].tokens)
+        deadline = time.time() + self.max_wait
+
+        while rows < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            rows += len(pending.tokens)
+
+        return batch
+
+    def run(self):
+        with self.graph.as_default(), self.session.as_default():
+            while True:
+                batch = self.gather()
+                try:
+                    tokens = np.concatenate([pending.tokens for pending in batch])
+                    predictions = self.model.predict_on_batch(tokens)
+                except Exception as err:
+                    logger.error("batch of {} failed: {}".format(len(batch), err))
+                    for pending in batch:
+                        pending.error = str(err)
+                        pending.done.set()
+                    continue
+
+                logger.debug("batch: {} requests {} rows".format(len(batch), len(tokens)))
+                start = 0
+                for pending in batch:
+                    pending.result = predictions[start:start + len(pending.tokens)]
+                    start += len(pending.tokens)
+                    pending.done.set()
+
+
+class Predictor(object):
+    """
+    Turns requests into encoded probes and probabilities into answers.
+
+    A request is a json object with one of
+        "probe": a cleaned probe string (as in the csv),
+        "raw": the spy tool output, cleaned here,
+        "tokens": a list of vocab indices,
+    or a list of them under "probes", "raws" or "tokens_list".
+    "k" picks how many guesses come back.
+    A run length encoded model takes "raw", or "tokens" as [index, run length] pairs.
+
+    :param batcher: the running batcher
+    :type batcher: Batcher
+    :param vocab: sorted vocab from dataset.read_vocab
+    :type vocab: list
+    :param input_len: probe length the model takes
+    :type input_len: int
+    :param target_dict: map between int and url
+    :type target_dict: dict
+    :param top_k: default number of guesses, defaults to TOP_K
+    :type top_k: int, optional
+    :param rle: the model takes run length encoded probes, defaults to False
+    :type rle: bool, optional
+    """
+    def __init__(self, batcher, vocab, input_len, target_dict, top_k=TOP_K, rle=False):
+        self.batcher = batcher
+        self.vocab = vocab
+        self.input_len = input_len
+        self.target_dict = target_dict
+        self.top_k = top_k
+        self.rle = rle
+
+    def encode(self, request):
+        """
+        Pull the probes out of a request.
+
+        :param request: the decoded request
+        :type request: dict
+        :raises ValueError: bad request
+        :return: encoded probes
+        :rtype: numpy.array
+        """
+        if 'tokens' in request or 'tokens_list' in request:
+            rows = request['tokens_list'] if 'tokens_list' in request else [request['tokens']]
+            tokens = np.array(rows, dtype=np.int64)
+            if tokens.ndim != (3 if self.rle else 2) or tokens.shape[1] < self.input_len:
+                raise ValueError("tokens must be rows of at least {} {}".format(self.input_len, "[index, run length] pairs" if self.rle else "indices"))
+            symbols = tokens[:, :, 0] if self.rle else tokens
+            if symbols.min() < 0 or symbols.max() >= len(self.vocab):
+                raise ValueError("tokens must be between 0 and {}".format(len(self.vocab) - 1))
+            if self.rle:
+                return np.clip(tokens[:, :self.input_len], 0, dataset.MAX_RUN).astype(dataset.RUN_DTYPE)
+            return tokens[:, :self.input_len].astype(dataset.TOKEN_DTYPE)
+
+        if self.rle:
+            return self.encode_runs(request)
+
+        if 'raw' in request or 'raws' in request:
+            raws = request['raws'] if 'raws' in request else [request['raw']]
+            probes = [clean_data.clean_probe(raw, self.input_len) for raw in raws]
+        elif 'probe' in request or 'probes' in request:
+            probes = request['probes'] if 'probes' in request else [request['probe']]
+        else:
+            raise ValueError("request needs one of probe, probes, raw, raws, tokens, tokens_list")
+
+        for probe in probes:
+            if len(probe) < self.input_len:
+                raise ValueError("probe is {} characters, needs {}".format(len(probe), self.input_len))
+
+        return dataset.encode(probes, self.vocab, self.input_len)
+
+    def encode_runs(self, request):
+        """
+        Run length encode the raw probes in a request.
+
+        :param request: the decoded request
+        :type request: dict
+        :raises ValueError: bad request
+        :return: symbols and run lengths, see dataset.stack_runs
+        :rtype: numpy.array
+        """
+        if 'raw' not in request and 'raws' not in request:
+            raise ValueError("run length encoded model needs raw, raws or tokens")
+
+        raws = request['raws'] if 'raws' in request else [request['raw']]
+        symbols = []
+        runs = []
+        for raw in raws:
+            probe_symbols, probe_runs = clean_data.rle_clean(raw)
+            if len(probe_runs) < self.input_len:
+                raise ValueError("probe is {} runs, needs {}".format(len(probe_runs), self.input_len))
+            symbols.append(probe_symbols[:self.input_len])
+            runs.append(probe_runs[:self.input_len])
+
+        return dataset.stack_runs(dataset.encode(symbols, self.vocab), dataset.encode_runs(runs))
+
+    def answer(self, request):
+        """
+        Run a request through the model.
+
+        :param request: the decoded request
+        :type request: dict
+        :return: the response, label and top k for every probe
+        :rtype: dict
+        """
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("request must be a json object")
+            k = int(request.get('k', self.top_k))
+            if k <= 0:
+                raise ValueError("k must be positive")
+            tokens = self.encode(request)
+            predictions = self.batcher.submit(tokens)
+        except (ValueError, TypeError, RuntimeError) as err:
+            return {'error': str(err)}
+
+        results = []
+        for prediction in predictions:
+            top = np.argsort(prediction)[::-1][:k]
+            results.append({
+                'label': int(top[0]),
+                'url': self.target_dict.get(int(top[0])),
+                'top_k': [{'label': int(i), 'url': self.target_dict.get(int(i)), 'prob': float(prediction[i])} for i in top]
+            })
+
+        return {'results': results}
+
+
+class UnixHandler(socketserver.StreamRequestHandler):
+    """
+    One json request per line, one json response per line.
+    """
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as err:
+                response = {'error': "bad json: {}".format(err)}
+            else:
+                response = self.server.predictor.answer(request)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    POST a json request, get a json response.
+    """
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as err:
+            response = {'error': "bad json: {}".format(err)}
+        else:
+            response = self.server.predictor.answer(request)
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(400 if 'error' in response else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("{} {}".format(self.address_string(), format % args))
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(predictor, socket_path=None, host='127.0.0.1', port=None):
+    """
+    Serve requests until interrupted. Each connection gets a thread,
+    they all feed the one batcher.
+
+    :param predictor: the predictor
+    :type predictor: Predictor
+    :param socket_path: unix socket to listen on, defaults to None
+    :type socket_path: str, optional
+    :param host: http address, defaults to '127.0.0.1'
+    :type host: str, optional
+    :param port: http port, defaults to None
+    :type port: int, optional
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixServer(socket_path, UnixHandler)
+        logger.info("listening on unix socket: {}".format(socket_path))
+    else:
+        server = ThreadingHTTPServer((host, port), HTTPHandler)
+        logger.info("listening on http://{}:{}".format(host, port))
+
+    server.predictor = predictor
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("shutting down")
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,268 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import logging
+import numpy as np
+
+import character_rnn as rnn
+import clean_data
+import dataset
+
+
+# init logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# format output
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+# configuration for console logging
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+# symbols fed to the model per step
+CHUNK = 25
+
+# confidence needed to stop early
+THRESHOLD = 0.9
+
+# thresholds the eval goes over
+THRESHOLDS = [0.5, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+
+def load_streaming_model(checkpoint_dir, batch_size=1, cpu=False):
+    """
+    Load a gru checkpoint as a stateful model. The GRU state is kept between
+    calls so a trace can be handed over a chunk at a time, call
+    reset_states before starting on the next trace.
+
+    :param checkpoint_dir: checkpoint dir of a gru model
+    :type checkpoint_dir: str
+    :param batch_size: traces run side by side, defaults to 1
+    :type batch_size: int, optional
+    :param cpu: use the cpu GRU, defaults to False
+    :type cpu: bool, optional
+    :raises ValueError: the checkpoint is not a plain gru model
+    :return: the model
+    """
+    if rnn.checkpoint_model_type(checkpoint_dir) != 'gru':
+        raise ValueError("only gru checkpoints can be streamed")
+    if rnn.checkpoint_is_rle(checkpoint_dir):
+        raise ValueError("run length encoded checkpoints can not be streamed")
+
+    model, _ = rnn.load_model(checkpoint_dir, rnn.checkpoint_vocab_len(checkpoint_dir), None, cpu,
+                              model_type='gru', rle=False, stateful=True, batch_size=batch_size)
+    return model
+
+
+class StreamingClassifier(object):
+    """
+    Classify one trace as it comes in.
+
+    Symbols are buffered until there is a chunk, the chunk goes through the
+    model and the guess is kept once its confidence passes the threshold.
+
+    :param model: from load_streaming_model with batch_size 1
+    :param threshold: confidence needed to stop, defaults to THRESHOLD
+    :type threshold: float, optional
+    :param chunk: symbols per step, defaults to CHUNK
+    :type chunk: int, optional
+    :param max_len: most symbols to look at, defaults to None (no limit)
+    :type max_len: int, optional
+    """
+    def __init__(self, model, threshold=THRESHOLD, chunk=CHUNK, max_len=None):
+        self.model = model
+        self.threshold = threshold
+        self.chunk = chunk
+        self.max_len = max_len
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the trace so far.
+        """
+        self.model.reset_states()
+        self.buffer = np.zeros(0, dtype=dataset.TOKEN_DTYPE)
+        self.consumed = 0
+        self.prediction = None
+
+    @property
+    def done(self):
+        if self.prediction is not None and self.prediction.max() >= self.threshold:
+            return True
+        return self.max_len is not None and self.consumed >= self.max_len
+
+    def step(self, tokens):
+        """
+        Run tokens through the model, the state carries on from the last step.
+
+        :param tokens: encoded symbols
+        :type tokens: numpy.array
+        """
+        self.prediction = self.model.predict_on_batch(tokens.reshape(1, -1))[0]
+        self.consumed += len(tokens)
+
+    def feed(self, tokens, flush=False):
+        """
+        Hand over the next encoded symbols.
+
+        :param tokens: encoded symbols
+        :type tokens: numpy.array
+        :param flush: run what is left even if it is short of a chunk, defaults to False
+        :type flush: bool, optional
+        :return: True once there is an answer
+        :rtype: bool
+        """
+        self.buffer = np.concatenate([self.buffer, np.asarray(tokens, dtype=dataset.TOKEN_DTYPE)])
+        if self.max_len is not None:
+            self.buffer = self.buffer[:self.max_len - self.consumed]
+
+        while not self.done and (len(self.buffer) >= self.chunk or (flush and len(self.buffer))):
+            self.step(self.buffer[:self.chunk])
+            self.buffer = self.buffer[self.chunk:]
+
+        return self.done
+
+    def result(self):
+        """
+        The guess so far.
+
+        :return: label, confidence, symbols consumed and whether the threshold was hit
+        :rtype: dict
+        """
+        if self.prediction is None:
+            return {'label': None, 'confidence': 0.0, 'consumed': 0, 'early': False}
+        label = int(np.argmax(self.prediction))
+        confidence = float(self.prediction[label])
+        return {'label': label, 'confidence': confidence, 'consumed': self.consumed, 'early': confidence >= self.threshold}
+
+
+def classify_raw(classifier, chunks, vocab):
+    """
+    Clean and classify a raw trace as it is read, stops reading once the
+    classifier has an answer.
+
+    :param classifier: a fresh (or reset) classifier
+    :type classifier: StreamingClassifier
+    :param chunks: the raw spy tool output in order
+    :type chunks: iterable of str
+    :param vocab: sorted vocab from dataset.read_vocab
+    :type vocab: list
+    :return: see StreamingClassifier.result
+    :rtype: dict
+    """
+    for piece in clean_data.clean_chunks(chunks, name='stream'):
+        if piece and classifier.feed(dataset.encode([piece], vocab)[0]):
+            return classifier.result()
+
+    classifier.feed([], flush=True)
+    return classifier.result()
+
+
+def chunk_predictions(model, data, chunk=CHUNK, batch_size=256):
+    """
+    Run the traces through a stateful model a chunk at a time and keep the
+    prediction after every chunk.
+
+    :param model: from load_streaming_model
+    :param data: encoded probes
+    :type data: numpy.array
+    :param chunk: symbols per step, defaults to CHUNK
+    :type chunk: int, optional
+    :param batch_size: the batch size the model was built with, defaults to 256
+    :type batch_size: int, optional
+    :return: predictions (probe, chunk, class) and symbols consumed after each chunk
+    :rtype: tuple
+    """
+    ends = np.arange(chunk, data.shape[1] + chunk, chunk).clip(max=data.shape[1])
+    predictions = []
+
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        rows = len(batch)
+        if rows < batch_size:
+            # stateful models only take full batches
+            batch = np.concatenate([batch, np.zeros((batch_size - rows,) + batch.shape[1:], dtype=batch.dtype)])
+
+        model.reset_states()
+        steps = []
+        begin = 0
+        for end in ends:
+            steps.append(model.predict_on_batch(batch[:, begin:end])[:rows])
+            begin = end
+        predictions.append(np.stack(steps, axis=1))
+
+    return np.concatenate(predictions), ends
+
+
+def early_exit(predictions, ends, threshold):
+    """
+    Where each trace would have stopped.
+
+    :param predictions: from chunk_predictions
+    :type predictions: numpy.array
+    :param ends: from chunk_predictions
+    :type ends: numpy.array
+    :param threshold: confidence needed to stop
+    :type threshold: float
+    :return: the guesses, symbols consumed and whether the threshold was hit for each trace
+    :rtype: tuple
+    """
+    confident = predictions.max(axis=2) >= threshold
+    early = confident.any(axis=1)
+    # first confident chunk, or the last one if it never got there
+    stop = np.where(early, confident.argmax(axis=1), len(ends) - 1)
+    rows = np.arange(len(predictions))
+    return predictions[rows, stop].argmax(axis=1), ends[stop], early
+
+
+def tradeoff(predictions, ends, labels, thresholds=THRESHOLDS):
+    """
+    Accuracy against symbols consumed over a range of thresholds.
+
+    :param predictions: from chunk_predictions
+    :type predictions: numpy.array
+    :param ends: from chunk_predictions
+    :type ends: numpy.array
+    :param labels: sparse labels
+    :type labels: numpy.array
+    :param thresholds: thresholds to try, defaults to THRESHOLDS
+    :type thresholds: list, optional
+    :return: one row per threshold, then the full trace
+    :rtype: list of dict
+    """
+    labels = np.asarray(labels).flatten()
+    report = []
+    for threshold in thresholds:
+        guesses, consumed, early = early_exit(predictions, ends, threshold)
+        report.append({
+            'threshold': threshold,
+            'accuracy': float(np.mean(guesses == labels)),
+            'mean_symbols': float(np.mean(consumed)),
+            'median_symbols': float(np.median(consumed)),
+            'early': float(np.mean(early))
+        })
+
+    report.append({
+        'threshold': None,
+        'accuracy': float(np.mean(predictions[:, -1].argmax(axis=1) == labels)),
+        'mean_symbols': float(ends[-1]),
+        'median_symbols': float(ends[-1]),
+        'early': 0.0
+    })
+    return report
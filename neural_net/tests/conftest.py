@@ -0,0 +1,57 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import os
+import random
+import sys
+
+import pytest
+
+
+# the modules import each other by name, same as data_center.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mod'))
+
+
+def random_probes(rng, count, alphabet='abc', min_len=0, max_len=8, labels=4):
+    """
+    Short probes over a small alphabet, so there are plenty of duplicates
+    and tied distances.
+
+    :return: (label, probe) tuples
+    :rtype: list of tuples
+    """
+    return [(rng.randrange(labels), ''.join(rng.choice(alphabet) for _ in range(rng.randint(min_len, max_len))))
+            for _ in range(count)]
+
+
+def brute_force(train_probes, test_probe):
+    """
+    Every distance in full, the first train probe wins a tie.
+
+    :return: label and distance
+    :rtype: tuple
+    """
+    import Levenshtein as lev
+    best = None
+    for label, probe in train_probes:
+        distance = lev.distance(probe, test_probe[1])
+        if best is None or distance < best[1]:
+            best = (label, distance)
+    return best
+
+
+@pytest.fixture
+def rng():
+    return random.Random(1234)
@@ -0,0 +1,82 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import os
+
+import Levenshtein as lev
+import pytest
+
+import lev_index
+import levenshtein_tools
+from conftest import brute_force, random_probes
+
+
+def k_nearest(train_probes, probe, k):
+    """
+    The k closest by a full scan, ties by position.
+    """
+    ranked = sorted((lev.distance(train, probe), position, label) for position, (label, train) in enumerate(train_probes))
+    return [(label, distance) for distance, _, label in ranked[:k]]
+
+
+@pytest.mark.parametrize('bucket_size', [1, 32])
+def test_nearest_matches_brute_force(rng, bucket_size):
+    for _ in range(50):
+        train_probes = random_probes(rng, rng.randint(1, 80), max_len=10)
+        tree = lev_index.BKTree(train_probes, bucket_size)
+        assert len(tree) == len(train_probes)
+        for test_probe in random_probes(rng, 10, max_len=10):
+            assert tree.nearest(test_probe) == brute_force(train_probes, test_probe)
+
+
+@pytest.mark.parametrize('bucket_size', [1, 32])
+@pytest.mark.parametrize('k', [2, 5])
+def test_query_k_matches_brute_force(rng, bucket_size, k):
+    for _ in range(30):
+        train_probes = random_probes(rng, rng.randint(1, 80), max_len=10)
+        tree = lev_index.BKTree(train_probes, bucket_size)
+        for _, probe in random_probes(rng, 10, max_len=10):
+            assert tree.query(probe, k) == k_nearest(train_probes, probe, k)
+
+
+def test_empty():
+    tree = lev_index.BKTree()
+    assert tree.query('abc') == []
+    assert tree.nearest((0, 'abc'))[0] == -1
+
+
+@pytest.mark.parametrize('bucket_size', [1, 32])
+def test_save_load_reorder(rng, tmpdir, bucket_size):
+    train_probes = random_probes(rng, 120, max_len=10)
+    path = lev_index.index_file(os.path.join(str(tmpdir), 'session.csv'))
+    lev_index.BKTree(train_probes, bucket_size).save(path)
+
+    # lev-eval reads session.csv back in its own order
+    reordered = list(train_probes)
+    rng.shuffle(reordered)
+    tree = lev_index.BKTree.load(path)
+    tree.reorder(reordered)
+
+    for test_probe in random_probes(rng, 60, max_len=10):
+        assert tree.nearest(test_probe) == levenshtein_tools.least_distance(reordered, test_probe)
+
+
+def test_reorder_rejects_other_probes(rng):
+    train_probes = random_probes(rng, 20)
+    tree = lev_index.BKTree(train_probes)
+    with pytest.raises(ValueError):
+        tree.reorder(train_probes[1:])
+    with pytest.raises(ValueError):
+        tree.reorder(train_probes[1:] + [(99, 'zzz')])
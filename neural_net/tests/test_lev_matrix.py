@@ -0,0 +1,104 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import os
+
+import Levenshtein as lev
+import numpy as np
+import pytest
+
+import lev_matrix
+import levenshtein_tools
+from conftest import random_probes
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # blocks that don't divide the probes evenly
+    monkeypatch.setattr(lev_matrix, 'BLOCK', 4)
+
+
+def full_matrix(probes):
+    return np.array([[lev.distance(one, two) for two in probes] for one in probes], dtype=lev_matrix.MATRIX_DTYPE)
+
+
+def test_matrix_matches_brute_force(rng, tmpdir, small_blocks):
+    probes = [probe for _, probe in random_probes(rng, 19, max_len=10)]
+    matrix = lev_matrix.distance_matrix(probes, os.path.join(str(tmpdir), 'matrix.npy'))
+    assert matrix.dtype == lev_matrix.MATRIX_DTYPE
+    np.testing.assert_array_equal(matrix, full_matrix(probes))
+
+
+def test_matrix_resumes(rng, tmpdir, monkeypatch, small_blocks):
+    probes = [probe for _, probe in random_probes(rng, 19, max_len=10)]
+    matrix_file = os.path.join(str(tmpdir), 'matrix.npy')
+    block = lev_matrix._block
+    calls = []
+
+    def interrupted(corner):
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        calls.append(corner)
+        return block(corner)
+
+    monkeypatch.setattr(lev_matrix, '_block', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        lev_matrix.distance_matrix(probes, matrix_file)
+    assert lev_matrix.read_done(matrix_file + lev_matrix.DONE_SUFFIX) == set(calls)
+
+    resumed = []
+
+    def counted(corner):
+        resumed.append(corner)
+        return block(corner)
+
+    monkeypatch.setattr(lev_matrix, '_block', counted)
+    matrix = lev_matrix.distance_matrix(probes, matrix_file)
+    np.testing.assert_array_equal(matrix, full_matrix(probes))
+    # 5 x 5 blocks, the upper triangle is 15 of them
+    assert not set(calls) & set(resumed)
+    assert len(calls) + len(resumed) == 15
+
+
+def test_matrix_starts_over_for_other_probes(rng, tmpdir, small_blocks):
+    matrix_file = os.path.join(str(tmpdir), 'matrix.npy')
+    probes = [probe for _, probe in random_probes(rng, 10)]
+    lev_matrix.distance_matrix(probes, matrix_file)
+
+    probes[3] += 'abc'
+    matrix = lev_matrix.distance_matrix(probes, matrix_file)
+    np.testing.assert_array_equal(matrix, full_matrix(probes))
+
+
+def test_classify_matches_least_distance(rng, tmpdir, small_blocks):
+    data = random_probes(rng, 40)
+    matrix = lev_matrix.distance_matrix([probe for _, probe in data], os.path.join(str(tmpdir), 'matrix.npy'))
+
+    rows = list(range(len(data)))
+    rng.shuffle(rows)
+    train_rows = [(data[row][0], row) for row in rows[:30]]
+    test_rows = [(data[row][0], row) for row in rows[30:]]
+    train_probes = [(label, data[row][1]) for label, row in train_rows]
+
+    for (test_probe, match, dist, _), (_, row) in zip(lev_matrix.classify(matrix, train_rows, test_rows), test_rows):
+        assert test_probe == (data[row][0], row)
+        assert (match, dist) == levenshtein_tools.least_distance(train_probes, data[row])
+
+
+def test_vote():
+    # most votes wins
+    assert lev_matrix.vote([1, 2, 2], [0, 1, 1]) == (2, 1)
+    # a tied count goes to the label with the closest neighbour
+    assert lev_matrix.vote([3, 1, 1, 3], [1, 2, 2, 4]) == (3, 1)
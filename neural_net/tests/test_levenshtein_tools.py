@@ -0,0 +1,95 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import Levenshtein as lev
+import pytest
+
+import levenshtein_tools
+from conftest import brute_force, random_probes
+
+
+@pytest.fixture(params=[True, False], ids=['score_cutoff', 'fallback'])
+def score_cutoff(request, monkeypatch):
+    if request.param and not levenshtein_tools.HAS_SCORE_CUTOFF:
+        pytest.skip("this Levenshtein has no score_cutoff")
+    monkeypatch.setattr(levenshtein_tools, 'HAS_SCORE_CUTOFF', request.param)
+    return request.param
+
+
+def test_bounded_distance(rng, score_cutoff):
+    for _ in range(500):
+        (_, one), (_, two) = random_probes(rng, 2)
+        cutoff = rng.randint(0, 8)
+        distance = lev.distance(one, two)
+        bounded = levenshtein_tools.bounded_distance(one, two, cutoff)
+        if distance <= cutoff:
+            assert bounded == distance
+        else:
+            assert bounded > cutoff
+
+
+def test_least_distance_matches_brute_force(rng, score_cutoff):
+    for _ in range(300):
+        train_probes = random_probes(rng, rng.randint(1, 30))
+        test_probe = random_probes(rng, 1)[0]
+        assert levenshtein_tools.least_distance(train_probes, test_probe) == brute_force(train_probes, test_probe)
+
+
+def test_least_distance_first_wins_ties(score_cutoff):
+    # all three are one edit away, the first one in the list wins
+    train_probes = [(7, 'abd'), (8, 'abe'), (9, 'abf')]
+    assert levenshtein_tools.least_distance(train_probes, (0, 'abc')) == (7, 1)
+    assert levenshtein_tools.least_distance(train_probes[::-1], (0, 'abc')) == (9, 1)
+    # an exact duplicate further down doesn't replace an exact match
+    assert levenshtein_tools.least_distance([(1, 'abc'), (2, 'abc')], (0, 'abc')) == (1, 0)
+
+
+def test_least_distance_empty():
+    assert levenshtein_tools.least_distance([], (0, 'abc'))[0] == -1
+
+
+@pytest.mark.parametrize('q', [1, 2, 3])
+def test_prefilter_bounds_are_lower_bounds(rng, q):
+    for _ in range(100):
+        train_probes = random_probes(rng, rng.randint(1, 30), alphabet='abcd', max_len=12)
+        prefilter = levenshtein_tools.Prefilter(train_probes, q)
+        # symbols the train probes never had go in the shared column
+        _, probe = random_probes(rng, 1, alphabet='abcde', max_len=12)[0]
+        bounds = prefilter.bounds(probe)
+        for bound, (_, train) in zip(bounds, train_probes):
+            assert 0 <= bound <= lev.distance(train, probe)
+
+
+@pytest.mark.parametrize('q', [1, 2, 3])
+def test_prefilter_nearest_matches_least_distance(rng, score_cutoff, q):
+    for _ in range(100):
+        train_probes = random_probes(rng, rng.randint(1, 30))
+        prefilter = levenshtein_tools.Prefilter(train_probes, q)
+        for test_probe in random_probes(rng, 5):
+            assert prefilter.nearest(test_probe) == levenshtein_tools.least_distance(train_probes, test_probe)
+
+
+def test_prefilter_stats(rng):
+    train_probes = random_probes(rng, 40)
+    prefilter = levenshtein_tools.Prefilter(train_probes, 2)
+    for test_probe in random_probes(rng, 10):
+        prefilter.nearest(test_probe)
+
+    stats = prefilter.take_stats()
+    assert stats['queries'] == 10
+    assert stats['candidates'] == 400
+    assert stats['kernel'] + stats['bound_pruned'] == stats['candidates']
+    assert stats['cutoff_pruned'] <= stats['kernel']
+    assert prefilter.take_stats()['queries'] == 0
@@ -0,0 +1,108 @@
+#  Copyright (C) 2020 Assured Information Security, Inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+import report
+
+
+# guesses are 0, 1, 1, 0, 2, 1
+PREDICTIONS = np.array([
+    [0.7, 0.2, 0.1],
+    [0.2, 0.5, 0.3],
+    [0.1, 0.8, 0.1],
+    [0.6, 0.3, 0.1],
+    [0.2, 0.2, 0.6],
+    [0.1, 0.6, 0.3],
+])
+LABELS = np.array([0, 0, 1, 1, 2, 2])
+
+
+def test_classification_report_by_hand():
+    results = report.classification_report(PREDICTIONS, LABELS, top_k=2)
+
+    assert results['rows'] == 6
+    assert results['accuracy'] == pytest.approx(0.5)
+    np.testing.assert_array_equal(results['confusion_matrix'], [[1, 1, 0], [1, 1, 0], [0, 1, 1]])
+    np.testing.assert_allclose(results['precision'], [1 / 2, 1 / 3, 1])
+    np.testing.assert_allclose(results['recall'], [1 / 2, 1 / 2, 1 / 2])
+    np.testing.assert_allclose(results['f1'], [1 / 2, 2 / 5, 2 / 3])
+    np.testing.assert_array_equal(results['support'], [2, 2, 2])
+    # only the second row has its label outside the best two
+    assert results['top_k_accuracy'] == pytest.approx(5 / 6)
+    assert results['loss'] == pytest.approx(-np.mean(np.log([0.7, 0.2, 0.8, 0.3, 0.6, 0.3])))
+
+
+def test_one_hot_and_int_labels_agree():
+    by_int = report.classification_report(PREDICTIONS, LABELS)
+    for labels in (np.eye(3)[LABELS], LABELS.reshape(-1, 1)):
+        other = report.classification_report(PREDICTIONS, labels)
+        assert other.keys() == by_int.keys()
+        for key in by_int:
+            np.testing.assert_array_equal(other[key], by_int[key])
+
+
+def test_class_never_seen_or_guessed():
+    predictions = np.array([[0.9, 0.1, 0.0], [0.2, 0.8, 0.0]])
+    results = report.classification_report(predictions, np.array([0, 0]))
+    np.testing.assert_allclose(results['precision'], [1, 0, 0])
+    np.testing.assert_allclose(results['recall'], [1 / 2, 0, 0])
+    np.testing.assert_allclose(results['f1'], [2 / 3, 0, 0])
+
+
+def test_top_k_ties():
+    predictions = np.array([[0.4, 0.4, 0.2]] * 3)
+    labels = np.array([0, 1, 2])
+    # a tie with the label doesn't push it out
+    assert report.top_k_accuracy(predictions, labels, 1) == pytest.approx(2 / 3)
+    assert report.top_k_accuracy(predictions, labels, 2) == pytest.approx(2 / 3)
+    assert report.top_k_accuracy(predictions, labels, 3) == pytest.approx(1)
+    # k past the number of classes is every class
+    assert report.top_k_accuracy(predictions, labels, 10) == pytest.approx(1)
+
+
+def test_top_k_matches_a_loop():
+    rng = np.random.RandomState(0)
+    predictions = rng.randint(0, 4, size=(200, 6)).astype(np.float64)
+    labels = rng.randint(0, 6, size=200)
+    for k in range(1, 7):
+        expected = np.mean([sum(p > p[label]) < k for p, label in zip(predictions, labels)])
+        assert report.top_k_accuracy(predictions, labels, k) == pytest.approx(expected)
+
+
+def test_confusion_matrix_rejects_unknown_classes():
+    with pytest.raises(ValueError, match='label 3'):
+        report.confusion_matrix(np.array([0, 3]), np.array([0, 1]), 3)
+    with pytest.raises(ValueError, match='guess -1'):
+        report.confusion_matrix(np.array([0, 1]), np.array([-1, 1]), 3)
+    with pytest.raises(ValueError):
+        report.classification_report(PREDICTIONS, np.array([0, 0, 1, 1, 2, 3]))
+
+
+def test_write_report(tmpdir):
+    report_file = os.path.join(str(tmpdir), 'eval.json')
+    csv_file = report.write_report(report.classification_report(PREDICTIONS, LABELS), report_file, {0: 'a.com', 2: 'c.com'})
+
+    with open(report_file) as f:
+        assert json.load(f)['confusion_matrix'] == [[1, 1, 0], [1, 1, 0], [0, 1, 1]]
+    with open(csv_file) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['url'] for row in rows] == ['a.com', '', 'c.com']
+    assert rows[1]['precision'] == '0.3333'